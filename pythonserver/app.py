@@ -1,21 +1,16 @@
 import traceback
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException ,Query
-from fastapi.responses import FileResponse
+import asyncio
+import json
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException ,Query, Request, Depends
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from services import *
 import os
-import base64
 from fastapi.responses import JSONResponse
 from typing import List
-from sentinelhub import SHConfig, SentinelHubRequest, MimeType, DataCollection, BBox, CRS
-import numpy as np
-import rasterio 
-from rasterio.transform import from_bounds
-import tempfile
-import shutil
+from sentinelhub import SHConfig, BBox, CRS
 import ee
 from pydantic import BaseModel, Field
-from EVALSCRIPTS import EVALSCRIPTS
 import logging
 
 
@@ -27,6 +22,9 @@ config = SHConfig()
 if CLIENT_ID and CLIENT_SECRET:
     config.sh_client_id = CLIENT_ID
     config.sh_client_secret = CLIENT_SECRET
+# Point at another Sentinel Hub deployment (or a local stand-in server for tests)
+config.sh_base_url = os.getenv("SH_BASE_URL", config.sh_base_url)
+config.sh_token_url = os.getenv("SH_TOKEN_URL", config.sh_token_url)
 
 
 
@@ -61,44 +59,483 @@ LOCAL_SAVE_DIR = "saved_tiffs"
 os.makedirs(LOCAL_SAVE_DIR, exist_ok=True)
 
 
+async def run_compute(kind: str, func, *args, **kwargs):
+    """Run a blocking service call in the compute pool for its operation class ("terrain" or "network")"""
+    try:
+        return await run_in_pool(kind, func, *args, **kwargs)
+    except ComputeBusyError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+@app.on_event("startup")
+async def startup_event():
+    # Workspaces of requests that never finished (killed worker, crash) are swept here
+    await asyncio.to_thread(sweep_workspaces)
+
+    # Earth Engine is initialized once here; endpoints retry if it was not available yet
+    try:
+        await run_in_pool("network", EE_CLIENT.initialize)
+    except Exception as e:
+        logger.warning(f"Earth Engine not available at startup: {e}")
+
+    # Background job workers; Sentinel Hub credentials are handed to every job
+    JOB_MANAGER.start(sh_config=config)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    JOB_MANAGER.shutdown()
+    shutdown_compute_pools()
+    shutdown_terrain_pool()
+
+
+@app.get("/compute/status")
+async def compute_status():
+    """Running and queued work per compute pool"""
+    return JSONResponse(content=compute_pool_status())
+
+
+async def ingest_upload(file: UploadFile, destination: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Stream an upload to destination in chunks; returns (sha256, size)"""
+    try:
+        return await save_upload(file, destination, max_bytes=max_bytes)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def check_response_mode(response_mode: str):
+    if response_mode not in RESPONSE_MODES:
+        raise HTTPException(status_code=400, detail=f"response_mode must be one of: {', '.join(RESPONSE_MODES)}")
+
+
+async def request_workspace():
+    """Private directory for one request's uploads and intermediate files, removed when the request ends"""
+    workspace = Workspace()
+    try:
+        yield workspace
+    finally:
+        await asyncio.to_thread(workspace.cleanup)
+
+
+async def memory_workspace():
+    """Private /vsimem/ directory for one request's in-memory intermediates, freed when the request ends"""
+    memory = MemoryWorkspace()
+    try:
+        yield memory
+    finally:
+        await asyncio.to_thread(memory.cleanup)
+
+
+async def save_aoi_input(upload: UploadFile, workspace: Workspace):
+    """Save an AOI upload to the workspace, keeping its extension so OGR recognizes the format"""
+    extension = os.path.splitext(upload.filename or "")[1].lower()
+    aoi_path = workspace.file("aoi" + (extension if extension in AOI_UPLOAD_EXTENSIONS else ".zip"))
+    await ingest_upload(upload, aoi_path)
+    return aoi_path
+
+
+async def save_dem_input(file: UploadFile = None, dataset_id: str = None, workspace: Workspace = None):
+    """Return a DEM path on disk, either from a registered dataset_id or by saving the uploaded file to the workspace"""
+    if dataset_id:
+        dem_path = find_dataset(dataset_id)
+        if dem_path is None:
+            raise HTTPException(status_code=404, detail=f"Unknown dataset_id: {dataset_id}")
+        return dem_path
+
+    if file is None:
+        raise HTTPException(status_code=400, detail="Provide either a DEM file or a dataset_id")
+
+    dem_path = workspace.file(file.filename) if workspace else upload_path(UPLOAD_FOLDER, file.filename)
+    await ingest_upload(file, dem_path)
+    return dem_path
+
+
+# How often the progress streams and the disconnect watcher look at an operation
+PROGRESS_POLL_SECONDS = 0.5
+# A progress stream may be opened before the request carrying its operation_id arrives
+PROGRESS_SUBSCRIBE_WAIT = 10.0
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+async def cancel_on_disconnect(request: Request, progress: OperationProgress):
+    """Cancel the operation as soon as the client goes away, so GDAL aborts and the worker is freed"""
+    while progress.state == "running":
+        if await request.is_disconnected():
+            PROGRESS.cancel(progress.id)
+            return
+        await asyncio.sleep(PROGRESS_POLL_SECONDS)
+
+
+async def operation_progress(request: Request, operation_id: str = Form(None)):
+    """Progress reporter for one synchronous request, streamed from /progress/{operation_id}"""
+    try:
+        progress = PROGRESS.start(operation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    watcher = asyncio.create_task(cancel_on_disconnect(request, progress))
+    failed = False
+    try:
+        yield progress
+    except Exception:
+        failed = True
+        raise
+    finally:
+        watcher.cancel()
+        PROGRESS.finish(progress, failed=failed)
+
+
+def raise_if_cancelled(progress: OperationProgress):
+    # 499 (client closed request): the work was abandoned, not failed
+    if progress.cancelled:
+        raise HTTPException(status_code=499, detail="Operation cancelled")
+
+
+def sse_event(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.get("/progress/{operation_id}")
+async def progress_events(request: Request, operation_id: str):
+    """Server-Sent Events stream of a synchronous operation's progress, ending with an `end` event.
+
+    Pass the same operation_id as a form field of the request to follow; operations are tracked
+    in the server process that runs them.
+    """
+    async def events():
+        progress, version = None, None
+        waited = idle = 0.0
+        while not await request.is_disconnected():
+            progress = progress or PROGRESS.get(operation_id)
+            if progress is None and waited >= PROGRESS_SUBSCRIBE_WAIT:
+                yield sse_event("error", {"error": f"Unknown operation_id: {operation_id}"})
+                return
+            if progress is not None and progress.version != version:
+                version = progress.version
+                snapshot = progress.snapshot()
+                yield sse_event("progress", snapshot)
+                idle = 0.0
+                if snapshot["state"] != "running":
+                    yield sse_event("end", snapshot)
+                    return
+            elif idle >= SSE_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            await asyncio.sleep(PROGRESS_POLL_SECONDS)
+            waited += PROGRESS_POLL_SECONDS
+            idle += PROGRESS_POLL_SECONDS
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/progress/{operation_id}/cancel")
+async def cancel_operation(operation_id: str):
+    """Abort a running synchronous operation; its request then fails with 499"""
+    progress = PROGRESS.cancel(operation_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Unknown operation_id: {operation_id}")
+    return JSONResponse(content=progress.snapshot())
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    """Queue an operation to run in the background worker pool.
+
+    Form fields: `operation` (see /jobs/operations), `params` as a JSON object, and the operation's
+    file inputs either as uploads or as registered dataset ids inside params.
+    """
+    form = await request.form()
+    operation = form.get("operation")
+    if operation not in JOB_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"operation must be one of: {', '.join(sorted(JOB_OPERATIONS))}")
+    spec = JOB_OPERATIONS[operation]
+
+    try:
+        params = json.loads(form.get("params") or "{}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"params must be a JSON object: {str(e)}")
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    try:
+        spec.check_params(params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Inputs are saved to the job's own workspace, removed once the job has run
+    workspace = Workspace(prefix="job")
+    try:
+        inputs = {}
+        for field, dataset_param, required in spec.inputs:
+            upload = form.get(field)
+            dataset_id = params.pop(dataset_param, None)
+            if upload is not None and not isinstance(upload, str):
+                inputs[field] = workspace.file(upload.filename)
+                await ingest_upload(upload, inputs[field])
+            elif dataset_id:
+                inputs[field] = find_dataset(dataset_id)
+                if inputs[field] is None:
+                    raise HTTPException(status_code=404, detail=f"Unknown {dataset_param}: {dataset_id}")
+            elif required:
+                raise HTTPException(status_code=400, detail=f"Provide either {field} or {dataset_param}")
+
+        job_id = JOB_MANAGER.submit(operation, params, inputs, workspace)
+    except Exception:
+        await asyncio.to_thread(workspace.cleanup)
+        raise
+
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "state": "queued", "status_url": f"/jobs/{job_id}"},
+        headers={"Location": f"/jobs/{job_id}"}
+    )
+
+
+@app.get("/jobs")
+async def list_jobs(state: str = Query(None), limit: int = Query(100, ge=1, le=1000)):
+    """Most recent jobs, optionally filtered by state"""
+    return JSONResponse(content={"jobs": JOB_MANAGER.list(state, limit)})
+
+
+@app.get("/jobs/operations")
+async def job_operations():
+    """Operations that can be queued, with their file inputs and parameters"""
+    return JSONResponse(content={name: spec.describe() for name, spec in sorted(JOB_OPERATIONS.items())})
+
+
+@app.get("/jobs/status")
+async def job_status():
+    """Job worker pool and queue counts"""
+    return JSONResponse(content=JOB_MANAGER.status())
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """State, progress and timings of a job; results of finished jobs carry download handles"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    job.pop("workspace", None)
+    job.pop("inputs", None)
+    return JSONResponse(content=job)
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Result of a succeeded job; outputs are fetched through /download with their handles"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if job["state"] != "succeeded":
+        return JSONResponse(
+            status_code=409,
+            content={"job_id": job_id, "state": job["state"], "error": job["error"]}
+        )
+    return JSONResponse(content=job["result"])
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    """Server-Sent Events stream of a job's state and progress, ending with an `end` event"""
+    if await asyncio.to_thread(JOB_MANAGER.get, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+
+    async def events():
+        last = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            job = await asyncio.to_thread(JOB_MANAGER.get, job_id)
+            if job is None:
+                yield sse_event("error", {"error": f"Job {job_id} was purged"})
+                return
+            snapshot = {field: job[field] for field in
+                        ("id", "operation", "state", "progress", "message", "cancel_requested", "error")}
+            if snapshot != last:
+                last = snapshot
+                idle = 0.0
+                yield sse_event("progress", snapshot)
+                if job["state"] in FINISHED_STATES:
+                    yield sse_event("end", snapshot)
+                    return
+            elif idle >= SSE_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            await asyncio.sleep(PROGRESS_POLL_SECONDS)
+            idle += PROGRESS_POLL_SECONDS
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or ask a running one to stop at its next progress report"""
+    job = JOB_MANAGER.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return JSONResponse(content={
+        "job_id": job_id,
+        "state": job["state"],
+        "cancel_requested": job["cancel_requested"]
+    })
+
+
+@app.post("/datasets")
+async def register_dataset_endpoint(file: UploadFile = File(...)):
+    """Upload a raster once and get a dataset_id usable by every terrain endpoint"""
+    try:
+        dataset_id, dataset_path, created = await register_dataset(file)
+        return JSONResponse(content={
+            "success": True,
+            "dataset_id": dataset_id,
+            "filename": file.filename,
+            "size": os.path.getsize(dataset_path),
+            "created": created
+        }, status_code=201 if created else 200)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Dataset registration failed: {str(e)}")
+
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss metrics and size"""
+    return JSONResponse(content=RESULT_CACHE.stats())
+
+
+@app.get("/cache/datasets")
+async def dataset_cache_stats():
+    """Open raster handle and decoded block cache metrics"""
+    return JSONResponse(content=DATASET_CACHE.stats())
+
+
+@app.get("/cache/aoi")
+async def aoi_cache_stats():
+    """Parsed AOI cache metrics"""
+    return JSONResponse(content=AOI_CACHE.stats())
+
+
+@app.get("/download")
+async def download(request: Request, file: str = Query(..., description="result handle")):
+    """Stream a result file with HTTP Range and ETag / If-None-Match support"""
+    try:
+        path = resolve_output_path(file, OUTPUT_FOLDER)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    size = os.path.getsize(path)
+    etag = file_etag(path)
+    media_type = media_type_for(path)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        try:
+            start, end = parse_byte_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+        )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file_range(path, 0, size - 1), media_type=media_type, headers=headers)
+
+
+@app.get("/tiles/{product_id}/{z}/{x}/{y}.{fmt}")
+async def tiles(
+    product_id: str,
+    z: int,
+    x: int,
+    y: int,
+    fmt: str,
+    colormap: str = Query(None, description="gray, slope, aspect, ndvi, diverging, thermal, lulc"),
+    vmin: float = Query(None),
+    vmax: float = Query(None)
+):
+    """XYZ web-mercator tile of a derived raster (hillshade, slope, NDVI, LST, LULC ...)"""
+    try:
+        content, media_type = await run_compute(
+            "terrain", tile_service, product_id, z, x, y,
+            fmt=fmt, colormap=colormap, vmin=vmin, vmax=vmax
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return Response(content=content, media_type=media_type, headers={"Cache-Control": "public, max-age=3600"})
+
 
 @app.post("/contours")
 async def contours(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
     interval: float = Form(20.0)
 ):
     """Generate contours as GeoJSON"""
-    temp_dem_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    with open(temp_dem_path, "wb") as buffer:
-        buffer.write(await file.read())
+    temp_dem_path = await save_dem_input(file, dataset_id, workspace)
 
-    output_geojson = os.path.join(UPLOAD_FOLDER, 'contours.geojson')
+    output_geojson = unique_output_path("contours", temp_dem_path, ".geojson", folder=OUTPUT_FOLDER)
 
-    result = generate_contours(temp_dem_path, output_geojson, interval)
+    response, status = await run_compute(
+        "terrain", cached_service, "contours", [temp_dem_path], {"interval": interval},
+        contour_service, temp_dem_path, output_geojson, interval, progress=progress
+    )
+    raise_if_cancelled(progress)
 
-    if result:
-        return FileResponse(output_geojson, filename="contours.geojson", media_type="application/geo+json")
+    if status == 200:
+        return FileResponse(response["output_path"], filename="contours.geojson", media_type="application/geo+json")
     raise HTTPException(status_code=500, detail="Contour generation failed")
 
 @app.post("/hillshade")
 async def hillshade(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     z_factor: float = Form(1.0),
     azimuth: float = Form(315.0),
     altitude: float = Form(45.0),
-    scale: float = Form(1.0)
+    scale: float = Form(1.0),
+    tiled: bool = Form(False),
+    response_mode: str = Form("base64", description="base64 or handle"),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Hillshade calculation endpoint with JSON + base64 output + stats"""
     try:
-        # Save uploaded DEM to disk
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await file.read())
+        check_response_mode(response_mode)
+
+        # Save uploaded DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
 
         # Run hillshade service
-        response, status = hillshade_service(
-            temp_dem_path, z_factor, azimuth, altitude, scale
+        response, status = await run_compute(
+            "terrain", cached_service, "hillshade", [temp_dem_path],
+            {"z_factor": z_factor, "azimuth": azimuth, "altitude": altitude, "scale": scale, "tiled": tiled},
+            hillshade_service, temp_dem_path, z_factor, azimuth, altitude, scale, tiled=tiled, progress=progress
         )
+        raise_if_cancelled(progress)
 
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error"))
@@ -106,11 +543,10 @@ async def hillshade(
         hillshade_path = response["hillshade_path"]
 
         # Compute statistics + histogram
-        stats, histogram = compute_hillshade_stats(hillshade_path)
+        stats, histogram = await run_compute("terrain", compute_hillshade_stats, hillshade_path)
 
-        # Encode file to base64
-        with open(hillshade_path, "rb") as hf:
-            file_b64 = base64.b64encode(hf.read()).decode("utf-8")
+        # Inline base64, or a handle to stream from /download
+        result_fields = await run_compute("terrain", raster_result, hillshade_path, response_mode)
 
         return JSONResponse(content={
             "success": True,
@@ -121,102 +557,92 @@ async def hillshade(
                 "scale": scale
             },
             "filename": os.path.basename(hillshade_path),
-            "file_base64": file_b64,
+            **result_fields,
             "stats": stats,
             "histogram": histogram
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
     
 @app.post("/aspect")
-async def aspect(file: UploadFile = File(...)):
+async def aspect(
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
+    tiled: bool = Form(False),
+    response_mode: str = Form("base64", description="base64 or handle"),
+    progress: OperationProgress = Depends(operation_progress),
+):
     """Aspect calculation endpoint"""
     try:
-        # Save uploaded file to disk
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        check_response_mode(response_mode)
+
+        # Save uploaded file to disk (or reuse a registered dataset)
+        file_path = await save_dem_input(file, dataset_id, workspace)
 
         # Call service with file path
-        response, status = aspect_service(file_path)
+        response, status = await run_compute("terrain", aspect_service, file_path, tiled=tiled, progress=progress)
+        raise_if_cancelled(progress)
 
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "Unknown error"))
 
         aspect_path = response["aspect_path"]
 
-        # Encode output TIFF to base64 (same as slope)
-        with open(aspect_path, "rb") as af:
-            file_b64 = base64.b64encode(af.read()).decode("utf-8")
+        # Inline base64, or a handle to stream from /download
+        result_fields = await run_compute("terrain", raster_result, aspect_path, response_mode)
 
         return JSONResponse(content={
             "success": True,
             "parameters": response.get("parameters", {}),
             "filename": os.path.basename(aspect_path),
-            "file_base64": file_b64
+            **result_fields,
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/slope")
 async def slope(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     slope_type: str = Form("degree"),
-    z_factor: float = Form(1.0)
+    z_factor: float = Form(1.0),
+    tiled: bool = Form(False),
+    response_mode: str = Form("base64", description="base64 or handle"),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     try:
-        # Save uploaded DEM
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        check_response_mode(response_mode)
+
+        # Save uploaded DEM (or reuse a registered dataset)
+        file_path = await save_dem_input(file, dataset_id, workspace)
 
         # Run slope service
-        response, status = slope_service(file_path, slope_format=slope_type, scale=z_factor)
+        response, status = await run_compute(
+            "terrain", cached_service, "slope", [file_path],
+            {"slope_format": slope_type, "scale": z_factor, "tiled": tiled},
+            slope_service, file_path, slope_format=slope_type, scale=z_factor, tiled=tiled, progress=progress
+        )
+        raise_if_cancelled(progress)
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error"))
 
         slope_path = response["slope_path"]
 
-        # ---- Open slope raster for stats + classification ----
-        with rasterio.open(slope_path) as src:
-            slope_data = src.read(1, masked=True).astype(float)
-
-        # Statistics
-        stats = {
-            "min": float(np.nanmin(slope_data)),
-            "max": float(np.nanmax(slope_data)),
-            "mean": float(np.nanmean(slope_data))
-        }
-
-        # Classification ranges
-        classes = [
-            {"label": "Flat (0-2°)", "range": (0, 2), "color": "#00ff00"},
-            {"label": "Gentle (2-6°)", "range": (2, 6), "color": "#a8ff00"},
-            {"label": "Moderate (6-15°)", "range": (6, 15), "color": "#ffff00"},
-            {"label": "Steep (15-30°)", "range": (15, 30), "color": "#ff7f00"},
-            {"label": "Very Steep (>30°)", "range": (30, 9999), "color": "#ff0000"},
-        ]
-
-        class_stats = []
-        total_pixels = slope_data.count()
-
-        for cls in classes:
-            mask = (slope_data >= cls["range"][0]) & (slope_data < cls["range"][1])
-            count = int(mask.sum())
-            class_stats.append({
-                "label": cls["label"],
-                "count": count,
-                "percent": round((count / total_pixels) * 100, 2),
-                "color": cls["color"]
-            })
+        # ---- Stats + classification off the event loop ----
+        stats, class_stats = await run_compute("terrain", compute_slope_stats, slope_path)
 
-        # Encode slope raster to Base64
-        with open(slope_path, "rb") as sf:
-            file_b64 = base64.b64encode(sf.read()).decode("utf-8")
+        # Inline base64, or a handle to stream from /download
+        result_fields = await run_compute("terrain", raster_result, slope_path, response_mode)
 
         return JSONResponse(content={
             "success": True,
@@ -227,37 +653,48 @@ async def slope(
                 "classification": class_stats
             },
             "filename": os.path.basename(slope_path),
-            "file_base64": file_b64
+            **result_fields,
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @app.post("/tpi")
 async def tpi_endpoint(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     z_factor: float = Form(1.0),
-    scale: float = Form(1.0)
+    scale: float = Form(1.0),
+    tiled: bool = Form(False),
+    response_mode: str = Form("base64", description="base64 or handle"),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Generate TPI from DEM and return as base64 JSON"""
     try:
-        # Save uploaded DEM file
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await file.read())
+        check_response_mode(response_mode)
+
+        # Save uploaded DEM file (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
 
         # Run TPI service
-        response, status = tpi_service(temp_dem_path, z_factor, scale)
+        response, status = await run_compute(
+            "terrain", cached_service, "tpi", [temp_dem_path],
+            {"z_factor": z_factor, "scale": scale, "tiled": tiled},
+            tpi_service, temp_dem_path, z_factor, scale, tiled=tiled, progress=progress
+        )
+        raise_if_cancelled(progress)
 
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "TPI calculation failed"))
 
         output_path = response["output_path"]
 
-        # Encode the output TIFF to base64
-        with open(output_path, "rb") as of:
-            file_b64 = base64.b64encode(of.read()).decode("utf-8")
+        # Inline base64, or a handle to stream from /download
+        result_fields = await run_compute("terrain", raster_result, output_path, response_mode)
 
         return JSONResponse(content={
             "success": True,
@@ -266,25 +703,32 @@ async def tpi_endpoint(
                 "scale": scale
             }),
             "filename": os.path.basename(output_path),
-            "file_base64": file_b64
+            **result_fields,
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"TPI generation failed: {str(e)}")
 
 @app.post("/curvature")
 async def curvature_endpoint(
-    dem: UploadFile = File(...),
+    dem: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     z_factor: float = Form(1.0),
-    scale: float = Form(1.0)
+    scale: float = Form(1.0),
+    tiled: bool = Form(False),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Generate curvature from DEM"""
     try:
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, dem.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await dem.read())
+        temp_dem_path = await save_dem_input(dem, dataset_id, workspace)
 
-        response, status = curvature_service(temp_dem_path, z_factor, scale)
+        response, status = await run_compute(
+            "terrain", curvature_service, temp_dem_path, z_factor, scale, tiled=tiled, progress=progress
+        )
+        raise_if_cancelled(progress)
 
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "Curvature calculation failed"))
@@ -295,33 +739,42 @@ async def curvature_endpoint(
             media_type="image/tiff"
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Curvature generation failed: {str(e)}")
 
 @app.post("/roughness")
 async def roughness_service_endpoint(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     z_factor: float = Form(1.0),
-    scale: float = Form(1.0)
+    scale: float = Form(1.0),
+    tiled: bool = Form(False),
+    response_mode: str = Form("base64", description="base64 or handle"),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Generate roughness from DEM (JSON + base64 format)"""
     try:
-        # Save DEM to disk
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await file.read())
+        check_response_mode(response_mode)
+
+        # Save DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
 
         # Run roughness service
-        response, status = roughness_service(temp_dem_path, z_factor, scale)
+        response, status = await run_compute(
+            "terrain", roughness_service, temp_dem_path, z_factor, scale, tiled=tiled, progress=progress
+        )
+        raise_if_cancelled(progress)
 
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "Roughness calculation failed"))
 
         output_path = response["output_path"]
 
-        # Encode result TIFF to base64
-        with open(output_path, "rb") as rf:
-            file_b64 = base64.b64encode(rf.read()).decode("utf-8")
+        # Inline base64, or a handle to stream from /download
+        result_fields = await run_compute("terrain", raster_result, output_path, response_mode)
 
         return JSONResponse(content={
             "success": True,
@@ -330,16 +783,256 @@ async def roughness_service_endpoint(
                 "scale": scale
             },
             "filename": os.path.basename(output_path),
-            "file_base64": file_b64
+            **result_fields,
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Roughness generation failed: {str(e)}")
 
+@app.post("/terrain")
+async def terrain_endpoint(
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
+    products: str = Form(",".join(TERRAIN_PRODUCTS), description="comma separated: slope, aspect, hillshade, tpi, roughness, curvature"),
+    z_factor: float = Form(1.0),
+    scale: float = Form(1.0),
+    azimuth: float = Form(315.0),
+    altitude: float = Form(45.0),
+    slope_type: str = Form("degree"),
+    workers: int = Form(1),
+    progress: OperationProgress = Depends(operation_progress),
+):
+    """Compute several terrain products from a single pass over the DEM"""
+    try:
+        # Save DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
+
+        response, status = await run_compute(
+            "terrain",
+            terrain_service,
+            temp_dem_path,
+            products=products,
+            z_factor=z_factor,
+            scale=scale,
+            azimuth=azimuth,
+            altitude=altitude,
+            slope_format=slope_type,
+            workers=workers,
+            progress=progress
+        )
+        raise_if_cancelled(progress)
+
+        if status != 200:
+            raise HTTPException(status_code=status, detail=response.get("error", "Terrain calculation failed"))
+
+        return JSONResponse(content={
+            "success": True,
+            "parameters": response["parameters"],
+            "products": {
+                product: {
+                    "filename": os.path.basename(path),
+                    "download_url": response["download_urls"][product]
+                }
+                for product, path in response["outputs"].items()
+            }
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Terrain generation failed: {str(e)}")
+
+@app.post("/band_math")
+async def band_math_endpoint(
+    expression: str = Form(..., description="e.g. (b2 - b1) / (b2 + b1); bN is the N-th input"),
+    bands: List[UploadFile] = File(None, description="input rasters, b1, b2, ... in upload order"),
+    dataset_ids: str = Form(None, description="comma separated registered datasets, numbered after the uploads"),
+    reference: int = Form(None, description="input whose grid the output uses; default: the finest resolution"),
+    resampling: str = Form("bilinear", description="resampling of inputs on another grid"),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
+):
+    """Evaluate a band-math expression block by block over N rasters, aligned on the fly"""
+    try:
+        input_paths = []
+        for band in bands or []:
+            path = workspace.file(band.filename)
+            await ingest_upload(band, path)
+            input_paths.append(path)
+        for dataset_id in (dataset_ids or "").split(","):
+            if dataset_id.strip():
+                input_paths.append(await save_dem_input(None, dataset_id.strip(), workspace))
+        if not input_paths:
+            raise HTTPException(status_code=400, detail="Provide input rasters as bands uploads or dataset_ids")
+
+        response, status = await run_compute(
+            "terrain", cached_service, "band_math", input_paths,
+            {"expression": expression, "reference": reference, "resampling": resampling},
+            band_math_service, input_paths, expression, reference=reference, resampling=resampling,
+            progress=progress
+        )
+        raise_if_cancelled(progress)
+
+        if status != 200:
+            raise HTTPException(status_code=status, detail=response.get("error", "Band math failed"))
+
+        return FileResponse(
+            path=response["output_path"],
+            filename=os.path.basename(response["output_path"]),
+            media_type="image/tiff",
+            headers={"X-Product-Id": os.path.basename(response["output_path"])}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Band math failed: {str(e)}")
+
+
+@app.post("/scene_indices")
+async def scene_indices_endpoint(
+    scene: UploadFile = File(None, description="multi-band GeoTIFF, or ZIP of single-band files"),
+    dataset_id: str = Form(None, description="registered multi-band raster instead of an upload"),
+    band_roles: str = Form(..., description="red=4,nir=5 (band numbers) or red=B4,nir=B5 (ZIP file names); JSON also accepted"),
+    indices: str = Form("ndvi,ndwi,ndbi", description=f"comma separated: {', '.join(SPECTRAL_INDICES)}"),
+    output: str = Form("multiband", description="multiband: one COG with a band per index, files: one COG per index"),
+    reflectance_scale: float = Form(1.0, description="multiplier from stored values to reflectance, e.g. 0.0001"),
+    reflectance_offset: float = Form(0.0),
+    resampling: str = Form("bilinear", description="resampling of bands on another grid"),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
+):
+    """Compute many spectral indices from one scene, reading each source band once"""
+    try:
+        if output not in SCENE_OUTPUTS:
+            raise HTTPException(status_code=400, detail=f"output must be one of: {', '.join(SCENE_OUTPUTS)}")
+        if scene is None and not dataset_id:
+            raise HTTPException(status_code=400, detail="Provide either a scene file or a dataset_id")
+        scene_path = await save_dem_input(scene, dataset_id, workspace)
+        try:
+            roles = parse_band_roles(band_roles)
+            sources = await run_compute("terrain", scene_sources, scene_path, roles, workspace.subdir("scene"))
+        except BandMathError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        options = {
+            "reflectance_scale": reflectance_scale,
+            "reflectance_offset": reflectance_offset,
+            "resampling": resampling
+        }
+        if output == "multiband":
+            response, status = await run_compute(
+                "terrain", cached_service, "scene_indices", [scene_path],
+                {"band_roles": roles, "indices": indices, **options},
+                scene_indices_service, sources, indices, output, progress=progress, **options
+            )
+        else:
+            # Several outputs: not a single cacheable artifact
+            response, status = await run_compute(
+                "terrain", scene_indices_service, sources, indices, output, progress=progress, **options
+            )
+        raise_if_cancelled(progress)
+
+        if status != 200:
+            raise HTTPException(status_code=status, detail=response.get("error", "Index calculation failed"))
+
+        if output == "multiband":
+            return FileResponse(
+                path=response["output_path"],
+                filename=os.path.basename(response["output_path"]),
+                media_type="image/tiff",
+                headers={
+                    "X-Product-Id": os.path.basename(response["output_path"]),
+                    "X-Band-Names": ",".join(response["indices"])
+                }
+            )
+
+        return JSONResponse(content={
+            "success": True,
+            "indices": response["indices"],
+            "bands": response["bands"],
+            "metadata": response["metadata"],
+            "outputs": {
+                name: raster_result(path, "handle")["result"]
+                for name, path in response["outputs"].items()
+            }
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Index calculation failed: {str(e)}")
+
+
+@app.post("/zonal_stats")
+async def zonal_stats_endpoint(
+    zones: UploadFile = File(..., description="polygon layer: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    file: UploadFile = File(None, description="raster to summarize"),
+    dataset_id: str = Form(None),
+    product_id: str = Form(None, description="a raster this server produced or holds (slope, NDVI, LST, LULC ...)"),
+    histogram: str = Form("auto", description=f"per-zone histogram: {', '.join(ZONAL_HISTOGRAMS)}"),
+    output_format: str = Form("geojson", description="geojson: features with stats, csv: one row per feature"),
+    all_touched: bool = Form(False, description="count every pixel a polygon touches, not only those whose centre it covers"),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
+):
+    """Per-feature count/mean/min/max/std and histograms of a raster, joined to the polygon layer"""
+    try:
+        if output_format not in ZONAL_FORMATS:
+            raise HTTPException(status_code=400, detail=f"output_format must be one of: {', '.join(ZONAL_FORMATS)}")
+
+        if product_id:
+            try:
+                raster_path = resolve_tile_source(product_id)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except FileNotFoundError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+        else:
+            raster_path = await save_dem_input(file, dataset_id, workspace)
+        # The product name picks the "auto" histogram (ndvi_*, LST_*, LULC_* ...)
+        product_name = product_id or (file.filename if file is not None and not dataset_id else None)
+
+        zones_path = workspace.file(zones.filename or "zones.zip")
+        await ingest_upload(zones, zones_path)
+
+        response, status = await run_compute(
+            "terrain", cached_service, "zonal_stats", [raster_path, zones_path],
+            {"histogram": histogram, "output_format": output_format, "all_touched": all_touched,
+             "product_name": product_name},
+            zonal_stats_service, raster_path, zones_path, output_format=output_format, histogram=histogram,
+            all_touched=all_touched, product_name=product_name, progress=progress
+        )
+        raise_if_cancelled(progress)
+
+        if status != 200:
+            raise HTTPException(status_code=status, detail=response.get("error", "Zonal statistics failed"))
+
+        return FileResponse(
+            path=response["output_path"],
+            filename=os.path.basename(response["output_path"]),
+            media_type=media_type_for(response["output_path"]),
+            headers={
+                "X-Zone-Count": str(response["zones"]),
+                "X-Zones-With-Data": str(response["zones_with_data"])
+            }
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Zonal statistics failed: {str(e)}")
+
+
 @app.post("/ndvi")
 async def ndvi_endpoint(
     red_band: UploadFile = File(...),
-    nir_band: UploadFile = File(...)
+    nir_band: UploadFile = File(...),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Calculate NDVI from Red and NIR bands"""
     try:
@@ -347,18 +1040,20 @@ async def ndvi_endpoint(
         print(f"Received files - Red: {red_band.filename}, NIR: {nir_band.filename}")
         
         # Save uploaded files
-        red_path = os.path.join(UPLOAD_FOLDER, red_band.filename)
-        nir_path = os.path.join(UPLOAD_FOLDER, nir_band.filename)
+        red_path = workspace.file(red_band.filename)
+        nir_path = workspace.file(nir_band.filename)
         
         print(f"Saving files to: {red_path} and {nir_path}")
-        with open(red_path, "wb") as buffer:
-            buffer.write(await red_band.read())
-        with open(nir_path, "wb") as buffer:
-            buffer.write(await nir_band.read())
+        await ingest_upload(red_band, red_path)
+        await ingest_upload(nir_band, nir_path)
         print("Files saved successfully")
 
         print("Calling NDVI service...")
-        response, status = ndvi_service(red_path, nir_path)  # Fixed: Changed from ndbi_service to ndvi_service
+        response, status = await run_compute(
+            "terrain", cached_service, "ndvi", [red_path, nir_path], {},
+            ndvi_service, red_path, nir_path, progress=progress
+        )
+        raise_if_cancelled(progress)
         
         if status != 200:
             error_msg = response.get("error", "NDVI calculation failed")
@@ -372,6 +1067,8 @@ async def ndvi_endpoint(
             media_type="image/tiff"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Critical error in NDVI endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"NDVI generation failed: {str(e)}")
@@ -380,20 +1077,24 @@ async def ndvi_endpoint(
 @app.post("/ndwi")
 async def ndwi_endpoint(
     green_band: UploadFile = File(...),
-    nir_band: UploadFile = File(...)
+    nir_band: UploadFile = File(...),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Calculate NDWI from Green and NIR bands"""
     try:
         # Save uploaded files
-        green_path = os.path.join(UPLOAD_FOLDER, green_band.filename)
-        nir_path = os.path.join(UPLOAD_FOLDER, nir_band.filename)
+        green_path = workspace.file(green_band.filename)
+        nir_path = workspace.file(nir_band.filename)
         
-        with open(green_path, "wb") as buffer:
-            buffer.write(await green_band.read())
-        with open(nir_path, "wb") as buffer:
-            buffer.write(await nir_band.read())
+        await ingest_upload(green_band, green_path)
+        await ingest_upload(nir_band, nir_path)
 
-        response, status = ndbi_service(green_path, nir_path)
+        response, status = await run_compute(
+            "terrain", cached_service, "ndwi", [green_path, nir_path], {},
+            ndwi_service, green_path, nir_path, progress=progress
+        )
+        raise_if_cancelled(progress)
         
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "NDWI calculation failed"))
@@ -404,26 +1105,32 @@ async def ndwi_endpoint(
             media_type="image/tiff"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"NDWI generation failed: {str(e)}")
 
 @app.post("/ndbi")
 async def ndbi_endpoint(
     nir_band: UploadFile = File(...),
-    swir_band: UploadFile = File(...)
+    swir_band: UploadFile = File(...),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     """Calculate NDBI from NIR and SWIR bands"""
     try:
         # Save uploaded files
-        nir_path = os.path.join(UPLOAD_FOLDER, nir_band.filename)
-        swir_path = os.path.join(UPLOAD_FOLDER, swir_band.filename)
+        nir_path = workspace.file(nir_band.filename)
+        swir_path = workspace.file(swir_band.filename)
         
-        with open(nir_path, "wb") as buffer:
-            buffer.write(await nir_band.read())
-        with open(swir_path, "wb") as buffer:
-            buffer.write(await swir_band.read())
+        await ingest_upload(nir_band, nir_path)
+        await ingest_upload(swir_band, swir_path)
 
-        response, status = ndbi_service(nir_path, swir_path)
+        response, status = await run_compute(
+            "terrain", cached_service, "ndbi", [nir_path, swir_path], {},
+            ndbi_service, nir_path, swir_path, progress=progress
+        )
+        raise_if_cancelled(progress)
         
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "NDBI calculation failed"))
@@ -434,25 +1141,27 @@ async def ndbi_endpoint(
             media_type="image/tiff"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"NDBI generation failed: {str(e)}")
 
 
 @app.post("/elevation_point")
 async def elevation_point_endpoint(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
     longitude: float = Form(...),
     latitude: float = Form(...)
 ):
     """Get elevation at a specific coordinate"""
     try:
-        # Save DEM to disk
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await file.read())
+        # Save DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
 
         # Run service
-        response, status = elevation_point_service(temp_dem_path, longitude, latitude)
+        response, status = await run_compute("terrain", elevation_point_service, temp_dem_path, longitude, latitude)
         
         if status != 200:
             raise HTTPException(status_code=status, detail=response.get("error", "Elevation point query failed"))
@@ -467,29 +1176,106 @@ async def elevation_point_endpoint(
             "elevation": response.get("elevation")  # Assuming your service returns this key
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Elevation point query failed: {str(e)}")
 
+@app.post("/elevation_points")
+async def elevation_points_endpoint(
+    file: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
+    points: str = Form(None, description="JSON array of [lon, lat] pairs, CSV text or GeoJSON"),
+    points_file: UploadFile = File(None, description="CSV, JSON or GeoJSON file of points"),
+    points_format: str = Form("auto", description="auto, json, csv or geojson"),
+    interpolation: str = Form("nearest", description="nearest or bilinear")
+):
+    """Get elevations for many coordinates in one request"""
+    try:
+        if points is None and points_file is None:
+            raise HTTPException(status_code=400, detail="Provide either points or points_file")
+
+        # Save DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(file, dataset_id, workspace)
+
+        try:
+            if points is not None:
+                if len(points) > MAX_POINTS_BYTES:
+                    raise HTTPException(status_code=413, detail=f"points exceeds the {MAX_POINTS_BYTES} byte limit")
+                lons, lats = await run_compute("terrain", parse_points, points, points_format)
+            else:
+                # Streamed to the workspace in chunks, refused as soon as it is over the limit
+                points_path = workspace.file(points_file.filename)
+                await ingest_upload(points_file, points_path, max_bytes=MAX_POINTS_BYTES)
+                lons, lats = await run_compute("terrain", read_points, points_path, points_format)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid points: {str(e)}")
+
+        response, status = await run_compute(
+            "terrain", elevation_points_service, temp_dem_path, lons, lats, interpolation
+        )
+
+        if status != 200:
+            raise HTTPException(status_code=status, detail=response.get("error", "Elevation points query failed"))
+
+        return JSONResponse(content={
+            "success": True,
+            "parameters": {
+                "interpolation": interpolation,
+                "count": response["count"]
+            },
+            "valid_count": response["valid_count"],
+            "lons": response["lons"],
+            "lats": response["lats"],
+            "elevations": response["elevations"]
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Elevation points query failed: {str(e)}")
+
+PROFILE_FORMATS = ("records", "columnar", "binary")
+
+
 @app.post("/elevation_profile")
 async def elevation_profile_endpoint(
 
-    dem: UploadFile = File(...),
-    Longitude1: float = Form(...),
-    Latitude1: float = Form(...),
-    Longitude2: float = Form(...),
-    Latitude2: float = Form(...),
-    samples: int = Form(50)
+    dem: UploadFile = File(None),
+    dataset_id: str = Form(None),
+    workspace: Workspace = Depends(request_workspace),
+    Longitude1: float = Form(None),
+    Latitude1: float = Form(None),
+    Longitude2: float = Form(None),
+    Latitude2: float = Form(None),
+    path: str = Form(None, description="Polyline as a JSON array of [lon, lat] vertices or a GeoJSON LineString"),
+    samples: int = Form(50),
+    interpolation: str = Form("nearest", description="nearest or bilinear"),
+    response_format: str = Form("records", description="records, columnar or binary")
 ):
-    """Get elevation profile between two points"""
+    """Get elevation profile along a line between two points or a polyline"""
     try:
-        # Save DEM to disk
-        temp_dem_path = os.path.join(UPLOAD_FOLDER, dem.filename)
-        with open(temp_dem_path, "wb") as buffer:
-            buffer.write(await dem.read())
+        if response_format not in PROFILE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"response_format must be one of: {', '.join(PROFILE_FORMATS)}")
+
+        if path is not None:
+            try:
+                lons, lats = parse_points(path, "json")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid path: {str(e)}")
+            vertices = list(zip(lons.tolist(), lats.tolist()))
+        elif None not in (Longitude1, Latitude1, Longitude2, Latitude2):
+            vertices = [(Longitude1, Latitude1), (Longitude2, Latitude2)]
+        else:
+            raise HTTPException(status_code=400, detail="Provide either path or both start and end points")
+
+        # Save DEM to disk (or reuse a registered dataset)
+        temp_dem_path = await save_dem_input(dem, dataset_id, workspace)
 
         # Run elevation profile service
-        response, status = elevation_profile_service(
-            temp_dem_path, Longitude1, Latitude1, Longitude2, Latitude2, samples
+        response, status = await run_compute(
+            "terrain", elevation_profile_service, temp_dem_path, vertices, samples, interpolation
         )
 
         if status != 200:
@@ -497,18 +1283,36 @@ async def elevation_profile_endpoint(
                 status_code=status,
                 detail=response.get("error", "Elevation profile query failed")
             )
-        # Return in a consistent format
-        return JSONResponse(content={
+
+        columns = response["columns"]
+        if response_format == "binary":
+            return Response(
+                content=profile_binary(columns),
+                media_type="application/octet-stream",
+                headers={
+                    "X-Profile-Columns": ",".join(PROFILE_COLUMNS),
+                    "X-Profile-Count": str(response["count"]),
+                    "X-Profile-Dtype": "float64-le"
+                }
+            )
+
+        result = {
             "success": True,
             "parameters": {
-                "start_point": [Longitude1, Latitude1],
-                "end_point": [Longitude2, Latitude2],
-                "samples": samples
+                "vertices": [list(vertex) for vertex in vertices],
+                "samples": samples,
+                "interpolation": interpolation
             },
-            "profile": response.get("profile"),  # Assuming service returns a list of {distance, elevation}
-
-        })
+            "summary": response["summary"]
+        }
+        if response_format == "columnar":
+            result["columns"] = profile_lists(columns)
+        else:
+            result["profile"] = profile_records(columns)
+        return JSONResponse(content=result)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Elevation profile query failed: {str(e)}")
 
@@ -519,13 +1323,17 @@ async def get_index(
     time_start: str = Form(None, description="start date YYYY-MM-DD"),
     time_end: str = Form(None, description="end date YYYY-MM-DD"),
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP"),
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    resolution: float = Form(LANDSAT_RESOLUTION, description="target ground sample distance in metres"),
+    workspace: Workspace = Depends(request_workspace),
 ):
     service = service.lower()
+    if service not in LANDSAT_INDICES:
+        return {"error": f"service must be one of: {', '.join(LANDSAT_INDICES)}"}
 
     geometry = None
     bbox_sh = None
-    gdf = None
+    aoi = None
 
     # --- Option 1: BBOX ---
     if bbox:
@@ -537,80 +1345,45 @@ async def get_index(
         except Exception as e:
             return {"error": f"Invalid bbox: {str(e)}"}
 
-    # --- Option 2: Shapefile ZIP ---
+    # --- Option 2: AOI file ---
     elif zip_file:
         try:
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                f.write(await zip_file.read())
-            geometry, gdf = unzip_and_read_shapefile(tmp_zip.name)
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            geometry, aoi = await run_compute("terrain", unzip_and_read_shapefile, aoi_path)
         except Exception as e:
             return {"error": str(e)}
 
     else:
-        return {"error": "Provide either bbox or shapefile ZIP"}
+        return {"error": "Provide either bbox or an AOI file"}
 
-    # --- SentinelHub Request ---
+    # --- Landsat bands (cached) ---
     time_interval = (time_start, time_end) if time_start and time_end else None
 
-    sh_request = SentinelHubRequest(
-        evalscript=EVALSCRIPTS[service],
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.LANDSAT_OT_L2,
-                time_interval=time_interval
-            )
-        ],
-        responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+    # Bands are fetched once per AOI and time interval, the index is computed locally
+    data = await run_compute(
+        "network", landsat_index_data, config, service,
         bbox=bbox_sh if bbox_sh else None,
         geometry=geometry if geometry else None,
-        size=(512, 512),
-        config=config
+        time_interval=time_interval,
+        resolution=resolution
     )
 
-    data = sh_request.get_data()[0]
-
-    # Temporary file for API response
-    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".tiff")
-
     # --- Fix: Correct bbox coords ---
     if bbox_sh:
-        bbox_coords = [bbox_sh.min_x, bbox_sh.min_y, bbox_sh.max_x, bbox_sh.max_y]
-        transform = from_bounds(*bbox_coords, data.shape[1], data.shape[0])
+        bounds = [bbox_sh.min_x, bbox_sh.min_y, bbox_sh.max_x, bbox_sh.max_y]
     else:
-        bounds = gdf.total_bounds
-        transform = from_bounds(*bounds, data.shape[1], data.shape[0])
-
-    # Write TIFF (temporary file)
-    with rasterio.open(
-        tmp_file.name,
-        "w",
-        driver="GTiff",
-        height=data.shape[0],
-        width=data.shape[1],
-        count=1,
-        dtype=data.dtype,
-        crs="EPSG:4326",
-        transform=transform,
-    ) as dst:
-        dst.write(data, 1)
-
-    # Save permanently in local folder
-    local_file_path = os.path.join(LOCAL_SAVE_DIR, f"{service}.tiff")
-    with rasterio.open(
-        local_file_path,
-        "w",
-        driver="GTiff",
-        height=data.shape[0],
-        width=data.shape[1],
-        count=1,
-        dtype=data.dtype,
-        crs="EPSG:4326",
-        transform=transform,
-    ) as dst:
-        dst.write(data, 1)
+        bounds = list(aoi.bounds)
+
+    # Save permanently in local folder as a COG, under a name of its own
+    local_file_path = unique_output_path(service, ext=".tiff", folder=LOCAL_SAVE_DIR)
+    await run_compute("terrain", write_index_raster, data, bounds, local_file_path)
 
-    return FileResponse(tmp_file.name, media_type="image/tiff", filename=f"{service}.tiff")
+    return FileResponse(
+        local_file_path,
+        media_type="image/tiff",
+        filename=f"{service}.tiff",
+        headers={"X-Product-Id": os.path.basename(local_file_path)}
+    )
 
 
 @app.post("/landsat_indices_statistics")
@@ -619,13 +1392,17 @@ async def get_index_statistics(
     time_start: str = Form(None, description="start date YYYY-MM-DD"),
     time_end: str = Form(None, description="end date YYYY-MM-DD"),
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP"),
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    resolution: float = Form(LANDSAT_RESOLUTION, description="target ground sample distance in metres"),
+    workspace: Workspace = Depends(request_workspace),
 ):
     service = service.lower()
+    if service not in LANDSAT_INDICES:
+        return {"error": f"service must be one of: {', '.join(LANDSAT_INDICES)}"}
 
     geometry = None
     bbox_sh = None
-    gdf = None
+    aoi = None
 
     # --- Option 1: BBOX ---
     if bbox:
@@ -637,98 +1414,36 @@ async def get_index_statistics(
         except Exception as e:
             return JSONResponse(content={"error": f"Invalid bbox: {str(e)}"}, status_code=400)
 
-    # --- Option 2: Shapefile ZIP ---
+    # --- Option 2: AOI file ---
     elif zip_file:
         try:
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                f.write(await zip_file.read())
-            geometry, gdf = unzip_and_read_shapefile(tmp_zip.name)
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            geometry, aoi = await run_compute("terrain", unzip_and_read_shapefile, aoi_path)
         except Exception as e:
             return JSONResponse(content={"error": str(e)}, status_code=400)
 
     else:
-        return JSONResponse(content={"error": "Provide either bbox or shapefile ZIP"}, status_code=400)
+        return JSONResponse(content={"error": "Provide either bbox or an AOI file"}, status_code=400)
 
-    # --- SentinelHub Request ---
+    # --- Landsat bands (cached) ---
     time_interval = (time_start, time_end) if time_start and time_end else None
 
-    sh_request = SentinelHubRequest(
-        evalscript=EVALSCRIPTS[service],
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.LANDSAT_OT_L2,
-                time_interval=time_interval
-            )
-        ],
-        responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+    # Bands are fetched once per AOI and time interval, the index is computed locally
+    data = await run_compute(
+        "network", landsat_index_data, config, service,
         bbox=bbox_sh if bbox_sh else None,
         geometry=geometry if geometry else None,
-        size=(512, 512),
-        config=config
+        time_interval=time_interval,
+        resolution=resolution
     )
 
-    data = sh_request.get_data()[0]
-
-    # --- Compute transform ---
-    if bbox_sh:
-        bbox_coords = [bbox_sh.min_x, bbox_sh.min_y, bbox_sh.max_x, bbox_sh.max_y]
-        total_area_m2 = (bbox_sh.max_x - bbox_sh.min_x) * (bbox_sh.max_y - bbox_sh.min_y) * (111320**2)
-    else:
-        bounds = gdf.total_bounds
-        total_area_m2 = (bounds[2] - bounds[0]) * (bounds[3] - bounds[1]) * (111320**2)
-
     # --- Compute statistics ---
-    pixel_area_m2 = (total_area_m2 / data.size)
-    pixel_area_km2 = pixel_area_m2 / 1e6
-
-    mean_val = float(np.nanmean(data))
-    min_val = float(np.nanmin(data))
-    max_val = float(np.nanmax(data))
-
-    # Optional: define thresholds for index classes
-    if service == "ndvi":
-        CLASSES = {
-            "Low": (-1, 0.2),
-            "Medium": (0.2, 0.5),
-            "High": (0.5, 1.0)
-        }
-    elif service == "ndwi":
-        CLASSES = {
-            "Low": (-1, 0),
-            "Medium": (0, 0.3),
-            "High": (0.3, 1.0)
-        }
-    elif service == "ndbi":
-        CLASSES = {
-            "Low": (-1, 0),
-            "Medium": (0, 0.2),
-            "High": (0.2, 1.0)
-        }
+    if bbox_sh:
+        bounds = [bbox_sh.min_x, bbox_sh.min_y, bbox_sh.max_x, bbox_sh.max_y]
     else:
-        CLASSES = {}
-
-    class_stats = []
-    for cls, (low, high) in CLASSES.items():
-        mask = (data >= low) & (data < high)
-        count = int(np.count_nonzero(mask))
-        if count == 0:
-            continue
-        class_stats.append({
-            "class_name": cls,
-            "pixel_count": count,
-            "area_km2": round(count * pixel_area_km2, 2),
-            "percentage": round((count / data.size) * 100, 2)
-        })
+        bounds = list(aoi.bounds)
 
-    result = {
-        "mean": round(mean_val, 4),
-        "min": round(min_val, 4),
-        "max": round(max_val, 4),
-        "pixel_area_km2": round(pixel_area_km2, 4),
-        "total_area_km2": round(pixel_area_km2 * data.size, 2),
-        "classes": class_stats
-    }
+    result = await run_compute("terrain", index_statistics, data, service, bounds)
 
     return JSONResponse(content=result, status_code=200)
 
@@ -742,13 +1457,15 @@ async def download_lst(
     time_start: str = Form(...),
     time_end: str = Form(...),
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP")
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     try:
-        LSTDataDownloader.initialize_earth_engine()
+        await run_compute("network", LSTDataDownloader.initialize_earth_engine)
 
         region = None
-        shp_path = None
+        cutline = None
         scale=1000
         
 
@@ -761,39 +1478,39 @@ async def download_lst(
 
         # Option 2: shapefile
         elif zip_file:
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                shutil.copyfileobj(zip_file.file, f)
-            region, shp_path = unzip_and_read_shapefile_ee(tmp_zip.name)
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            region, cutline = await run_compute("terrain", unzip_and_read_shapefile_ee, aoi_path)
         else:
-            return {"error": "Provide either bbox or shapefile ZIP"}
+            return {"error": "Provide either bbox or an AOI file"}
 
-        # Download LST
-        tiff_path = LSTDataDownloader.download_lst_single(
-            start_date=time_start, end_date=time_end, region=region, scale=scale
+        # Download LST into the request workspace
+        tiff_path = await run_compute(
+            "network", LSTDataDownloader.download_lst_single, start_date=time_start, end_date=time_end, region=region,
+            scale=scale, output_path=workspace.file("LST.tif"), progress=progress.span(0.0, 0.8)
         )
 
-        folder = "LST_data"
-        os.makedirs(folder, exist_ok=True)
-        output_tiff = os.path.join(folder, "LST_clipped.tif")
+        # Published under a unique name so concurrent requests never share it
+        output_tiff = unique_output_path("LST_clipped", ext=".tif", folder="LST_data")
 
-        if shp_path:
-            clip_raster_gdal(tiff_path, output_tiff, shapefile=shp_path)
+        if cutline:
+            await run_compute(
+                "terrain", clip_raster_gdal, tiff_path, output_tiff, shapefile=cutline,
+                progress=progress.span(0.8, 1.0)
+            )
         else:
-            shutil.copy2(tiff_path, output_tiff)
-
-        try:
-            if os.path.exists(tiff_path):
-                os.remove(tiff_path)
-        except:
-            pass
+            publish(tiff_path, output_tiff)
 
         return FileResponse(
             path=output_tiff,
             filename="LST_clipped.tif",
-            media_type="image/tiff"
+            media_type="image/tiff",
+            headers={"X-Product-Id": os.path.basename(output_tiff)}
         )
 
+    except HTTPException:
+        raise
+    except OperationCancelled:
+        raise HTTPException(status_code=499, detail="Operation cancelled")
     except Exception as e:
         import traceback
         logger.error(f"DEBUG ERROR:\n{traceback.format_exc()}")
@@ -805,14 +1522,23 @@ async def lst_statistics(
     time_start: str = Form(...),
     time_end: str = Form(...),
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP"),
-    
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    mode: str = Form("server", description="server: reduce on Earth Engine, local: download and clip"),
+    pipeline: str = Form("memory", description="local mode: memory keeps the download and clip in /vsimem, disk writes them to the request workspace"),
+    workspace: Workspace = Depends(request_workspace),
+    memory: MemoryWorkspace = Depends(memory_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     try:
-        LSTDataDownloader.initialize_earth_engine()
+        if mode not in STATS_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(STATS_MODES)}")
+        if pipeline not in PIPELINE_MODES:
+            raise HTTPException(status_code=400, detail=f"pipeline must be one of: {', '.join(PIPELINE_MODES)}")
+
+        await run_compute("network", LSTDataDownloader.initialize_earth_engine)
 
         region = None
-        shp_path = None
+        cutline = None
         scale=1000
 
 
@@ -822,81 +1548,57 @@ async def lst_statistics(
                 return {"error": "bbox must be minX,minY,maxX,maxY"}
             region = ee.Geometry.Rectangle(coords)
         elif zip_file:
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                shutil.copyfileobj(zip_file.file, f)
-            region, shp_path = unzip_and_read_shapefile_ee(tmp_zip.name)
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            region, cutline = await run_compute("terrain", unzip_and_read_shapefile_ee, aoi_path)
         else:
-            return {"error": "Provide either bbox or shapefile ZIP"}
+            return {"error": "Provide either bbox or an AOI file"}
+
+        # --- Server-side reduction: only the numbers come back ---
+        if mode == "server":
+            summary, stats_classes = await run_compute(
+                "network", LSTDataDownloader.lst_statistics_server, time_start, time_end, region, scale
+            )
+            return JSONResponse(content={
+                "lst_statistics": {
+                    "summary": summary,
+                    "classes": stats_classes
+                }
+            })
 
-        # --- Download TIFF ---
-        tiff_path = LSTDataDownloader.download_lst_single(
-            start_date=time_start, end_date=time_end, region=region, scale=scale
+        # --- Local path: download, clip strictly to the polygon and scan ---
+        # memory: download and clip stay in /vsimem (the clip is a VRT read by the scan), disk: the
+        # request workspace; either is removed when the request ends
+        memory = memory if pipeline == "memory" else None
+        tiff_path = await run_compute(
+            "network", LSTDataDownloader.download_lst_single, start_date=time_start, end_date=time_end, region=region,
+            scale=scale, output_path=workspace.file("LST.tif"), progress=progress.span(0.0, 0.8), memory=memory
         )
 
-        output_tiff = os.path.join(tempfile.gettempdir(), "LST_clipped.tif")
-        if shp_path:
-            clip_raster_gdal(tiff_path, output_tiff, shapefile=shp_path)
+        if cutline:
+            output_tiff = memory.file("LST_clipped.vrt") if memory else workspace.file("LST_clipped.tif")
+            await run_compute(
+                "terrain", clip_raster_gdal, tiff_path, output_tiff, shapefile=cutline,
+                progress=progress.span(0.8, 1.0)
+            )
         else:
-            shutil.copy2(tiff_path, output_tiff)
+            output_tiff = tiff_path
 
-        try:
-            if os.path.exists(tiff_path):
-                os.remove(tiff_path)
-        except:
-            pass
-
-        # --- Read raster and compute statistics ---
-        with rasterio.open(output_tiff) as src:
-            data = src.read(1).astype(float)
-            total_pixels = data.size
-            pixel_area_m2 = scale * scale
-            pixel_area_km2 = pixel_area_m2 / 1e6
-
-            mean_val = float(np.nanmean(data))
-            min_val = float(np.nanmin(data))
-            max_val = float(np.nanmax(data))
-
-        # Temperature classes in °C
-        TEMP_CLASSES = {
-            "Very Cold": (-999, 0),
-            "Cold": (0, 10),
-            "Mild": (10, 20),
-            "Hot": (20, 30),
-            "Extreme": (30, 999),
-        }
-
-        stats_classes = []
-        for class_name, (low, high) in TEMP_CLASSES.items():
-            mask = (data >= low) & (data < high)
-            count = int(np.count_nonzero(mask))
-            if count == 0:
-                continue
-            stats_classes.append({
-                "class_name": class_name,
-                "pixel_count": count,
-                "area_km2": round(count * pixel_area_km2, 2),
-                "percentage": round((count / total_pixels) * 100, 2)
-            })
-
-        try:
-            if os.path.exists(output_tiff):
-                os.remove(output_tiff)
-        except:
-            pass
+        # --- Scan raster once for statistics and temperature classes ---
+        summary, stats_classes = await run_compute(
+            "terrain", LSTDataDownloader.lst_statistics_local, output_tiff, scale
+        )
 
         return JSONResponse(content={
             "lst_statistics": {
-                "summary": {
-                    "mean_celsius": round(mean_val, 2),
-                    "min_celsius": round(min_val, 2),
-                    "max_celsius": round(max_val, 2),
-                    "area_km2": round(total_pixels * pixel_area_km2, 2)
-                },
+                "summary": summary,
                 "classes": stats_classes
             }
         })
 
+    except HTTPException:
+        raise
+    except OperationCancelled:
+        raise HTTPException(status_code=499, detail="Operation cancelled")
     except Exception as e:
         import traceback
         logger.error(f"DEBUG ERROR:\n{traceback.format_exc()}")
@@ -907,14 +1609,16 @@ lulc_downloader = LULCDataDownloader()
 @app.post("/download_lulc")
 async def download_lulc(
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP"),
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    workspace: Workspace = Depends(request_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     try:
         # Initialize Earth Engine
-        LULCDataDownloader.initialize_earth_engine()
+        await run_compute("network", LULCDataDownloader.initialize_earth_engine)
         
         region = None
-        shp_path = None
+        cutline = None
         bbox_coords = None
 
         # Option 1: bbox
@@ -927,42 +1631,41 @@ async def download_lulc(
         # Option 2: shapefile
         elif zip_file:
             # Save uploaded file temporarily
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                shutil.copyfileobj(zip_file.file, f)
-            region, shp_path = unzip_and_read_shapefile_ee(tmp_zip.name)
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            region, cutline = await run_compute("terrain", unzip_and_read_shapefile_ee, aoi_path)
         else:
-            return {"error": "Provide either bbox or shapefile ZIP"}
-
-        # Step 1: Download clipped LULC from EE
-        tiff_path = LULCDataDownloader.download_lulc_single(region=region)
-        folder="LULC_data"
-        os.makedirs(folder, exist_ok=True)
-        # Step 2: Create output path
-        output_tiff = os.path.join(folder, "LULC_clipped.tif")
+            return {"error": "Provide either bbox or an AOI file"}
+
+        # Step 1: Download clipped LULC from EE into the request workspace
+        tiff_path = await run_compute(
+            "network", LULCDataDownloader.download_lulc_single, region=region, output_path=workspace.file("LULC.tif"),
+            progress=progress.span(0.0, 0.8)
+        )
+        # Step 2: Create output path, unique so concurrent requests never share it
+        output_tiff = unique_output_path("LULC_clipped", ext=".tif", folder="LULC_data")
         
         # Step 3: Clip using GDAL (if shapefile provided for precise clipping)
-        if shp_path:
-            clip_raster_gdal(tiff_path, output_tiff, shapefile=shp_path)
+        if cutline:
+            await run_compute(
+                "terrain", clip_raster_gdal, tiff_path, output_tiff, shapefile=cutline,
+                progress=progress.span(0.8, 1.0)
+            )
         else:
             # For bbox, we already got the clipped image from EE
-            # Just copy the file or do minimal processing
-            shutil.copy2(tiff_path, output_tiff)
-
-        # Clean up temporary files
-        try:
-            if os.path.exists(tiff_path):
-                os.remove(tiff_path)
-        except:
-            pass
+            publish(tiff_path, output_tiff)
 
         # Step 4: Return clipped file
         return FileResponse(
             path=output_tiff,
             filename="LULC_clipped.tif",
-            media_type="image/tiff"
+            media_type="image/tiff",
+            headers={"X-Product-Id": os.path.basename(output_tiff)}
         )
 
+    except HTTPException:
+        raise
+    except OperationCancelled:
+        raise HTTPException(status_code=499, detail="Operation cancelled")
     except Exception as e:
         import traceback
         logger.error(f"DEBUG ERROR:\n{traceback.format_exc()}")
@@ -972,14 +1675,24 @@ async def download_lulc(
 async def lulc_statistics(
     bbox: str = Form(None, description="bbox as minX,minY,maxX,maxY"),
     scale: int = Form(100),
-    zip_file: UploadFile = File(None, description="Shapefile ZIP"),
+    zip_file: UploadFile = File(None, description="AOI: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf"),
+    mode: str = Form("server", description="server: reduce on Earth Engine, local: download and clip"),
+    pipeline: str = Form("memory", description="local mode: memory keeps the download and clip in /vsimem, disk writes them to the request workspace"),
+    workspace: Workspace = Depends(request_workspace),
+    memory: MemoryWorkspace = Depends(memory_workspace),
+    progress: OperationProgress = Depends(operation_progress),
 ):
     try:
+        if mode not in STATS_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(STATS_MODES)}")
+        if pipeline not in PIPELINE_MODES:
+            raise HTTPException(status_code=400, detail=f"pipeline must be one of: {', '.join(PIPELINE_MODES)}")
+
         # Initialize Earth Engine (same as download_lulc)
-        LULCDataDownloader.initialize_earth_engine()
+        await run_compute("network", LULCDataDownloader.initialize_earth_engine)
         
         region = None
-        shp_path = None
+        cutline = None
         bbox_coords = None
 
         # Option 1: bbox (same logic as download_lulc)
@@ -992,76 +1705,45 @@ async def lulc_statistics(
         # Option 2: shapefile (same logic as download_lulc)
         elif zip_file:
             # Save uploaded file temporarily
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            with open(tmp_zip.name, "wb") as f:
-                shutil.copyfileobj(zip_file.file, f)
-            region, shp_path = unzip_and_read_shapefile_ee(tmp_zip.name)  # Use the EE version
+            aoi_path = await save_aoi_input(zip_file, workspace)
+            region, cutline = await run_compute("terrain", unzip_and_read_shapefile_ee, aoi_path)  # Use the EE version
         else:
-            return {"error": "Provide either bbox or shapefile ZIP"}
+            return {"error": "Provide either bbox or an AOI file"}
+
+        # Server-side reduction: a frequency histogram instead of a raster download
+        if mode == "server":
+            stats = await run_compute("network", LULCDataDownloader.lulc_statistics_server, region, scale)
+            return JSONResponse(content={"lulc_statistics": stats})
+
+        # Step 1: Download clipped LULC from EE (same as download_lulc), kept in /vsimem for the memory
+        # pipeline or written to the request workspace
+        memory = memory if pipeline == "memory" else None
+        tiff_path = await run_compute(
+            "network", LULCDataDownloader.download_lulc_single, region=region, output_path=workspace.file("LULC.tif"),
+            progress=progress.span(0.0, 0.8), memory=memory
+        )
 
-        # Step 1: Download clipped LULC from EE (same as download_lulc)
-        tiff_path = LULCDataDownloader.download_lulc_single(region=region)
-    
-        
-        # Step 2: Create output path
-        output_tiff = os.path.join(tempfile.gettempdir(), "LULC_clipped.tif")
-        
-        # Step 3: Clip using GDAL (if shapefile provided for precise clipping)
-        if shp_path:
-            clip_raster_gdal(tiff_path, output_tiff, shapefile=shp_path)
+        # Step 2: Clip using GDAL (if an AOI file was provided for precise clipping); in memory the clip is a
+        # VRT evaluated by the scan. Both are removed when the request ends
+        if cutline:
+            output_tiff = memory.file("LULC_clipped.vrt") if memory else workspace.file("LULC_clipped.tif")
+            await run_compute(
+                "terrain", clip_raster_gdal, tiff_path, output_tiff, shapefile=cutline,
+                progress=progress.span(0.8, 1.0)
+            )
         else:
             # For bbox, we already got the clipped image from EE
-            shutil.copy2(tiff_path, output_tiff)
+            output_tiff = tiff_path
 
-        # Clean up temporary files (same as download_lulc)
-        try:
-            if os.path.exists(tiff_path):
-                os.remove(tiff_path)
-        except:
-            pass
-
-        # Read TIFF & compute stats (your original statistics logic)
-        with rasterio.open(output_tiff) as src:
-            data = src.read(1)
-            total_pixels = data.size
-            pixel_area_m2 = scale * scale
-            pixel_area_km2 = pixel_area_m2 / 1e6
-
-            LULC_CLASSES = {
-                10: "Tree cover",
-                20: "Shrubland",
-                30: "Grassland",
-                40: "Cropland",
-                50: "Built-up",
-                60: "Bare / sparse vegetation",
-                70: "Snow and ice",
-                80: "Permanent water bodies",
-                90: "Herbaceous wetland",
-                95: "Mangroves",
-                100: "Moss and lichen"
-            }
-
-        unique, counts = np.unique(data, return_counts=True)
-        stats = []
-        for val, cnt in zip(unique, counts):
-            if val in LULC_CLASSES:
-                stats.append({
-                    "class_id": int(val),
-                    "class_name": LULC_CLASSES[val],
-                    "pixel_count": int(cnt),
-                    "area_km2": round(cnt * pixel_area_km2, 2),
-                    "percentage": round((cnt / total_pixels) * 100, 2)
-                })
-
-        # Additional cleanup: remove the output TIFF after processing
-        try:
-            if os.path.exists(output_tiff):
-                os.remove(output_tiff)
-        except:
-            pass
+        # Count class pixels in one blockwise pass
+        stats = await run_compute("terrain", LULCDataDownloader.lulc_statistics_local, output_tiff, scale)
 
         return JSONResponse(content={"lulc_statistics": stats})
 
+    except HTTPException:
+        raise
+    except OperationCancelled:
+        raise HTTPException(status_code=499, detail="Operation cancelled")
     except Exception as e:
         import traceback
         logger.error(f"DEBUG ERROR:\n{traceback.format_exc()}")
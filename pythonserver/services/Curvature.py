@@ -1,7 +1,12 @@
 from osgeo import gdal
 import os
+from .terrain import run_tiled
+from .output_writer import cog_output
+from .progress import span
+from .workspace import unique_output_path
+from .dataset_cache import DATASET_CACHE
 
-def curvature_service(dem_path, z_factor=1.0, scale=1.0):
+def curvature_service(dem_path, z_factor=1.0, scale=1.0, tiled=False, workers=None, progress=None):
     """Calculate profile curvature from DEM."""
     try:
         # Register GDAL drivers
@@ -11,55 +16,30 @@ def curvature_service(dem_path, z_factor=1.0, scale=1.0):
         if not os.path.exists(dem_path):
             return {"error": f"DEM file not found: {dem_path}"}, 400
         
-        # Try opening the input file to verify it's a valid raster
+        # Try opening the input file to verify it's a valid raster (the handle stays warm for later queries)
         try:
-            ds = gdal.Open(dem_path)
-            if ds is None:
-                return {"error": "Could not open DEM file - may be corrupt or invalid format"}, 400
-            ds = None  # Close the dataset
+            DATASET_CACHE.get(dem_path)
+        except ValueError:
+            return {"error": "Could not open DEM file - may be corrupt or invalid format"}, 400
         except Exception as e:
             return {"error": f"Invalid DEM file: {str(e)}"}, 400
 
-        # Prepare output directory
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        
         # Create unique output filename
-        base_name = os.path.splitext(os.path.basename(dem_path))[0]
-        output_path = os.path.join(temp_dir, f"curvature_{base_name}.tif")
-
-        # Set processing options
-        dem_options = gdal.DEMProcessingOptions(
-            zFactor=z_factor,
-            scale=scale,
-            computeEdges=True,
-            format='GTiff',
-            creationOptions=['COMPRESS=LZW']
-        )
+        output_path = unique_output_path("curvature", dem_path, ".tif")
 
-        # Perform the curvature calculation
+        # gdaldem has no curvature mode: both paths run the terrain engine's Zevenbergen & Thorne
+        # curvature, serially or windowed over several processes for DEMs larger than RAM
         try:
-            gdal.DEMProcessing(
-                output_path,
-                dem_path,
-                "profilecurvature",
-                options=dem_options
-            )
+            with cog_output(output_path, progress=span(progress, 0.8, 1.0)) as work_path:
+                run_tiled(dem_path, "curvature", work_path, workers=workers if tiled else 1,
+                          z_factor=z_factor, scale=scale,
+                          progress=span(progress, 0.0, 0.8))
         except Exception as e:
             return {"error": f"GDAL processing failed: {str(e)}"}, 500
 
-        # Verify output was created
+        # Verify output was created (the COG pass already checked GDAL could write it)
         if not os.path.exists(output_path):
             return {"error": "GDAL failed to create output file"}, 500
-        
-        # Verify output is readable
-        try:
-            ds = gdal.Open(output_path)
-            if ds is None:
-                return {"error": "Output file created but is invalid"}, 500
-            ds = None
-        except Exception as e:
-            return {"error": f"Output verification failed: {str(e)}"}, 500
 
         return {
             "success": True,
@@ -1,7 +1,11 @@
 from osgeo import gdal
 import os
+from .terrain import run_tiled
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
+from .workspace import unique_output_path
 
-def roughness_service(dem_path, z_factor=1.0, scale=1.0):
+def roughness_service(dem_path, z_factor=1.0, scale=1.0, tiled=False, workers=None, progress=None):
     """Calculate surface roughness from DEM."""
     gdal.AllRegister()
 
@@ -13,22 +17,31 @@ def roughness_service(dem_path, z_factor=1.0, scale=1.0):
         return {"error": "Could not open DEM file"}, 500
 
     try:
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        output_path = os.path.join(temp_dir, f"roughness_{os.path.basename(dem_path)}")
-
-        dem_options = gdal.DEMProcessingOptions(
-            zFactor=z_factor,
-            scale=scale,
-            computeEdges=True
-        )
-
-        gdal.DEMProcessing(
-            output_path,
-            dem_path,
-            "roughness",
-            options=dem_options
-        )
+        output_path = unique_output_path("roughness", dem_path)
+
+        # Producer writes a work file that is turned into a COG with overviews
+        with cog_output(output_path, progress=span(progress, 0.8, 1.0)) as work_path:
+            if tiled:
+                # Windowed, multi-core execution for DEMs larger than RAM
+                run_tiled(dem_path, "roughness", work_path, workers=workers,
+                          z_factor=z_factor, scale=scale,
+                          progress=span(progress, 0.0, 0.8))
+            else:
+                dem_options = gdal.DEMProcessingOptions(
+                    zFactor=z_factor,
+                    scale=scale,
+                    computeEdges=True,
+                    format="GTiff",
+                    creationOptions=WORK_CREATION_OPTIONS,
+                    callback=gdal_callback(span(progress, 0.0, 0.8), "roughness")
+                )
+
+                gdal.DEMProcessing(
+                    work_path,
+                    dem_path,
+                    "roughness",
+                    options=dem_options
+                )
 
         return {
             "success": True,
@@ -38,7 +51,8 @@ def roughness_service(dem_path, z_factor=1.0, scale=1.0):
                 "analysis_type": "roughness",
                 "description": "Surface texture variability calculated",
                 "z_factor": z_factor,
-                "scale": scale
+                "scale": scale,
+                "tiled": tiled
             }
         }, 200
 
@@ -1,8 +1,12 @@
 from osgeo import gdal
 import os
+from .terrain import run_tiled
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
+from .workspace import unique_output_path
 
 # Service function
-def tpi_service(dem_path, z_factor=1.0, scale=1.0):
+def tpi_service(dem_path, z_factor=1.0, scale=1.0, tiled=False, workers=None, progress=None):
     """Calculate Topographic Position Index from DEM."""
     gdal.AllRegister()
     if not os.path.exists(dem_path):
@@ -11,20 +15,29 @@ def tpi_service(dem_path, z_factor=1.0, scale=1.0):
     if dem_ds is None:
         return {"error": "Could not open DEM file"}, 500
     try:
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        output_path = os.path.join(temp_dir, f"tpi_{os.path.basename(dem_path)}")
-        dem_options = gdal.DEMProcessingOptions(
-            zFactor=z_factor,
-            scale=scale,
-            computeEdges=True
-        )
-        gdal.DEMProcessing(
-            output_path,
-            dem_path,
-            "TPI",
-            options=dem_options
-        )
+        output_path = unique_output_path("tpi", dem_path)
+        # Producer writes a work file that is turned into a COG with overviews
+        with cog_output(output_path, progress=span(progress, 0.8, 1.0)) as work_path:
+            if tiled:
+                # Windowed, multi-core execution for DEMs larger than RAM
+                run_tiled(dem_path, "tpi", work_path, workers=workers,
+                          z_factor=z_factor, scale=scale,
+                          progress=span(progress, 0.0, 0.8))
+            else:
+                dem_options = gdal.DEMProcessingOptions(
+                    zFactor=z_factor,
+                    scale=scale,
+                    computeEdges=True,
+                    format="GTiff",
+                    creationOptions=WORK_CREATION_OPTIONS,
+                    callback=gdal_callback(span(progress, 0.0, 0.8), "tpi")
+                )
+                gdal.DEMProcessing(
+                    work_path,
+                    dem_path,
+                    "TPI",
+                    options=dem_options
+                )
         return {
             "success": True,
             "output_path": output_path,
@@ -33,7 +46,8 @@ def tpi_service(dem_path, z_factor=1.0, scale=1.0):
                 "analysis_type": "tpi",
                 "description": "Topographic Position Index calculated",
                 "z_factor": z_factor,
-                "scale": scale
+                "scale": scale,
+                "tiled": tiled
             }
         }, 200
     except Exception as e:
@@ -1,36 +1,162 @@
-from .countour import generate_contours
+from .countour import generate_contours, contour_service
 from .hillshade import hillshade_service, compute_hillshade_stats
 from .aspect import aspect_service
-from .slope import slope_service
+from .slope import slope_service, compute_slope_stats
 from .watershed import watershed_service
 from .Curvature import curvature_service
 from .Roughness import roughness_service
 from .TPI import tpi_service
-from .indices import ndvi_service,ndwi_service,ndbi_service
-from .elevation_profile import elevation_profile_service
-from .elevation_point import elevation_point_service
+from .terrain import terrain_service, shutdown_terrain_pool, TERRAIN_PRODUCTS
+from .indices import ndvi_service,ndwi_service,ndbi_service, scene_indices_service, scene_sources, parse_band_roles, parse_indices, SPECTRAL_INDICES, BAND_ROLES, SCENE_OUTPUTS
+from .band_math import band_math_service, BandMathPlan, Expression, BandMathError, RESAMPLING_METHODS
+from .elevation_profile import elevation_profile_service, profile_records, profile_lists, profile_binary, PROFILE_COLUMNS
+from .elevation_point import elevation_point_service, elevation_points_service, parse_points, read_points, INTERPOLATION_METHODS, MAX_POINTS_BYTES
+from .ee_client import EE_CLIENT, EarthEngineClient, plan_grid
 from .lst import LSTDataDownloader
 from .lulc import LULCDataDownloader
+from .ingest import save_upload, upload_path, file_digest, UploadTooLargeError, MAX_UPLOAD_BYTES
+from .result_cache import RESULT_CACHE, cached_service
+from .dataset_cache import DATASET_CACHE
+from .dataset_store import register_dataset, find_dataset, resolve_dataset
+from .delivery import RESPONSE_MODES, raster_result, resolve_output_path, file_etag, etag_matches, parse_byte_range, iter_file_range, media_type_for
+from .tiles import tile_service, resolve_tile_source, TILE_CACHE, TILE_FORMATS
+from .raster_stats import StreamingStats, raster_stats, array_stats, class_table_stats, CLASS_TABLES, LULC_CLASSES
+from .landsat import fetch_band_stack, plan_tiles, landsat_index, landsat_index_data, write_index_raster, index_statistics, LANDSAT_INDICES, LANDSAT_BANDS, LANDSAT_RESOLUTION
+from .output_writer import cog_output, write_cog, cog_creation_options
+from .compute import ComputeBusyError, run_in_pool, compute_pool_status, shutdown_compute_pools
+from .workspace import Workspace, MemoryWorkspace, unique_output_path, atomic_path, publish, sweep_workspaces
+from .progress import PROGRESS, ProgressReporter, OperationProgress, OperationCancelled
+from .jobs import JOB_MANAGER, JOB_OPERATIONS, FINISHED_STATES, JobManager, SQLiteJobStore, MemoryJobStore, JobError, JobCancelled
+from .job_operations import STATS_MODES, PIPELINE_MODES
+from .aoi import read_aoi, parse_aoi, aoi_source, AOI, AOIError, AOI_CACHE, AOI_UPLOAD_EXTENSIONS
 from .unzip_and_read_shapefile import unzip_and_read_shapefile, unzip_and_read_shapefile_ee, clip_raster_gdal
+from .zonal_stats import zonal_stats_service, zonal_statistics, ZonalAccumulator, ZonalStatsError, ZONAL_FORMATS, ZONAL_HISTOGRAMS
 
 __all__ = [
     'generate_contours',
+    'contour_service',
     'hillshade_service',
     'aspect_service',
     'compute_hillshade_stats',
     'slope_service',
+    'compute_slope_stats',
     'watershed_service',
     'curvature_service',
     'roughness_service',
     'tpi_service',
+    'terrain_service',
+    'shutdown_terrain_pool',
+    'TERRAIN_PRODUCTS',
     'ndvi_service',
     'ndwi_service',
     'ndbi_service',
+    'scene_indices_service',
+    'scene_sources',
+    'parse_band_roles',
+    'parse_indices',
+    'SPECTRAL_INDICES',
+    'BAND_ROLES',
+    'SCENE_OUTPUTS',
+    'band_math_service',
+    'BandMathPlan',
+    'Expression',
+    'BandMathError',
+    'RESAMPLING_METHODS',
     'elevation_profile_service',
+    'profile_records',
+    'profile_lists',
+    'profile_binary',
+    'PROFILE_COLUMNS',
     'elevation_point_service',
+    'elevation_points_service',
+    'parse_points',
+    'read_points',
+    'MAX_POINTS_BYTES',
+    'INTERPOLATION_METHODS',
+    'EE_CLIENT',
+    'EarthEngineClient',
+    'plan_grid',
     'LSTDataDownloader',
     'LULCDataDownloader',
+    'read_aoi',
+    'parse_aoi',
+    'aoi_source',
+    'AOI',
+    'AOIError',
+    'AOI_CACHE',
+    'AOI_UPLOAD_EXTENSIONS',
     'unzip_and_read_shapefile',
     'unzip_and_read_shapefile_ee',
-    'clip_raster_gdal'
+    'clip_raster_gdal',
+    'save_upload',
+    'upload_path',
+    'file_digest',
+    'UploadTooLargeError',
+    'MAX_UPLOAD_BYTES',
+    'RESULT_CACHE',
+    'cached_service',
+    'DATASET_CACHE',
+    'register_dataset',
+    'find_dataset',
+    'resolve_dataset',
+    'RESPONSE_MODES',
+    'raster_result',
+    'resolve_output_path',
+    'file_etag',
+    'etag_matches',
+    'parse_byte_range',
+    'iter_file_range',
+    'media_type_for',
+    'tile_service',
+    'resolve_tile_source',
+    'TILE_CACHE',
+    'TILE_FORMATS',
+    'StreamingStats',
+    'raster_stats',
+    'array_stats',
+    'class_table_stats',
+    'CLASS_TABLES',
+    'LULC_CLASSES',
+    'fetch_band_stack',
+    'plan_tiles',
+    'landsat_index',
+    'landsat_index_data',
+    'write_index_raster',
+    'index_statistics',
+    'LANDSAT_INDICES',
+    'LANDSAT_BANDS',
+    'LANDSAT_RESOLUTION',
+    'cog_output',
+    'write_cog',
+    'cog_creation_options',
+    'ComputeBusyError',
+    'run_in_pool',
+    'compute_pool_status',
+    'shutdown_compute_pools',
+    'Workspace',
+    'MemoryWorkspace',
+    'unique_output_path',
+    'atomic_path',
+    'publish',
+    'sweep_workspaces',
+    'PROGRESS',
+    'ProgressReporter',
+    'OperationProgress',
+    'OperationCancelled',
+    'JOB_MANAGER',
+    'JOB_OPERATIONS',
+    'FINISHED_STATES',
+    'JobManager',
+    'SQLiteJobStore',
+    'MemoryJobStore',
+    'JobError',
+    'JobCancelled',
+    'STATS_MODES',
+    'PIPELINE_MODES',
+    'zonal_stats_service',
+    'zonal_statistics',
+    'ZonalAccumulator',
+    'ZonalStatsError',
+    'ZONAL_FORMATS',
+    'ZONAL_HISTOGRAMS'
 ]
\ No newline at end of file
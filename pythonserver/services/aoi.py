@@ -0,0 +1,168 @@
+import os
+import json
+import logging
+import threading
+import zipfile
+from collections import OrderedDict
+from osgeo import ogr, osr
+from .ingest import file_digest
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AOI_CACHE_MAX_ENTRIES = int(os.getenv("AOI_CACHE_MAX_ENTRIES", 256))
+# Vector layers looked for inside a ZIP
+AOI_LAYER_EXTENSIONS = (".shp", ".gpkg", ".geojson", ".fgb")
+# What an AOI upload may be: a ZIP of any of the above, or a single-file format as is
+AOI_UPLOAD_EXTENSIONS = (".zip", ".gpkg", ".geojson", ".json", ".fgb")
+
+
+class AOIError(ValueError):
+    """An AOI file that cannot be read as a polygon layer"""
+
+
+class AOI:
+    """A parsed area of interest.
+
+    geojson is the union of every polygon feature in WGS84 (lon/lat order) and bounds its
+    (min_x, min_y, max_x, max_y). source is the OGR name of the layer, e.g. a /vsizip/ path,
+    usable directly as a GDAL cutline.
+    """
+
+    def __init__(self, source, geojson, bounds, feature_count, digest):
+        self.source = source
+        self.geojson = geojson
+        self.bounds = bounds
+        self.feature_count = feature_count
+        self.digest = digest
+
+
+def aoi_source(path):
+    """OGR name of the vector layer in path; a ZIP is read in place through /vsizip/"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    if not zipfile.is_zipfile(path):
+        return path
+    with zipfile.ZipFile(path) as archive:
+        names = [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and "__MACOSX" not in info.filename
+            and info.filename.lower().endswith(AOI_LAYER_EXTENSIONS)
+        ]
+    if len(names) != 1:
+        raise AOIError(
+            f"The ZIP must contain exactly one vector layer ({', '.join(AOI_LAYER_EXTENSIONS)}), found {len(names)}"
+        )
+    return f"/vsizip/{path}/{names[0]}"
+
+
+def _wgs84():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def parse_aoi(source):
+    """(GeoJSON geometry, bounds, feature count) of the polygons of the first layer of source, in WGS84"""
+    vector_ds = ogr.Open(source)
+    if vector_ds is None or vector_ds.GetLayerCount() == 0:
+        raise AOIError(f"Could not open {os.path.basename(source)} as a vector layer")
+    layer = vector_ds.GetLayer(0)
+
+    to_wgs84 = None
+    layer_srs = layer.GetSpatialRef()
+    if layer_srs is not None:
+        layer_srs = layer_srs.Clone()
+        layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        wgs84 = _wgs84()
+        if not layer_srs.IsSame(wgs84):
+            to_wgs84 = osr.CoordinateTransformation(layer_srs, wgs84)
+
+    polygons = ogr.Geometry(ogr.wkbMultiPolygon)
+    count = 0
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        geometry = geometry.Clone()
+        geometry.FlattenTo2D()
+        kind = ogr.GT_Flatten(geometry.GetGeometryType())
+        if kind == ogr.wkbPolygon:
+            parts = [geometry]
+        elif kind == ogr.wkbMultiPolygon:
+            parts = [geometry.GetGeometryRef(i).Clone() for i in range(geometry.GetGeometryCount())]
+        else:
+            continue
+        if to_wgs84 is not None:
+            for part in parts:
+                part.Transform(to_wgs84)
+        for part in parts:
+            polygons.AddGeometry(part)
+        count += 1
+    vector_ds = None
+
+    if count == 0:
+        raise AOIError("The AOI layer has no polygon features")
+    # All features dissolved into one AOI; invalid rings can defeat the union, then the parts are kept as is
+    merged = polygons.GetGeometryRef(0).Clone() if polygons.GetGeometryCount() == 1 else (
+        polygons.UnionCascaded() or polygons
+    )
+    min_x, max_x, min_y, max_y = merged.GetEnvelope()
+    return json.loads(merged.ExportToJson()), (min_x, min_y, max_x, max_y), count
+
+
+class AOICache:
+    """Process-level LRU of parsed AOIs keyed by the file's SHA-256.
+
+    Only the parsed geometry and bounds are kept, never a path, so an entry stays valid after
+    the request that uploaded the file has removed it.
+    """
+
+    def __init__(self, max_entries=AOI_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.metrics["hits"] += 1
+            return entry
+
+    def put(self, digest, entry):
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+AOI_CACHE = AOICache()
+
+
+def read_aoi(path, cache=AOI_CACHE):
+    """The AOI in a zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf file, read without extracting.
+
+    The same file content is parsed and reprojected once; uploads have their digest recorded
+    while they are saved, so a repeat costs a dictionary lookup.
+    """
+    source = aoi_source(path)
+    digest = file_digest(path)
+    parsed = cache.get(digest)
+    if parsed is None:
+        parsed = parse_aoi(source)
+        cache.put(digest, parsed)
+        logger.info(f"Parsed AOI {os.path.basename(path)}: {parsed[2]} polygon feature(s)")
+    return AOI(source, *parsed, digest)
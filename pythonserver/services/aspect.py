@@ -1,36 +1,50 @@
 from osgeo import gdal
 import os
+from .terrain import run_tiled
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
+from .workspace import unique_output_path
 
-def aspect_service(dem_path, trigonometric=True, zero_for_flat=True):
+def aspect_service(dem_path, trigonometric=True, zero_for_flat=True, tiled=False, workers=None, progress=None):
     gdal.AllRegister()
 
     if not os.path.exists(dem_path):
         return {"error": f"DEM file not found: {dem_path}"}, 400
 
     try:
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        aspect_path = os.path.join(temp_dir, f"aspect_{os.path.basename(dem_path)}")
+        aspect_path = unique_output_path("aspect", dem_path)
 
-        options = gdal.DEMProcessingOptions(
-            computeEdges=True,
-            trigonometric=trigonometric,
-            zeroForFlat=zero_for_flat
-        )
+        # Producer writes a work file that is turned into a COG with overviews
+        with cog_output(aspect_path, resampling="NEAREST", progress=span(progress, 0.8, 1.0)) as work_path:
+            if tiled:
+                # Windowed, multi-core execution for DEMs larger than RAM
+                run_tiled(dem_path, "aspect", work_path, workers=workers,
+                          trigonometric=trigonometric, zero_for_flat=zero_for_flat,
+                          progress=span(progress, 0.0, 0.8))
+            else:
+                options = gdal.DEMProcessingOptions(
+                    computeEdges=True,
+                    trigonometric=trigonometric,
+                    zeroForFlat=zero_for_flat,
+                    format="GTiff",
+                    creationOptions=WORK_CREATION_OPTIONS,
+                    callback=gdal_callback(span(progress, 0.0, 0.8), "aspect")
+                )
 
-        gdal.DEMProcessing(
-            aspect_path,
-            dem_path,  # here we can pass path directly
-            "aspect",
-            options=options
-        )
+                gdal.DEMProcessing(
+                    work_path,
+                    dem_path,  # here we can pass path directly
+                    "aspect",
+                    options=options
+                )
 
         return {
             "success": True,
             "aspect_path": aspect_path,
             "parameters": {
                 "trigonometric": trigonometric,
-                "zero_for_flat": zero_for_flat
+                "zero_for_flat": zero_for_flat,
+                "tiled": tiled
             },
             "download_url": f"/download?file={os.path.basename(aspect_path)}"
         }, 200
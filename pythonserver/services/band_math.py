@@ -0,0 +1,409 @@
+import os
+import re
+import ast
+import math
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from osgeo import gdal, osr
+from .terrain import iter_windows, BLOCK_SIZE, DEFAULT_WORKERS
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import OperationCancelled, span
+from .workspace import unique_output_path, new_token, OUTPUT_FOLDER
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BAND_MATH_NODATA = -9999.0
+MAX_EXPRESSION_LENGTH = 1000
+RESAMPLING_METHODS = ("nearest", "bilinear", "cubic", "cubicspline", "lanczos", "average", "mode")
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {ast.USub: np.negative, ast.UAdd: np.positive}
+# name -> (ufunc, number of arguments)
+FUNCTIONS = {
+    "sqrt": (np.sqrt, 1),
+    "abs": (np.abs, 1),
+    "log": (np.log, 1),
+    "log10": (np.log10, 1),
+    "exp": (np.exp, 1),
+    "min": (np.minimum, 2),
+    "max": (np.maximum, 2),
+}
+BAND_NAME = re.compile(r"^b([1-9][0-9]*)$")
+
+
+class BandMathError(ValueError):
+    """Invalid expression or inputs; reported to the client as a 400"""
+
+
+class Expression:
+    """A band-math expression such as `(b2 - b1) / (b2 + b1)`, where bN is the N-th input.
+
+    variables ({name: input number}) replaces the bN names, e.g. `(nir - red) / (nir + red)`.
+    It is compiled once into a list of ufunc steps, each writing into one of a few scratch
+    registers (`out=`), so evaluating a block allocates no temporaries. Constant
+    sub-expressions are folded at compile time.
+    """
+
+    def __init__(self, text, variables=None):
+        self.text = (text or "").strip()
+        self.variables = variables
+        if not self.text:
+            raise BandMathError("Expression is empty")
+        if len(self.text) > MAX_EXPRESSION_LENGTH:
+            raise BandMathError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+        try:
+            tree = ast.parse(self.text, mode="eval")
+        except SyntaxError as e:
+            raise BandMathError(f"Invalid expression: {e.msg}")
+
+        self.bands = set()
+        self.steps = []
+        self.registers = 0
+        self._free = []
+        try:
+            result = self._compile(tree.body)
+        except RecursionError:
+            raise BandMathError("Expression is nested too deeply")
+        if result[0] != "reg":
+            # A bare band or constant: copy it into a register the caller may overwrite
+            result = self._emit(np.positive, [result])
+        self.result = result[1]
+
+    def _alloc(self):
+        if self._free:
+            return self._free.pop()
+        self.registers += 1
+        return self.registers - 1
+
+    def _emit(self, func, operands):
+        # Operand registers are released first, so the output may reuse one of them in place
+        for kind, value in operands:
+            if kind == "reg":
+                self._free.append(value)
+        out = self._alloc()
+        self.steps.append((func, tuple(operands), out))
+        return "reg", out
+
+    def _apply(self, func, operands):
+        if all(kind == "const" for kind, _ in operands):
+            with np.errstate(all="ignore"):
+                return "const", float(func(*[value for _, value in operands]))
+        return self._emit(func, operands)
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return "const", float(node.value)
+        if isinstance(node, ast.Name) and self.variables is not None:
+            if node.id not in self.variables:
+                raise BandMathError(f"Unknown name '{node.id}'; available: {', '.join(self.variables)}")
+            self.bands.add(self.variables[node.id])
+            return "band", self.variables[node.id]
+        if isinstance(node, ast.Name):
+            match = BAND_NAME.match(node.id)
+            if not match:
+                raise BandMathError(f"Unknown name '{node.id}'; inputs are b1, b2, ...")
+            index = int(match.group(1))
+            self.bands.add(index)
+            return "band", index
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            return self._apply(BINARY_OPERATORS[type(node.op)], [self._compile(node.left), self._compile(node.right)])
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return self._apply(UNARY_OPERATORS[type(node.op)], [self._compile(node.operand)])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+            func, arity = FUNCTIONS[node.func.id]
+            if node.keywords or len(node.args) != arity:
+                raise BandMathError(f"{node.func.id}() takes {arity} argument(s)")
+            return self._apply(func, [self._compile(arg) for arg in node.args])
+        raise BandMathError(
+            f"Unsupported syntax in expression: {ast.get_source_segment(self.text, node) or type(node).__name__}; "
+            f"use numbers, b1..bN, + - * / ** and {', '.join(FUNCTIONS)}()"
+        )
+
+    def evaluate(self, bands, registers):
+        """Run the steps over {band index: block} into registers; returns the result register"""
+        def value(operand):
+            kind, v = operand
+            return bands[v] if kind == "band" else registers[v] if kind == "reg" else v
+
+        for func, operands, out in self.steps:
+            func(*[value(operand) for operand in operands], out=registers[out])
+        return registers[self.result]
+
+
+def _crs_name(wkt):
+    """'EPSG:32633' style name of a projection, or the WKT itself when it has no authority code"""
+    if not wkt:
+        return None
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(wkt)
+    srs.AutoIdentifyEPSG()
+    authority, code = srs.GetAuthorityName(None), srs.GetAuthorityCode(None)
+    return f"{authority}:{code}" if authority and code else wkt
+
+
+def _same_grid(ds, geotransform, wkt, xsize, ysize):
+    if (ds.RasterXSize, ds.RasterYSize) != (xsize, ysize):
+        return False
+    tolerance = abs(geotransform[1]) * 1e-6
+    if any(abs(a - b) > tolerance for a, b in zip(ds.GetGeoTransform(), geotransform)):
+        return False
+    if not ds.GetProjection() or not wkt:
+        return ds.GetProjection() == wkt
+    source, target = osr.SpatialReference(), osr.SpatialReference()
+    source.ImportFromWkt(ds.GetProjection())
+    target.ImportFromWkt(wkt)
+    return bool(source.IsSame(target))
+
+
+class _ThreadState:
+    """One worker thread's dataset handles and reusable block buffers"""
+
+    def __init__(self, plan):
+        # GDAL handles must not be shared between threads
+        self.datasets = {path: gdal.Open(path) for path in set(plan.read_paths.values())}
+        size = plan.block_size * plan.block_size
+        self.inputs = {index: np.empty(size, dtype=np.float32) for index in plan.used}
+        self.registers = [np.empty(size, dtype=np.float32) for _ in range(plan.registers)]
+        self.mask = np.empty(size, dtype=bool)
+
+
+class BandMathPlan:
+    """Inputs aligned on one output grid plus the compiled expressions, evaluated window by window.
+
+    sources are (path, band) pairs; bN in an expression is sources[N - 1]. The grid is the one of
+    the reference input (1-based; default: the finest resolution). Inputs on another grid are read
+    through a warped VRT, resampled on the fly for each window, never materialized whole.
+    Pixels that are nodata in any input used, or not finite in the result, become nodata.
+    scale and offset convert every input once per read (e.g. digital numbers to reflectance).
+    """
+
+    def __init__(self, sources, expressions, reference=None, resampling="bilinear", block_size=BLOCK_SIZE,
+                 scale=1.0, offset=0.0):
+        if not sources:
+            raise BandMathError("At least one input is required")
+        if resampling not in RESAMPLING_METHODS:
+            raise BandMathError(f"resampling must be one of: {', '.join(RESAMPLING_METHODS)}")
+        self.sources = list(sources)
+        self.expressions = [e if isinstance(e, Expression) else Expression(e) for e in expressions]
+        if not self.expressions:
+            raise BandMathError("At least one expression is required")
+        self.used = sorted(set().union(*(e.bands for e in self.expressions)))
+        if not self.used:
+            raise BandMathError("Expression does not use any input band")
+        if self.used[-1] > len(self.sources):
+            raise BandMathError(f"Expression uses b{self.used[-1]} but only {len(self.sources)} input(s) were given")
+        self.registers = max(e.registers for e in self.expressions)
+        self.block_size = block_size
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.read_paths = {}
+        self._vrt_paths = []
+        self._states = []
+        self._local = threading.local()
+        self._states_lock = threading.Lock()
+        self._align(reference, resampling)
+
+    def _align(self, reference, resampling):
+        datasets = {}
+        for path, band in self.sources:
+            if path not in datasets:
+                datasets[path] = gdal.Open(path)
+                if datasets[path] is None:
+                    raise BandMathError(f"Could not open raster {os.path.basename(path)}")
+            if not 1 <= band <= datasets[path].RasterCount:
+                raise BandMathError(f"{os.path.basename(path)} has no band {band}")
+
+        if reference is None:
+            # Finest resolution wins, so no input loses detail
+            reference = min(range(1, len(self.sources) + 1),
+                            key=lambda i: abs(datasets[self.sources[i - 1][0]].GetGeoTransform()[1]))
+        if not 1 <= reference <= len(self.sources):
+            raise BandMathError(f"reference must be between 1 and {len(self.sources)}")
+        self.reference = reference
+
+        ref_ds = datasets[self.sources[reference - 1][0]]
+        self.geotransform = ref_ds.GetGeoTransform()
+        self.projection = ref_ds.GetProjection()
+        self.xsize, self.ysize = ref_ds.RasterXSize, ref_ds.RasterYSize
+
+        minx, maxy = self.geotransform[0], self.geotransform[3]
+        maxx = minx + self.geotransform[1] * self.xsize
+        miny = maxy + self.geotransform[5] * self.ysize
+        for path, ds in datasets.items():
+            if _same_grid(ds, self.geotransform, self.projection, self.xsize, self.ysize):
+                self.read_paths[path] = path
+                continue
+            # Lazy warp onto the output grid; nodata and pixels outside the input come back as NaN
+            vrt_path = f"/vsimem/band_math_{new_token()}.vrt"
+            vrt = gdal.Warp(vrt_path, ds, options=gdal.WarpOptions(
+                format="VRT", outputBounds=(minx, miny, maxx, maxy), width=self.xsize, height=self.ysize,
+                dstSRS=self.projection or None, resampleAlg=resampling,
+                outputType=gdal.GDT_Float32, dstNodata=float("nan")
+            ))
+            if vrt is None:
+                raise BandMathError(f"Could not align {os.path.basename(path)} to the reference grid")
+            vrt = None
+            self._vrt_paths.append(vrt_path)
+            self.read_paths[path] = vrt_path
+
+        # Nodata values to mask while reading; warped inputs already carry NaN
+        self.nodata = {}
+        for index in self.used:
+            path, band = self.sources[index - 1]
+            nodata = datasets[path].GetRasterBand(band).GetNoDataValue()
+            warped = self.read_paths[path] != path
+            self.nodata[index] = None if warped or nodata is None or math.isnan(nodata) else nodata
+        datasets.clear()
+
+    def _state(self):
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = _ThreadState(self)
+            self._local.state = state
+            with self._states_lock:
+                self._states.append(state)
+        return state
+
+    def _evaluate_window(self, window, out_ds, write_lock):
+        """Read, compute and write one window; runs in a pool thread with that thread's buffers"""
+        state = self._state()
+        xoff, yoff, width, height = window
+        n = width * height
+        mask = state.mask[:n].reshape(height, width)
+
+        bands = {}
+        for index in self.used:
+            path, band = self.sources[index - 1]
+            block = state.inputs[index][:n].reshape(height, width)
+            state.datasets[self.read_paths[path]].GetRasterBand(band).ReadAsArray(
+                xoff, yoff, width, height, buf_obj=block
+            )
+            if self.nodata[index] is not None:
+                np.equal(block, self.nodata[index], out=mask)
+                np.copyto(block, np.nan, where=mask)
+            if self.scale != 1.0:
+                np.multiply(block, self.scale, out=block)
+            if self.offset:
+                np.add(block, self.offset, out=block)
+            bands[index] = block
+
+        registers = [register[:n].reshape(height, width) for register in state.registers]
+        for number, expression in enumerate(self.expressions, 1):
+            with np.errstate(all="ignore"):
+                result = expression.evaluate(bands, registers)
+            # NaN from nodata inputs, inf/NaN from division by zero and the like
+            np.isfinite(result, out=mask)
+            np.logical_not(mask, out=mask)
+            np.copyto(result, BAND_MATH_NODATA, where=mask)
+            with write_lock:
+                out_ds.GetRasterBand(number).WriteArray(result, xoff, yoff)
+
+    def render(self, output_path, names=None, workers=None, progress=None):
+        """Write every expression as one Float32 band of a tiled GeoTIFF at output_path"""
+        workers = max(int(workers or DEFAULT_WORKERS), 1)
+        out_ds = gdal.GetDriverByName("GTiff").Create(
+            output_path, self.xsize, self.ysize, len(self.expressions), gdal.GDT_Float32,
+            options=WORK_CREATION_OPTIONS
+        )
+        out_ds.SetGeoTransform(self.geotransform)
+        out_ds.SetProjection(self.projection)
+        for number, expression in enumerate(self.expressions, 1):
+            band = out_ds.GetRasterBand(number)
+            band.SetNoDataValue(BAND_MATH_NODATA)
+            band.SetDescription(names[number - 1] if names else expression.text)
+
+        write_lock = threading.Lock()
+        total = -(-self.xsize // self.block_size) * -(-self.ysize // self.block_size)
+        finished = 0
+        pending = set()
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="band-math") as pool:
+                try:
+                    for window in iter_windows(self.xsize, self.ysize, self.block_size):
+                        pending.add(pool.submit(self._evaluate_window, window, out_ds, write_lock))
+                        # Windows are only queued a little ahead of the workers
+                        if len(pending) < workers * 2:
+                            continue
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        finished = self._collect(done, finished, total, progress)
+                    while pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        finished = self._collect(done, finished, total, progress)
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            out_ds = None
+            self._release_states()
+        return output_path
+
+    def _collect(self, done, finished, total, progress):
+        for future in done:
+            future.result()
+            finished += 1
+        if progress is not None and not progress.update(finished / total, "computing blocks"):
+            raise OperationCancelled("Operation cancelled")
+        return finished
+
+    def _release_states(self):
+        with self._states_lock:
+            for state in self._states:
+                state.datasets.clear()
+            self._states.clear()
+        self._local = threading.local()
+
+    def close(self):
+        """Drop the warped VRTs; the plan cannot render afterwards"""
+        self._release_states()
+        for vrt_path in self._vrt_paths:
+            gdal.Unlink(vrt_path)
+        self._vrt_paths.clear()
+
+    def metadata(self):
+        return {
+            "reference": self.reference,
+            "width": self.xsize,
+            "height": self.ysize,
+            "resolution": self.geotransform[1],
+            "crs": _crs_name(self.projection),
+            "nodata_value": BAND_MATH_NODATA
+        }
+
+
+def band_math_service(input_paths, expression, output_folder=OUTPUT_FOLDER, name="band_math", reference=None,
+                      resampling="bilinear", workers=None, description=None, progress=None):
+    """Evaluate expression over the first band of each input (bN = input_paths[N - 1]) into a COG"""
+    for path in input_paths:
+        if not os.path.exists(path):
+            return {"error": f"Input raster not found: {os.path.basename(path)}"}, 400
+
+    try:
+        plan = BandMathPlan([(path, 1) for path in input_paths], [expression], reference, resampling)
+    except BandMathError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        output_path = unique_output_path(name, input_paths[0], ".tif", folder=output_folder)
+        with cog_output(output_path, progress=span(progress, 0.8, 1.0)) as work_path:
+            plan.render(work_path, [description or plan.expressions[0].text], workers=workers,
+                        progress=span(progress, 0.0, 0.8))
+        return {
+            "success": True,
+            "output_path": output_path,
+            "metadata": {"expression": plan.expressions[0].text, "inputs": len(input_paths), **plan.metadata()}
+        }, 200
+    except Exception as e:
+        logger.error(f"Band math failed for {expression!r}: {e}")
+        return {"error": f"Band math failed: {str(e)}"}, 500
+    finally:
+        plan.close()
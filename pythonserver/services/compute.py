@@ -0,0 +1,97 @@
+import os
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ComputeBusyError(Exception):
+    """Raised when an operation class has no free worker and its queue is full"""
+
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f"The {pool_name} compute pool is busy, retry in {retry_after} seconds")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class ComputePool:
+    """Bounded thread pool for one class of blocking work (GDAL/rasterio release the GIL)"""
+
+    def __init__(self, name, max_workers, max_queue=0, retry_after=5):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-compute")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the pool without blocking the event loop"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                raise ComputeBusyError(self.name, self.retry_after)
+            self._in_flight += 1
+
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except Exception:
+            self._release(None)
+            raise
+        # Released when the work really finishes, even if the request was abandoned
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def status(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": min(in_flight, self.max_workers),
+            "queued": max(in_flight - self.max_workers, 0)
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# CPU-bound raster work vs. network-bound Earth Engine / Sentinel Hub calls
+COMPUTE_POOLS = {
+    "terrain": ComputePool(
+        "terrain",
+        max_workers=int(os.getenv("TERRAIN_WORKERS", os.cpu_count() or 1)),
+        max_queue=int(os.getenv("TERRAIN_QUEUE", 16)),
+        retry_after=int(os.getenv("TERRAIN_RETRY_AFTER", 10))
+    ),
+    "network": ComputePool(
+        "network",
+        max_workers=int(os.getenv("NETWORK_WORKERS", 8)),
+        max_queue=int(os.getenv("NETWORK_QUEUE", 32)),
+        retry_after=int(os.getenv("NETWORK_RETRY_AFTER", 5))
+    ),
+}
+
+
+async def run_in_pool(kind, func, *args, **kwargs):
+    """Dispatch a blocking call to the pool for its operation class"""
+    return await COMPUTE_POOLS[kind].run(func, *args, **kwargs)
+
+
+def compute_pool_status():
+    return {name: pool.status() for name, pool in COMPUTE_POOLS.items()}
+
+
+def shutdown_compute_pools():
+    for pool in COMPUTE_POOLS.values():
+        pool.shutdown()
+    logger.info("Compute pools shut down")
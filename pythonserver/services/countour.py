@@ -1,7 +1,9 @@
 import os
 from osgeo import gdal, ogr, osr
+from .workspace import atomic_path
+from .progress import OperationCancelled, gdal_callback
 
-def generate_contours(dem_path, output_geojson, interval):
+def generate_contours(dem_path, output_geojson, interval, progress=None):
     try:
         gdal.AllRegister()
         
@@ -23,7 +25,7 @@ def generate_contours(dem_path, output_geojson, interval):
         field_defn = ogr.FieldDefn("ELEV", ogr.OFTReal)
         contour_layer.CreateField(field_defn)
 
-        gdal.ContourGenerate(
+        err = gdal.ContourGenerate(
             dem_ds.GetRasterBand(1),
             interval,
             0,
@@ -32,8 +34,11 @@ def generate_contours(dem_path, output_geojson, interval):
             0,
             contour_layer,
             0,
-            0
+            0,
+            callback=gdal_callback(progress, "contours")
         )
+        if err != 0:
+            raise RuntimeError(f"ContourGenerate returned error {err}")
 
         return True
     except Exception as e:
@@ -43,4 +48,22 @@ def generate_contours(dem_path, output_geojson, interval):
         if 'contour_ds' in locals():
             contour_ds = None
         if 'dem_ds' in locals():
-            dem_ds = None
\ No newline at end of file
+            dem_ds = None
+
+
+def contour_service(dem_path, output_geojson, interval, progress=None):
+    """Service-style wrapper around generate_contours returning (response, status)"""
+    try:
+        # Written under a private name and renamed into place once complete
+        with atomic_path(output_geojson) as work_path:
+            if not generate_contours(dem_path, work_path, interval, progress):
+                if progress is not None:
+                    progress.check()
+                raise RuntimeError("Contour generation failed")
+    except (RuntimeError, OperationCancelled) as e:
+        return {"error": str(e)}, 500
+    return {
+        "success": True,
+        "output_path": output_geojson,
+        "interval": interval
+    }, 200
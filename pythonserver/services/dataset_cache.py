@@ -0,0 +1,174 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from osgeo import gdal, osr
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATASET_CACHE_MAX_HANDLES = int(os.getenv("DATASET_CACHE_MAX_HANDLES", 32))
+BLOCK_CACHE_MAX_BYTES = int(os.getenv("BLOCK_CACHE_MAX_BYTES", 256 * 1024 ** 2))  # 256 MB
+
+
+def _wgs84():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+class CachedDataset:
+    """An open raster with its parsed georeferencing, shared between queries.
+
+    GDAL handles are not safe to use from two threads at once, so reads and coordinate
+    transforms go through `lock`.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.lock = threading.Lock()
+        self.ds = gdal.Open(path)
+        if self.ds is None:
+            raise ValueError(f"Could not open raster {path}")
+
+        self.band = self.ds.GetRasterBand(1)
+        self.width = self.ds.RasterXSize
+        self.height = self.ds.RasterYSize
+        self.geotransform = self.ds.GetGeoTransform()
+        self.inverse_geotransform = gdal.InvGeoTransform(self.geotransform)
+        self.nodata = self.band.GetNoDataValue()
+        self.block_size = tuple(self.band.GetBlockSize())
+
+        self.srs = osr.SpatialReference(wkt=self.ds.GetProjection())
+        self.srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        wgs84 = _wgs84()
+        self.is_wgs84 = bool(self.srs.IsSame(wgs84))
+        self.is_geographic = bool(self.srs.IsGeographic())
+        if self.is_wgs84:
+            self._from_wgs84 = self._to_wgs84 = None
+        else:
+            self._from_wgs84 = osr.CoordinateTransformation(wgs84, self.srs)
+            self._to_wgs84 = osr.CoordinateTransformation(self.srs, wgs84)
+
+    def transform(self, points, inverse=False):
+        """TransformPoints from WGS84 into the dataset CRS, or back with inverse=True"""
+        transform = self._to_wgs84 if inverse else self._from_wgs84
+        with self.lock:
+            return transform.TransformPoints(points)
+
+    def read(self, xoff, yoff, width, height):
+        """Read a window as float64 with nodata replaced by NaN"""
+        with self.lock:
+            array = self.band.ReadAsArray(xoff, yoff, width, height)
+        array = array.astype(np.float64)
+        if self.nodata is not None:
+            array[array == self.nodata] = np.nan
+        return array
+
+
+class DatasetCache:
+    """Process-level LRU of open rasters plus a byte-budgeted LRU of decoded windows.
+
+    Entries are keyed by absolute path and validated against the file's (size, mtime) on
+    every lookup, so a replaced file is reopened and its cached blocks are dropped.
+    """
+
+    def __init__(self, max_handles=DATASET_CACHE_MAX_HANDLES, max_block_bytes=BLOCK_CACHE_MAX_BYTES):
+        self.max_handles = max_handles
+        self.max_block_bytes = max_block_bytes
+        self.metrics = {"hits": 0, "misses": 0, "block_hits": 0, "block_misses": 0, "evictions": 0}
+        self._datasets = OrderedDict()
+        self._blocks = OrderedDict()
+        self._block_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """The CachedDataset for path, opening it (and dropping the least recently used) if needed"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        version = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is not None and entry.version == version:
+                self._datasets.move_to_end(key)
+                self.metrics["hits"] += 1
+                return entry
+            self.metrics["misses"] += 1
+
+        opened = CachedDataset(key, version)
+
+        # Evicted handles are not closed here: a query may still be using one, and GDAL
+        # closes it when the last reference goes away
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is not None and entry.version == version:
+                # Another thread opened it meanwhile
+                opened = entry
+            else:
+                if entry is not None:
+                    self._drop_blocks(key)
+                self._datasets[key] = opened
+            self._datasets.move_to_end(key)
+            while len(self._datasets) > self.max_handles:
+                old_key, _ = self._datasets.popitem(last=False)
+                self._drop_blocks(old_key)
+                self.metrics["evictions"] += 1
+        return opened
+
+    def read(self, dataset, xoff, yoff, width, height):
+        """A decoded window of dataset, served from the block cache when it was read before.
+
+        Callers get the cached array itself and must not modify it.
+        """
+        key = (dataset.path, dataset.version, xoff, yoff, width, height)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.metrics["block_hits"] += 1
+                return block
+            self.metrics["block_misses"] += 1
+
+        block = dataset.read(xoff, yoff, width, height)
+        block.setflags(write=False)
+        if block.nbytes > self.max_block_bytes:
+            return block
+
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self._block_bytes += block.nbytes
+            while self._block_bytes > self.max_block_bytes:
+                _, old = self._blocks.popitem(last=False)
+                self._block_bytes -= old.nbytes
+        return block
+
+    def _drop_blocks(self, path):
+        for key in [key for key in self._blocks if key[0] == path]:
+            self._block_bytes -= self._blocks.pop(key).nbytes
+
+    def invalidate(self, path):
+        """Forget a raster and its blocks, e.g. before deleting or overwriting it"""
+        key = os.path.abspath(path)
+        with self._lock:
+            self._datasets.pop(key, None)
+            self._drop_blocks(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.metrics,
+                "open_datasets": len(self._datasets),
+                "max_handles": self.max_handles,
+                "cached_blocks": len(self._blocks),
+                "block_bytes": self._block_bytes,
+                "max_block_bytes": self.max_block_bytes
+            }
+
+
+DATASET_CACHE = DatasetCache()
@@ -0,0 +1,60 @@
+import os
+import re
+import logging
+from .ingest import save_upload, record_digest
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATASET_FOLDER = os.path.join("uploads", "datasets")
+
+_DATASET_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+async def register_dataset(upload, folder=DATASET_FOLDER):
+    """Stream an UploadFile to disk, hashing it on the way, and store it once under its SHA-256 digest.
+
+    Returns (dataset_id, path, created). A raster that is already stored is not written twice.
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    extension = os.path.splitext(upload.filename or "")[1].lower() or ".tif"
+    staging_path = os.path.join(folder, f".incoming_{os.getpid()}_{id(upload)}")
+    try:
+        dataset_id, size = await save_upload(upload, staging_path)
+
+        existing = find_dataset(dataset_id, folder)
+        if existing:
+            logger.info(f"Dataset {dataset_id} already registered ({size} bytes)")
+            return dataset_id, existing, False
+
+        path = os.path.join(folder, f"{dataset_id}{extension}")
+        os.replace(staging_path, path)
+        record_digest(path, dataset_id)
+        logger.info(f"Registered dataset {dataset_id} ({size} bytes)")
+        return dataset_id, path, True
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def find_dataset(dataset_id, folder=DATASET_FOLDER):
+    """Return the stored path for a dataset_id, or None if it is unknown."""
+    if not dataset_id or not _DATASET_ID_RE.match(dataset_id):
+        return None
+    if not os.path.isdir(folder):
+        return None
+
+    for name in os.listdir(folder):
+        if name.startswith(dataset_id) and not name.endswith(".part"):
+            return os.path.join(folder, name)
+    return None
+
+
+def resolve_dataset(dataset_id, folder=DATASET_FOLDER):
+    """Return the stored path for a dataset_id, raising if it was never registered."""
+    path = find_dataset(dataset_id, folder)
+    if path is None:
+        raise FileNotFoundError(f"Unknown dataset_id: {dataset_id}")
+    return path
@@ -0,0 +1,94 @@
+import os
+import base64
+import mimetypes
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+RESPONSE_MODES = ("base64", "handle")
+
+mimetypes.add_type("image/tiff", ".tif")
+mimetypes.add_type("image/tiff", ".tiff")
+mimetypes.add_type("application/geo+json", ".geojson")
+
+
+def resolve_output_path(filename, folder="outputs"):
+    """Map a result handle to a file inside the output folder, refusing anything outside it"""
+    name = os.path.basename(filename or "")
+    if not name or name != filename:
+        raise ValueError(f"Invalid result handle: {filename}")
+    path = os.path.join(folder, name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Result not found: {filename}")
+    return path
+
+
+def file_etag(path):
+    """Cheap validator from size + modification time, quoted as HTTP requires"""
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def media_type_for(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header matches the current ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_byte_range(range_header, size):
+    """Parse a single `bytes=start-end` range into inclusive offsets; raises ValueError if unsatisfiable"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("Only single byte ranges are supported")
+
+    start_text, _, end_text = spec.strip().partition("-")
+    if start_text == "":
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length <= 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def iter_file_range(path, start, end, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield bytes start..end (inclusive) of a file in chunks"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def raster_result(path, response_mode="base64"):
+    """Response fields for a raster output: inline base64, or a small handle to stream from /download"""
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"response_mode must be one of: {', '.join(RESPONSE_MODES)}")
+
+    filename = os.path.basename(path)
+    if response_mode == "handle":
+        return {
+            "result": {
+                "handle": filename,
+                "download_url": f"/download?file={filename}",
+                "size": os.path.getsize(path),
+                "etag": file_etag(path),
+                "media_type": media_type_for(path)
+            }
+        }
+
+    with open(path, "rb") as f:
+        return {"file_base64": base64.b64encode(f.read()).decode("utf-8")}
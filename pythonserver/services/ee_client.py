@@ -0,0 +1,220 @@
+import os
+import math
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import ee
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from osgeo import gdal
+from .progress import OperationCancelled, span, gdal_callback
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EE_PROJECT = os.getenv("EE_PROJECT", "ee-202319022")
+# Interactive ee.Authenticate() is only useful on a developer machine, never inside a request
+EE_INTERACTIVE_AUTH = os.getenv("EE_INTERACTIVE_AUTH", "0") == "1"
+EE_CONCURRENCY = int(os.getenv("EE_CONCURRENCY", 4))
+# getDownloadURL refuses requests over 32 MB of pixel data or 10000 px per side; keep a margin
+EE_MAX_TILE_BYTES = int(os.getenv("EE_MAX_TILE_BYTES", 24 * 1024 ** 2))
+EE_MAX_TILE_SIDE = int(os.getenv("EE_MAX_TILE_SIDE", 8192))
+EE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+EE_DOWNLOAD_TIMEOUT = int(os.getenv("EE_DOWNLOAD_TIMEOUT", 300))
+# Downloads larger than this go to disk even when an in-memory pipeline was asked for
+MEMORY_PIPELINE_MAX_BYTES = int(os.getenv("MEMORY_PIPELINE_MAX_BYTES", 512 * 1024 ** 2))
+
+METRES_PER_DEGREE = 111320.0
+
+
+def _make_session(pool_size):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def plan_grid(bounds, scale, bytes_per_pixel=4, max_tile_bytes=EE_MAX_TILE_BYTES, max_side=EE_MAX_TILE_SIDE):
+    """Cut a lon/lat bounding box into a pixel-aligned grid of download tiles.
+
+    Returns (pixel size in degrees, [(x_offset, y_offset, width, height, tile_bounds)]), with
+    every tile under the getDownloadURL size limits.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    step = scale / METRES_PER_DEGREE
+    width = max(math.ceil((max_x - min_x) / step), 1)
+    height = max(math.ceil((max_y - min_y) / step), 1)
+
+    side = min(max_side, int(math.sqrt(max_tile_bytes / bytes_per_pixel)))
+    tiles = []
+    for y in range(0, height, side):
+        for x in range(0, width, side):
+            tile_w, tile_h = min(side, width - x), min(side, height - y)
+            tile_bounds = (
+                min_x + x * step, max_y - (y + tile_h) * step,
+                min_x + (x + tile_w) * step, max_y - y * step
+            )
+            tiles.append((x, y, tile_w, tile_h, tile_bounds))
+    return step, tiles
+
+
+def grid_bytes(bounds, scale, bytes_per_pixel=4):
+    """Uncompressed size of the raster plan_grid lays over bounds"""
+    min_x, min_y, max_x, max_y = bounds
+    step = scale / METRES_PER_DEGREE
+    return max(math.ceil((max_x - min_x) / step), 1) * max(math.ceil((max_y - min_y) / step), 1) * bytes_per_pixel
+
+
+def is_memory_path(path):
+    return path.startswith("/vsimem/")
+
+
+class EarthEngineClient:
+    """Earth Engine access for the whole process: initialized once, one pooled HTTP session.
+
+    Large regions are split into tiles below the getDownloadURL limit, fetched concurrently
+    in 1 MB chunks and merged through a VRT. `ee_module` and `session` can be swapped for
+    stand-ins to run everything offline.
+    """
+
+    def __init__(self, project=EE_PROJECT, concurrency=EE_CONCURRENCY, ee_module=ee, session=None):
+        self.project = project
+        self.concurrency = concurrency
+        self.ee = ee_module
+        self.session = session or _make_session(concurrency * 2)
+        self.initialized = False
+        self._init_lock = threading.Lock()
+
+    def initialize(self):
+        """Run ee.Initialize once; later calls return straight away"""
+        if self.initialized:
+            return
+        with self._init_lock:
+            if self.initialized:
+                return
+            try:
+                self.ee.Initialize(project=self.project)
+            except Exception:
+                if not EE_INTERACTIVE_AUTH:
+                    logger.error("Earth Engine initialization failed; configure credentials for this server")
+                    raise
+                logger.warning("Earth Engine not initialized. Authenticating...")
+                self.ee.Authenticate()
+                self.ee.Initialize(project=self.project)
+            self.initialized = True
+            logger.info("Earth Engine initialized successfully")
+
+    def _download_tile(self, image, crs, step, tile, destination):
+        x, y, tile_w, tile_h, (min_x, _, _, max_y) = tile
+        url = image.getDownloadURL({
+            "format": "GEO_TIFF",
+            "crs": crs,
+            # Explicit grid so neighbouring tiles share pixel edges
+            "crs_transform": [step, 0, min_x, 0, -step, max_y],
+            "dimensions": f"{tile_w}x{tile_h}"
+        })
+        with self.session.get(url, stream=True, timeout=EE_DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise Exception(f"Earth Engine download failed ({response.status_code}): {response.text}")
+            if is_memory_path(destination):
+                # A tile is under the getDownloadURL limit, so it is assembled in memory in one piece
+                gdal.FileFromMemBuffer(
+                    destination, b"".join(response.iter_content(chunk_size=EE_DOWNLOAD_CHUNK_SIZE))
+                )
+                return destination
+            with open(destination, "wb") as f:
+                for chunk in response.iter_content(chunk_size=EE_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        return destination
+
+    def download_image(self, image, bounds, scale, destination, crs="EPSG:4326", bytes_per_pixel=4, progress=None):
+        """Download an ee.Image over lon/lat bounds to a GeoTIFF at destination, tiling as needed.
+
+        A /vsimem/ destination keeps everything in memory: the tiles are fetched next to it and,
+        when there is more than one, a VRT mosaic over them takes the place of the merged copy.
+        Returns the path to read, which is then that VRT; the tiles live until the /vsimem/
+        directory is cleaned up. progress is updated per finished tile; once it is cancelled the
+        tiles not started yet are dropped.
+        """
+        self.initialize()
+        step, tiles = plan_grid(bounds, scale, bytes_per_pixel)
+        in_memory = is_memory_path(destination)
+        if in_memory:
+            stem = os.path.splitext(destination)[0]
+            paths = [destination] if len(tiles) == 1 else [f"{stem}_tile_{i}.tif" for i in range(len(tiles))]
+        else:
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            tile_dir = tempfile.mkdtemp(prefix="ee_tiles_")
+            paths = [os.path.join(tile_dir, f"tile_{i}.tif") for i in range(len(tiles))]
+
+        completed = False
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(tiles))) as executor:
+                futures = [
+                    executor.submit(self._download_tile, image, crs, step, tile, path)
+                    for tile, path in zip(tiles, paths)
+                ]
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        future.result()
+                        if progress is not None and not progress.update(done / len(tiles) * 0.9, "downloading tiles"):
+                            raise OperationCancelled("Operation cancelled")
+                finally:
+                    for future in futures:
+                        future.cancel()
+
+            if len(paths) == 1:
+                if not in_memory:
+                    shutil.move(paths[0], destination)
+            elif in_memory:
+                destination = f"{stem}.vrt"
+                vrt = gdal.BuildVRT(destination, paths)
+                if vrt is None:
+                    raise RuntimeError("Could not mosaic Earth Engine tiles")
+                vrt = None
+            else:
+                vrt_path = os.path.join(tile_dir, "mosaic.vrt")
+                vrt = gdal.BuildVRT(vrt_path, paths)
+                if vrt is None:
+                    raise RuntimeError("Could not mosaic Earth Engine tiles")
+                vrt = None
+                ds = gdal.Translate(
+                    destination, vrt_path,
+                    options=gdal.TranslateOptions(
+                        format="GTiff", creationOptions=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+                        callback=gdal_callback(span(progress, 0.9, 1.0), "mosaicking tiles")
+                    )
+                )
+                if progress is not None:
+                    progress.check()
+                if ds is None:
+                    raise RuntimeError(f"Could not write {destination}")
+                ds = None
+            completed = True
+        finally:
+            if not in_memory:
+                shutil.rmtree(tile_dir, ignore_errors=True)
+            elif not completed:
+                for path in paths:
+                    gdal.Unlink(path)
+
+        logger.info(f"Downloaded {destination} from Earth Engine in {len(tiles)} tile(s)")
+        return destination
+
+    def region_bounds(self, region):
+        """(min_x, min_y, max_x, max_y) of an ee.Geometry"""
+        coords = region.bounds().getInfo()["coordinates"][0]
+        return (
+            min(c[0] for c in coords), min(c[1] for c in coords),
+            max(c[0] for c in coords), max(c[1] for c in coords)
+        )
+
+
+EE_CLIENT = EarthEngineClient()
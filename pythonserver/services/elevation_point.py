@@ -1,7 +1,7 @@
 import os
-import math
+import json
 import numpy as np
-from osgeo import gdal, osr
+from .dataset_cache import DATASET_CACHE
 
 def elevation_point_service(dem_path, lon, lat):
     """Get elevation at a given point (lon, lat) from DEM"""
@@ -9,38 +9,256 @@ def elevation_point_service(dem_path, lon, lat):
         return {"error": f"DEM file not found: {dem_path}"}, 400
 
     try:
-        ds = gdal.Open(dem_path)
-        if ds is None:
+        try:
+            dataset = DATASET_CACHE.get(dem_path)
+        except ValueError:
             return {"error": "Failed to open DEM file"}, 500
 
-        # Get spatial reference and transformation
-        gt = ds.GetGeoTransform()
-        proj = osr.SpatialReference(wkt=ds.GetProjection())
-
-        wgs84 = osr.SpatialReference()
-        wgs84.ImportFromEPSG(4326)
-        transform = osr.CoordinateTransformation(wgs84, proj)
-
-        x, y, _ = transform.TransformPoint(lon, lat)
-
         # Pixel coordinates
-        px = int((x - gt[0]) / gt[1])
-        py = int((y - gt[3]) / gt[5])
-
-        # Read elevation
-        band = ds.GetRasterBand(1)
-        if px < 0 or py < 0 or px >= ds.RasterXSize or py >= ds.RasterYSize:
+        xs, ys = transform_points(dataset, [lon], [lat])
+        cols, rows = world_to_pixel(dataset, xs, ys)
+        if cols[0] < 0 or rows[0] < 0 or cols[0] >= dataset.width or rows[0] >= dataset.height:
             return {"error": "Point is outside DEM extent"}, 400
 
-        elevation = band.ReadAsArray(px, py, 1, 1)[0][0]
+        # Read elevation from the (cached) block holding the pixel
+        elevation = sample_band(dataset, cols, rows, "nearest")[0]
 
-        ds = None
         return {
             "success": True,
             "lon": lon,
             "lat": lat,
-            "elevation": float(elevation)
+            "elevation": None if np.isnan(elevation) else float(elevation)
+        }, 200
+
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+MAX_POINTS = int(os.getenv("MAX_ELEVATION_POINTS", 5_000_000))
+# Points payloads are refused above this size before any parsing; ~64 bytes per point is ample
+MAX_POINTS_BYTES = int(os.getenv("MAX_ELEVATION_POINTS_BYTES", MAX_POINTS * 64))
+INTERPOLATION_METHODS = ("nearest", "bilinear")
+POINT_FORMATS = ("auto", "json", "csv", "geojson")
+TRANSFORM_CHUNK = 100_000
+
+
+def _points_from_geojson(data):
+    """Collect (lon, lat) pairs from Point / MultiPoint geometries, features or collections"""
+    kind = data.get("type")
+    if kind == "FeatureCollection":
+        return [pair for feature in data.get("features", []) for pair in _points_from_geojson(feature)]
+    if kind == "Feature":
+        return _points_from_geojson(data.get("geometry") or {})
+    if kind == "GeometryCollection":
+        return [pair for geometry in data.get("geometries", []) for pair in _points_from_geojson(geometry)]
+    if kind == "Point":
+        return [data["coordinates"][:2]]
+    if kind in ("MultiPoint", "LineString"):
+        return [coords[:2] for coords in data["coordinates"]]
+    if kind == "MultiLineString":
+        return [coords[:2] for line in data["coordinates"] for coords in line]
+    raise ValueError(f"Unsupported GeoJSON geometry type: {kind}")
+
+
+def _points_from_csv(text):
+    """lon,lat rows; a header naming lon/lng/longitude/x and lat/latitude/y picks the columns"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return np.empty((0, 2))
+
+    header = [name.strip().lower() for name in lines[0].split(",")]
+    lon_col, lat_col = 0, 1
+    try:
+        [float(value) for value in header[:2]]
+    except ValueError:
+        lon_names, lat_names = ("lon", "lng", "long", "longitude", "x"), ("lat", "latitude", "y")
+        lon_col = next((i for i, name in enumerate(header) if name in lon_names), None)
+        lat_col = next((i for i, name in enumerate(header) if name in lat_names), None)
+        if lon_col is None or lat_col is None:
+            raise ValueError("CSV header needs lon/lat columns")
+        lines = lines[1:]
+
+    table = np.loadtxt(lines, delimiter=",", usecols=(lon_col, lat_col), ndmin=2)
+    return table
+
+
+def parse_points(payload, fmt="auto"):
+    """Parse coordinates sent as a JSON array, CSV text or GeoJSON into (lons, lats) arrays.
+
+    JSON arrays may hold [lon, lat] pairs or {"lon": .., "lat": ..} objects.
+    """
+    if fmt not in POINT_FORMATS:
+        raise ValueError(f"Point format must be one of: {', '.join(POINT_FORMATS)}")
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8-sig")
+    text = payload.strip()
+
+    if fmt == "auto":
+        fmt = "csv" if not text.startswith(("[", "{")) else "json"
+
+    if fmt == "csv":
+        coords = _points_from_csv(text)
+    else:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            coords = _points_from_geojson(data)
+        elif not isinstance(data, list):
+            raise ValueError("JSON points must be an array or a GeoJSON object")
+        elif data and isinstance(data[0], dict):
+            coords = [(p.get("lon", p.get("longitude")), p.get("lat", p.get("latitude"))) for p in data]
+        else:
+            coords = data
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2) if len(coords) else np.empty((0, 2))
+
+    if len(coords) > MAX_POINTS:
+        raise ValueError(f"Too many points ({len(coords)}), the limit is {MAX_POINTS}")
+    return coords[:, 0], coords[:, 1]
+
+
+def read_points(path, fmt="auto"):
+    """parse_points() on a saved points file"""
+    with open(path, "rb") as f:
+        return parse_points(f.read(), fmt)
+
+
+def transform_points(dataset, xs, ys, inverse=False):
+    """Project WGS84 lon/lat arrays into the dataset CRS (or back, with inverse=True) in batched calls"""
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if dataset.is_wgs84:
+        return xs, ys
+
+    out_x = np.empty(len(xs))
+    out_y = np.empty(len(xs))
+    for start in range(0, len(xs), TRANSFORM_CHUNK):
+        stop = start + TRANSFORM_CHUNK
+        points = np.column_stack((xs[start:stop], ys[start:stop])).tolist()
+        projected = np.asarray(dataset.transform(points, inverse=inverse))
+        out_x[start:stop] = projected[:, 0]
+        out_y[start:stop] = projected[:, 1]
+    return out_x, out_y
+
+
+def world_to_pixel(dataset, xs, ys):
+    """Fractional pixel coordinates (column, row) for georeferenced x/y arrays"""
+    inv = dataset.inverse_geotransform
+    cols = inv[0] + inv[1] * xs + inv[2] * ys
+    rows = inv[3] + inv[4] * xs + inv[5] * ys
+    return cols, rows
+
+
+def _check_method(method):
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError(f"Interpolation must be one of: {', '.join(INTERPOLATION_METHODS)}")
+
+
+def _anchor_pixels(cols, rows, width, height, method):
+    """Pixel each sample is read from (top-left of the 2x2 for bilinear) and whether it is on the raster"""
+    if method == "bilinear":
+        # Pixel centres sit at +0.5
+        fx, fy = cols - 0.5, rows - 0.5
+        inside = (fx >= -0.5) & (fy >= -0.5) & (fx <= width - 0.5) & (fy <= height - 0.5)
+        x0 = np.clip(np.floor(np.where(inside, fx, 0)), 0, width - 1).astype(np.int64)
+        y0 = np.clip(np.floor(np.where(inside, fy, 0)), 0, height - 1).astype(np.int64)
+    else:
+        inside = (cols >= 0) & (rows >= 0) & (cols < width) & (rows < height)
+        x0 = np.floor(np.where(inside, cols, 0)).astype(np.int64)
+        y0 = np.floor(np.where(inside, rows, 0)).astype(np.int64)
+    return x0, y0, inside
+
+
+def sample_array(array, cols, rows, method="nearest"):
+    """Sample a 2D array (NaN for nodata) at fractional pixel positions; NaN for points outside it"""
+    _check_method(method)
+    height, width = array.shape
+    values = np.full(len(cols), np.nan)
+    x0, y0, inside = _anchor_pixels(cols, rows, width, height, method)
+    index = np.flatnonzero(inside)
+    x0, y0 = x0[index], y0[index]
+
+    if method == "nearest":
+        values[index] = array[y0, x0]
+        return values
+
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    # Clamp the weights at the edge, where there is no neighbour to blend with
+    tx = np.clip(cols[index] - 0.5 - x0, 0.0, 1.0)
+    ty = np.clip(rows[index] - 0.5 - y0, 0.0, 1.0)
+    top = array[y0, x0] * (1 - tx) + array[y0, x1] * tx
+    bottom = array[y1, x0] * (1 - tx) + array[y1, x1] * tx
+    values[index] = top * (1 - ty) + bottom * ty
+    return values
+
+
+def sample_band(dataset, cols, rows, method="nearest"):
+    """Sample band 1 at fractional pixel positions, reading each raster block that holds points once.
+
+    Points are grouped by the block of their (top-left) sample pixel; bilinear reads the block
+    plus a one pixel margin so neighbours across the block edge are available.
+    Blocks come through the dataset cache, so repeated queries on a warm DEM do not decode again.
+    Returns float64 values with NaN for points outside the raster or on nodata.
+    """
+    _check_method(method)
+    width, height = dataset.width, dataset.height
+    block_w, block_h = dataset.block_size
+    # Strip-organised rasters report one-row blocks; read them in taller bands instead
+    block_h = max(block_h, min(256, height))
+
+    values = np.full(len(cols), np.nan)
+    x0, y0, inside = _anchor_pixels(cols, rows, width, height, method)
+    index = np.flatnonzero(inside)
+    if not len(index):
+        return values
+
+    blocks_across = (width + block_w - 1) // block_w
+    block_ids = (y0[index] // block_h) * blocks_across + (x0[index] // block_w)
+    order = np.argsort(block_ids, kind="stable")
+    index, block_ids = index[order], block_ids[order]
+    boundaries = np.flatnonzero(np.diff(block_ids)) + 1
+
+    margin = 1 if method == "bilinear" else 0
+    for group in np.split(index, boundaries):
+        bx = int(x0[group[0]] // block_w) * block_w
+        by = int(y0[group[0]] // block_h) * block_h
+        block = DATASET_CACHE.read(
+            dataset, bx, by, min(block_w + margin, width - bx), min(block_h + margin, height - by)
+        )
+        values[group] = sample_array(block, cols[group] - bx, rows[group] - by, method)
+
+    return values
+
+
+def elevation_points_service(dem_path, lons, lats, interpolation="nearest"):
+    """Sample DEM elevations for many WGS84 points in one pass"""
+    if not os.path.exists(dem_path):
+        return {"error": f"DEM file not found: {dem_path}"}, 400
+    if interpolation not in INTERPOLATION_METHODS:
+        return {"error": f"interpolation must be one of: {', '.join(INTERPOLATION_METHODS)}"}, 400
+
+    try:
+        try:
+            dataset = DATASET_CACHE.get(dem_path)
+        except ValueError:
+            return {"error": "Failed to open DEM file"}, 500
+
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        xs, ys = transform_points(dataset, lons, lats)
+        cols, rows = world_to_pixel(dataset, xs, ys)
+        elevations = sample_band(dataset, cols, rows, interpolation)
+
+        valid = ~np.isnan(elevations)
+        return {
+            "success": True,
+            "count": int(len(elevations)),
+            "valid_count": int(valid.sum()),
+            "interpolation": interpolation,
+            "lons": lons.tolist(),
+            "lats": lats.tolist(),
+            # null for points outside the DEM or on nodata
+            "elevations": np.where(valid, np.round(elevations, 3), None).tolist()
         }, 200
 
     except Exception as e:
-        return {"error": str(e)}, 500
\ No newline at end of file
+        return {"error": str(e)}, 500
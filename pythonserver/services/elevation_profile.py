@@ -1,76 +1,123 @@
 import os
-import math
 import numpy as np
-from osgeo import gdal, osr
+from .dataset_cache import DATASET_CACHE
+from .elevation_point import transform_points, world_to_pixel, sample_array, sample_band, INTERPOLATION_METHODS
 
+MAX_PROFILE_SAMPLES = int(os.getenv("MAX_PROFILE_SAMPLES", 100_000))
+# Larger bounding windows are sampled block by block instead of in one read
+MAX_WINDOW_PIXELS = int(os.getenv("MAX_PROFILE_WINDOW_PIXELS", 64 * 1024 * 1024))
+PROFILE_COLUMNS = ("distance", "elevation", "longitude", "latitude")
+EARTH_RADIUS = 6371008.8
 
-def elevation_profile_service(dem_path, lon1, lat1, lon2, lat2, samples=50):
-    """Get elevation profile between two points, including lat/lon"""
-    if not os.path.exists(dem_path):
-        return {"error": f"DEM file not found: {dem_path}"}, 400
-
-    try:
-        ds = gdal.Open(dem_path)
-        if ds is None:
-            return {"error": "Failed to open DEM file"}, 500
 
-        gt = ds.GetGeoTransform()
-        proj = osr.SpatialReference(wkt=ds.GetProjection())
+def _haversine(lons, lats):
+    """Great-circle length in metres of each step between consecutive lon/lat points"""
+    lon, lat = np.radians(lons), np.radians(lats)
+    dlon, dlat = np.diff(lon), np.diff(lat)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
 
-        wgs84 = osr.SpatialReference()
-        wgs84.ImportFromEPSG(4326)
 
-        # Transform from WGS84 to DEM projection
-        transform_to_proj = osr.CoordinateTransformation(wgs84, proj)
-        # Transform from DEM projection back to WGS84
-        transform_to_wgs84 = osr.CoordinateTransformation(proj, wgs84)
+def densify(xs, ys, samples):
+    """samples + 1 evenly spaced positions along the polyline through (xs, ys)"""
+    steps = np.hypot(np.diff(xs), np.diff(ys))
+    along = np.concatenate(([0.0], np.cumsum(steps)))
+    targets = np.linspace(0.0, along[-1], samples + 1)
+    return np.interp(targets, along, xs), np.interp(targets, along, ys)
 
-        x1, y1, _ = transform_to_proj.TransformPoint(lon1, lat1)
-        x2, y2, _ = transform_to_proj.TransformPoint(lon2, lat2)
 
-        total_distance = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-        distances = []
-        elevations = []
-        lats = []
-        lons = []
+def _sample_profile(dataset, cols, rows, interpolation):
+    """Read the window around the profile once; fall back to block reads when it is too large"""
+    width, height = dataset.width, dataset.height
+    x_min = max(int(np.floor(np.nanmin(cols))) - 1, 0)
+    y_min = max(int(np.floor(np.nanmin(rows))) - 1, 0)
+    x_max = min(int(np.ceil(np.nanmax(cols))) + 1, width)
+    y_max = min(int(np.ceil(np.nanmax(rows))) + 1, height)
 
-        band = ds.GetRasterBand(1)
+    if x_max <= x_min or y_max <= y_min:
+        return np.full(len(cols), np.nan)
+    if (x_max - x_min) * (y_max - y_min) > MAX_WINDOW_PIXELS:
+        return sample_band(dataset, cols, rows, interpolation)
 
-        for i in range(samples + 1):
-            t = i / samples
-            x = x1 + t * (x2 - x1)
-            y = y1 + t * (y2 - y1)
+    window = dataset.read(x_min, y_min, x_max - x_min, y_max - y_min)
+    return sample_array(window, cols - x_min, rows - y_min, interpolation)
 
-            px = int((x - gt[0]) / gt[1])
-            py = int((y - gt[3]) / gt[5])
 
-            if px < 0 or py < 0 or px >= ds.RasterXSize or py >= ds.RasterYSize:
-                continue
+def elevation_profile_service(dem_path, vertices, samples=50, interpolation="nearest"):
+    """Get an elevation profile along a polyline of (lon, lat) vertices.
 
-            arr = band.ReadAsArray(px, py, 1, 1)
-            if arr is None:
-                continue
-
-            elevation = arr[0][0]
-            lon_lat = transform_to_wgs84.TransformPoint(x, y)  # (lon, lat, z)
-            lon_pt, lat_pt = lon_lat[0], lon_lat[1]
-
-            distances.append(total_distance * t)
-            elevations.append(float(elevation))
-            lons.append(lon_pt)
-            lats.append(lat_pt)
+    The result is columnar: parallel distance / elevation / longitude / latitude arrays with
+    samples + 1 entries. Samples off the DEM or on nodata keep their place with a null elevation.
+    """
+    if not os.path.exists(dem_path):
+        return {"error": f"DEM file not found: {dem_path}"}, 400
+    if len(vertices) < 2:
+        return {"error": "A profile needs at least two vertices"}, 400
+    if not 1 <= samples <= MAX_PROFILE_SAMPLES:
+        return {"error": f"samples must be between 1 and {MAX_PROFILE_SAMPLES}"}, 400
+    if interpolation not in INTERPOLATION_METHODS:
+        return {"error": f"interpolation must be one of: {', '.join(INTERPOLATION_METHODS)}"}, 400
 
-        ds = None
+    try:
+        try:
+            dataset = DATASET_CACHE.get(dem_path)
+        except ValueError:
+            return {"error": "Failed to open DEM file"}, 500
 
-        profile = [
-            {"distance": d, "elevation": e, "longitude": lo, "latitude": la}
-            for d, e, lo, la in zip(distances, elevations, lons, lats)
-        ]
+        vertices = np.asarray(vertices, dtype=np.float64)
+        vx, vy = transform_points(dataset, vertices[:, 0], vertices[:, 1])
+        xs, ys = densify(vx, vy, samples)
+
+        cols, rows = world_to_pixel(dataset, xs, ys)
+        elevations = _sample_profile(dataset, cols, rows, interpolation)
+        lons, lats = transform_points(dataset, xs, ys, inverse=True)
+
+        # Distances in metres: geodesic for geographic DEMs, planar in the DEM CRS otherwise
+        steps = _haversine(lons, lats) if dataset.is_geographic else np.hypot(np.diff(xs), np.diff(ys))
+        distances = np.concatenate(([0.0], np.cumsum(steps)))
+
+        valid = ~np.isnan(elevations)
+        summary = {"length": float(distances[-1]), "valid_count": int(valid.sum())}
+        if valid.any():
+            climbs = np.diff(elevations[valid])
+            summary.update({
+                "min_elevation": float(elevations[valid].min()),
+                "max_elevation": float(elevations[valid].max()),
+                "total_ascent": float(climbs[climbs > 0].sum()),
+                "total_descent": float(np.abs(climbs[climbs < 0]).sum())
+            })
 
         return {
             "success": True,
-            "profile": profile
+            "count": int(len(distances)),
+            "columns": {
+                "distance": distances,
+                "elevation": elevations,
+                "longitude": lons,
+                "latitude": lats
+            },
+            "summary": summary
         }, 200
 
     except Exception as e:
         return {"error": str(e)}, 500
+
+
+def profile_records(columns):
+    """The columnar profile as a list of {distance, elevation, longitude, latitude} dicts"""
+    lists = profile_lists(columns)
+    return [dict(zip(PROFILE_COLUMNS, row)) for row in zip(*(lists[name] for name in PROFILE_COLUMNS))]
+
+
+def profile_lists(columns):
+    """JSON ready parallel arrays, with null for missing elevations"""
+    lists = {name: np.round(columns[name], 8).tolist() for name in ("longitude", "latitude")}
+    lists["distance"] = np.round(columns["distance"], 3).tolist()
+    elevation = columns["elevation"]
+    lists["elevation"] = np.where(np.isnan(elevation), None, np.round(elevation, 3)).tolist()
+    return lists
+
+
+def profile_binary(columns):
+    """Little-endian float64 columns back to back, in PROFILE_COLUMNS order; NaN marks missing elevation"""
+    return np.stack([columns[name] for name in PROFILE_COLUMNS]).astype("<f8").tobytes()
@@ -1,9 +1,13 @@
 import os
-import numpy as np
 from osgeo import gdal
+from .terrain import run_tiled
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
+from .workspace import unique_output_path
+from .raster_stats import raster_stats
 
 
-def hillshade_service(dem_path, z_factor=1.0, azimuth=315, altitude=45, scale=1.0):
+def hillshade_service(dem_path, z_factor=1.0, azimuth=315, altitude=45, scale=1.0, tiled=False, workers=None, progress=None):
     """Generate hillshade from an existing DEM file."""
     gdal.AllRegister()
 
@@ -15,25 +19,34 @@ def hillshade_service(dem_path, z_factor=1.0, azimuth=315, altitude=45, scale=1.
         return {"error": "Could not open DEM file"}, 500
 
     try:
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        hillshade_path = os.path.join(temp_dir, f"hillshade_{os.path.basename(dem_path)}")
+        hillshade_path = unique_output_path("hillshade", dem_path)
 
-        # Correct way: use DEMProcessingOptions
-        dem_options = gdal.DEMProcessingOptions(
-            azimuth=azimuth,
-            altitude=altitude,
-            zFactor=z_factor,
-            scale=scale,
-            computeEdges=True
-        )
+        # Producer writes a work file that is turned into a COG with overviews
+        with cog_output(hillshade_path, progress=span(progress, 0.8, 1.0)) as work_path:
+            if tiled:
+                # Windowed, multi-core execution for DEMs larger than RAM
+                run_tiled(dem_path, "hillshade", work_path, workers=workers,
+                          z_factor=z_factor, scale=scale, azimuth=azimuth, altitude=altitude,
+                          progress=span(progress, 0.0, 0.8))
+            else:
+                # Correct way: use DEMProcessingOptions
+                dem_options = gdal.DEMProcessingOptions(
+                    azimuth=azimuth,
+                    altitude=altitude,
+                    zFactor=z_factor,
+                    scale=scale,
+                    computeEdges=True,
+                    format="GTiff",
+                    creationOptions=WORK_CREATION_OPTIONS,
+                    callback=gdal_callback(span(progress, 0.0, 0.8), "hillshade")
+                )
 
-        gdal.DEMProcessing(
-            hillshade_path,
-            dem_path,
-            "hillshade",
-            options=dem_options
-        )
+                gdal.DEMProcessing(
+                    work_path,
+                    dem_path,
+                    "hillshade",
+                    options=dem_options
+                )
 
         return {
             "success": True,
@@ -47,19 +60,16 @@ def hillshade_service(dem_path, z_factor=1.0, azimuth=315, altitude=45, scale=1.
 
 
 def compute_hillshade_stats(hillshade_path):
-    """Compute min, max, mean + histogram for hillshade raster"""
-    ds = gdal.Open(hillshade_path)
-    band = ds.GetRasterBand(1)
-    arr = band.ReadAsArray().astype(np.uint8)
+    """Compute min, max, mean + histogram for hillshade raster in one blockwise pass"""
+    stats, _, _ = raster_stats(hillshade_path, bins=256, hist_range=(0, 255), ignore_nodata=False)
 
     # Basic statistics
-    min_val = int(np.min(arr))
-    max_val = int(np.max(arr))
-    mean_val = float(np.mean(arr))
+    min_val = int(stats.min)
+    max_val = int(stats.max)
+    mean_val = stats.mean
 
     # Histogram (0–255 bins)
-    hist, _ = np.histogram(arr, bins=256, range=(0, 255))
-    histogram = hist.tolist()
+    histogram = stats.histogram.tolist()
 
     return {
         "min": min_val,
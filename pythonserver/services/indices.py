@@ -1,276 +1,267 @@
-import rasterio
-from rasterio.warp import reproject, Resampling
-import numpy as np
 import os
+import re
+import json
+import shutil
+import logging
+import zipfile
+from osgeo import gdal
+from .band_math import band_math_service, BandMathPlan, Expression, BandMathError
+from .output_writer import cog_output, write_cog, work_path_for
+from .progress import span
+from .workspace import unique_output_path, new_token, OUTPUT_FOLDER
 
-def _resample_to_match(source_path, target_profile):
-    """Helper function to resample a source file to match target profile"""
-    with rasterio.open(source_path) as src:
-        # Create destination array
-        data = np.empty((target_profile['height'], target_profile['width']), dtype=np.float32)
-        
-        # Reproject source to match target
-        reproject(
-            source=rasterio.band(src, 1),
-            destination=data,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=target_profile['transform'],
-            dst_crs=target_profile['crs'],
-            resampling=Resampling.bilinear
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Two-band normalized differences; b1 and b2 are the service arguments in order
+INDEX_SPECS = {
+    "ndvi": {
+        "expression": "(b2 - b1) / (b2 + b1)",
+        "index": "NDVI",
+        "formula": "(NIR - Red) / (NIR + Red)",
+        "description": "Normalized Difference Vegetation Index"
+    },
+    "ndwi": {
+        "expression": "(b1 - b2) / (b1 + b2)",
+        "index": "NDWI",
+        "formula": "(Green - NIR) / (Green + NIR)",
+        "description": "Normalized Difference Water Index"
+    },
+    "ndbi": {
+        "expression": "(b2 - b1) / (b2 + b1)",
+        "index": "NDBI",
+        "formula": "(SWIR - NIR) / (SWIR + NIR)",
+        "description": "Normalized Difference Built-up Index"
+    },
+}
+
+
+def index_service(name, band_paths, output_folder="outputs", progress=None):
+    """Compute a named index with the band-math engine; the finer band sets the output grid"""
+    spec = INDEX_SPECS[name]
+    response, status = band_math_service(
+        band_paths, spec["expression"], output_folder=output_folder, name=name,
+        description=spec["index"], progress=progress
+    )
+    if status != 200:
+        return {"error": f"{spec['index']} calculation failed: {response['error']}"}, status
+
+    metadata = response["metadata"]
+    return {
+        "success": True,
+        "output_path": response["output_path"],
+        "metadata": {
+            "index": spec["index"],
+            "formula": spec["formula"],
+            "range": "[-1, 1]",
+            "description": spec["description"],
+            "nodata_value": metadata["nodata_value"],
+            "resolution": metadata["resolution"],
+            "crs": metadata["crs"]
+        }
+    }, 200
+
+
+def ndvi_service(red_band_path: str, nir_band_path: str, output_folder: str = "outputs", progress=None):
+    """Calculate NDVI from Red and NIR bands, resampling on the fly if their grids differ"""
+    return index_service("ndvi", [red_band_path, nir_band_path], output_folder, progress)
+
+
+def ndwi_service(green_band_path: str, nir_band_path: str, output_folder: str = "outputs", progress=None):
+    """Calculate NDWI from Green and NIR bands, resampling on the fly if their grids differ"""
+    return index_service("ndwi", [green_band_path, nir_band_path], output_folder, progress)
+
+
+def ndbi_service(nir_band_path: str, swir_band_path: str, output_folder: str = "outputs", progress=None):
+    """Calculate NDBI from NIR and SWIR bands, resampling on the fly if their grids differ"""
+    return index_service("ndbi", [nir_band_path, swir_band_path], output_folder, progress)
+
+
+# Scene indices over named band roles; reflectance-based (SAVI, EVI) expect reflectance_scale/offset
+SPECTRAL_INDICES = {
+    "ndvi": ("(nir - red) / (nir + red)", "Normalized Difference Vegetation Index"),
+    "gndvi": ("(nir - green) / (nir + green)", "Green Normalized Difference Vegetation Index"),
+    "ndwi": ("(green - nir) / (green + nir)", "Normalized Difference Water Index"),
+    "mndwi": ("(green - swir1) / (green + swir1)", "Modified Normalized Difference Water Index"),
+    "ndbi": ("(swir1 - nir) / (swir1 + nir)", "Normalized Difference Built-up Index"),
+    "ndmi": ("(nir - swir1) / (nir + swir1)", "Normalized Difference Moisture Index"),
+    "nbr": ("(nir - swir2) / (nir + swir2)", "Normalized Burn Ratio"),
+    "savi": ("1.5 * (nir - red) / (nir + red + 0.5)", "Soil Adjusted Vegetation Index (L = 0.5)"),
+    "evi": ("2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)", "Enhanced Vegetation Index"),
+    "bsi": ("((swir1 + red) - (nir + blue)) / ((swir1 + red) + (nir + blue))", "Bare Soil Index"),
+}
+BAND_ROLES = ("blue", "green", "red", "nir", "swir1", "swir2")
+ROLE_ALIASES = {"swir": "swir1"}
+SCENE_OUTPUTS = ("multiband", "files")
+SCENE_RASTER_EXTENSIONS = (".tif", ".tiff", ".jp2", ".img", ".vrt")
+
+
+def parse_indices(indices):
+    """Normalize a comma separated string or list of index names"""
+    if isinstance(indices, str):
+        indices = indices.split(",")
+    names = []
+    for name in indices:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in SPECTRAL_INDICES:
+            raise BandMathError(f"Unknown index '{name}'. Choose from: {', '.join(SPECTRAL_INDICES)}")
+        if name not in names:
+            names.append(name)
+    if not names:
+        raise BandMathError("At least one index is required")
+    return names
+
+
+def parse_band_roles(text):
+    """{role: band} from 'red=4,nir=5' or a JSON object; band is a band number or a file name"""
+    text = (text or "").strip()
+    if text.startswith("{"):
+        try:
+            pairs = json.loads(text).items()
+        except (ValueError, AttributeError):
+            raise BandMathError("band_roles is not a valid JSON object")
+    else:
+        pairs = []
+        for item in filter(None, (part.strip() for part in text.split(","))):
+            if "=" not in item:
+                raise BandMathError(f"Invalid band role '{item}'; use role=band")
+            pairs.append(tuple(part.strip() for part in item.split("=", 1)))
+
+    roles = {}
+    for role, band in pairs:
+        role = ROLE_ALIASES.get(role.lower(), role.lower())
+        if role not in BAND_ROLES:
+            raise BandMathError(f"Unknown band role '{role}'. Choose from: {', '.join(BAND_ROLES)}")
+        roles[role] = band
+    if not roles:
+        raise BandMathError("band_roles is required, e.g. red=4,nir=5")
+    return roles
+
+
+def _scene_member(names, wanted):
+    """The extracted file matching wanted: same name, or the only one whose stem ends with it (e.g. 'B4')"""
+    wanted = str(wanted).lower()
+    exact = [name for name in names if name.lower() == wanted]
+    if exact:
+        return exact[0]
+    matches = [name for name in names if os.path.splitext(name)[0].lower().endswith(wanted)]
+    if len(matches) != 1:
+        raise BandMathError(
+            f"{'No' if not matches else 'More than one'} file in the ZIP matches '{wanted}'"
+            + (f": {', '.join(sorted(matches))}" if matches else "")
         )
-        return data
+    return matches[0]
 
-def ndvi_service(red_band_path: str, nir_band_path: str, output_folder: str = "outputs"):
-    """Calculate NDVI from Red and NIR bands with resampling if needed"""
-    try:
-        print(f"[NDVI SERVICE] Starting with files: {red_band_path} and {nir_band_path}")
-        print(f"[NDVI SERVICE] Output folder: {output_folder}")
-        
-        os.makedirs(output_folder, exist_ok=True)
-        
-        print("[NDVI SERVICE] Opening input files to check dimensions...")
-        with rasterio.open(red_band_path) as red_src, rasterio.open(nir_band_path) as nir_src:
-            # Determine which band to use as reference (use the higher resolution one)
-            if red_src.transform.a < nir_src.transform.a:  # Red has higher resolution
-                reference_src = red_src
-                resample_path = nir_band_path
-                print("[NDVI SERVICE] Using red band as reference for resampling")
-            else:
-                reference_src = nir_src
-                resample_path = red_band_path
-                print("[NDVI SERVICE] Using NIR band as reference for resampling")
-            
-            # Get the profile to match
-            target_profile = reference_src.profile
-            target_profile.update(dtype=rasterio.float32)
-            
-            print("[NDVI SERVICE] Reading and resampling if needed...")
-            # Read reference band
-            if reference_src == red_src:
-                red_band = red_src.read(1).astype(np.float32)
-                nir_band = _resample_to_match(nir_band_path, target_profile)
-            else:
-                nir_band = nir_src.read(1).astype(np.float32)
-                red_band = _resample_to_match(red_band_path, target_profile)
-            
-            # Get nodata values
-            red_nodata = red_src.nodata
-            nir_nodata = nir_src.nodata
-            
-            # Create mask for invalid pixels
-            mask = ((red_band == red_nodata) | 
-                   (nir_band == nir_nodata) | 
-                   ((nir_band + red_band) == 0))
-            
-            print("[NDVI SERVICE] Calculating NDVI...")
-            # Calculate NDVI with proper handling of zeros
-            denominator = nir_band + red_band
-            denominator[denominator == 0] = np.nan  # Avoid division by zero
-            
-            ndvi = (nir_band - red_band) / denominator
-            
-            # Set invalid pixels to a specific nodata value
-            ndvi_nodata = -9999
-            ndvi[mask] = ndvi_nodata
-            
-            output_path = os.path.join(output_folder, f"ndvi_{os.path.basename(red_band_path)}")
-            print(f"[NDVI SERVICE] Creating output: {output_path}")
-            
-            # Create output file with reference profile
-            profile = target_profile.copy()
-            profile.update(
-                dtype=rasterio.float32,
-                count=1,
-                nodata=ndvi_nodata,
-                driver='GTiff'
-            )
-            
-            with rasterio.open(output_path, 'w', **profile) as dst:
-                dst.write(ndvi, 1)
-                dst.set_band_description(1, 'NDVI')
-            
-            print("[NDVI SERVICE] Completed successfully")
-            return {
-                "success": True,
-                "output_path": output_path,
-                "metadata": {
-                    "index": "NDVI",
-                    "formula": "(NIR - Red) / (NIR + Red)",
-                    "range": "[-1, 1]",
-                    "description": "Normalized Difference Vegetation Index",
-                    "nodata_value": ndvi_nodata,
-                    "resolution": profile['transform'].a,
-                    "crs": str(profile['crs'])
-                }
-            }, 200
-            
-    except Exception as e:
-        print(f"[NDVI SERVICE CRITICAL ERROR] {str(e)}")
-        return {"error": f"NDVI calculation failed: {str(e)}"}, 500
 
-def ndwi_service(green_band_path: str, nir_band_path: str, output_folder: str = "outputs"):
-    """Calculate NDWI from Green and NIR bands with resampling if needed"""
+def scene_sources(scene_path, band_roles, extract_dir):
+    """{role: (path, band)} for a multi-band raster (roles are band numbers) or a ZIP of single-band files"""
+    if not zipfile.is_zipfile(scene_path):
+        sources = {}
+        for role, band in band_roles.items():
+            try:
+                sources[role] = (scene_path, int(band))
+            except (TypeError, ValueError):
+                raise BandMathError(f"Band of '{role}' must be a band number for a multi-band raster")
+        return sources
+
+    with zipfile.ZipFile(scene_path) as archive:
+        members = {}
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name.lower().endswith(SCENE_RASTER_EXTENSIONS):
+                continue
+            # Flattened to the base name, so no member can escape extract_dir
+            members[name] = info
+        if not members:
+            raise BandMathError("The ZIP contains no raster files")
+
+        sources = {}
+        for role, wanted in band_roles.items():
+            name = _scene_member(members, wanted)
+            path = os.path.join(extract_dir, name)
+            if not os.path.exists(path):
+                with archive.open(members[name]) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            sources[role] = (path, 1)
+    return sources
+
+
+def scene_indices_service(sources, indices, output="multiband", output_folder=OUTPUT_FOLDER,
+                          reflectance_scale=1.0, reflectance_offset=0.0, resampling="bilinear",
+                          workers=None, progress=None):
+    """Compute several spectral indices from {role: (path, band)} in one windowed pass.
+
+    Every source band is read and decoded once per window, whatever the number of indices.
+    output="multiband" writes one COG with a band per index, "files" one COG per index.
+    """
     try:
-        print(f"[NDWI SERVICE] Starting with files: {green_band_path} and {nir_band_path}")
-        print(f"[NDWI SERVICE] Output folder: {output_folder}")
-        
-        os.makedirs(output_folder, exist_ok=True)
-        
-        print("[NDWI SERVICE] Opening input files to check dimensions...")
-        with rasterio.open(green_band_path) as green_src, rasterio.open(nir_band_path) as nir_src:
-            # Determine which band to use as reference
-            if green_src.transform.a < nir_src.transform.a:  # Green has higher resolution
-                reference_src = green_src
-                resample_path = nir_band_path
-                print("[NDWI SERVICE] Using green band as reference for resampling")
-            else:
-                reference_src = nir_src
-                resample_path = green_band_path
-                print("[NDWI SERVICE] Using NIR band as reference for resampling")
-            
-            target_profile = reference_src.profile
-            target_profile.update(dtype=rasterio.float32)
-            
-            print("[NDWI SERVICE] Reading and resampling if needed...")
-            if reference_src == green_src:
-                green_band = green_src.read(1).astype(np.float32)
-                nir_band = _resample_to_match(nir_band_path, target_profile)
-            else:
-                nir_band = nir_src.read(1).astype(np.float32)
-                green_band = _resample_to_match(green_band_path, target_profile)
-            
-            # Get nodata values
-            green_nodata = green_src.nodata
-            nir_nodata = nir_src.nodata
-            
-            # Create mask for invalid pixels
-            mask = ((green_band == green_nodata) | 
-                   (nir_band == nir_nodata) | 
-                   ((nir_band + green_band) == 0))
-            
-            print("[NDWI SERVICE] Calculating NDWI...")
-            denominator = green_band + nir_band
-            denominator[denominator == 0] = np.nan
-            
-            ndwi = (green_band - nir_band) / denominator
-            
-            ndwi_nodata = -9999
-            ndwi[mask] = ndwi_nodata
-            
-            output_path = os.path.join(output_folder, f"ndwi_{os.path.basename(green_band_path)}")
-            print(f"[NDWI SERVICE] Creating output: {output_path}")
-            
-            profile = target_profile.copy()
-            profile.update(
-                dtype=rasterio.float32,
-                count=1,
-                nodata=ndwi_nodata,
-                driver='GTiff'
-            )
-            
-            with rasterio.open(output_path, 'w', **profile) as dst:
-                dst.write(ndwi, 1)
-                dst.set_band_description(1, 'NDWI')
-            
-            print("[NDWI SERVICE] Completed successfully")
-            return {
-                "success": True,
-                "output_path": output_path,
-                "metadata": {
-                    "index": "NDWI",
-                    "formula": "(Green - NIR) / (Green + NIR)",
-                    "range": "[-1, 1]",
-                    "description": "Normalized Difference Water Index",
-                    "nodata_value": ndwi_nodata,
-                    "resolution": profile['transform'].a,
-                    "crs": str(profile['crs'])
-                }
-            }, 200
-            
-    except Exception as e:
-        print(f"[NDWI SERVICE CRITICAL ERROR] {str(e)}")
-        return {"error": f"NDWI calculation failed: {str(e)}"}, 500
+        indices = parse_indices(indices)
+        if output not in SCENE_OUTPUTS:
+            raise BandMathError(f"output must be one of: {', '.join(SCENE_OUTPUTS)}")
+        roles = {name: [role for role in BAND_ROLES if re.search(rf"\b{role}\b", SPECTRAL_INDICES[name][0])]
+                 for name in indices}
+        needed = [role for role in BAND_ROLES if any(role in used for used in roles.values())]
+        missing = [role for role in needed if role not in sources]
+        if missing:
+            blocked = [name.upper() for name in indices if set(roles[name]) & set(missing)]
+            raise BandMathError(f"{', '.join(blocked)} need band role(s): {', '.join(missing)}")
+        variables = {role: number for number, role in enumerate(needed, 1)}
+        plan = BandMathPlan(
+            [sources[role] for role in needed],
+            [Expression(SPECTRAL_INDICES[name][0], variables) for name in indices],
+            resampling=resampling, scale=reflectance_scale, offset=reflectance_offset
+        )
+    except BandMathError as e:
+        return {"error": str(e)}, 400
 
-def ndbi_service(nir_band_path: str, swir_band_path: str, output_folder: str = "outputs"):
-    """Calculate NDBI from NIR and SWIR bands with resampling if needed"""
+    names = [name.upper() for name in indices]
+    first_path = sources[needed[0]][0]
     try:
-        print(f"[NDBI SERVICE] Starting with files: {nir_band_path} and {swir_band_path}")
-        print(f"[NDBI SERVICE] Output folder: {output_folder}")
-        
-        os.makedirs(output_folder, exist_ok=True)
-        
-        print("[NDBI SERVICE] Opening input files to check dimensions...")
-        with rasterio.open(nir_band_path) as nir_src, rasterio.open(swir_band_path) as swir_src:
-            # Determine which band to use as reference
-            if nir_src.transform.a < swir_src.transform.a:  # NIR has higher resolution
-                reference_src = nir_src
-                resample_path = swir_band_path
-                print("[NDBI SERVICE] Using NIR band as reference for resampling")
-            else:
-                reference_src = swir_src
-                resample_path = nir_band_path
-                print("[NDBI SERVICE] Using SWIR band as reference for resampling")
-            
-            target_profile = reference_src.profile
-            target_profile.update(dtype=rasterio.float32)
-            
-            print("[NDBI SERVICE] Reading and resampling if needed...")
-            if reference_src == nir_src:
-                nir_band = nir_src.read(1).astype(np.float32)
-                swir_band = _resample_to_match(swir_band_path, target_profile)
-            else:
-                swir_band = swir_src.read(1).astype(np.float32)
-                nir_band = _resample_to_match(nir_band_path, target_profile)
-            
-            # Get nodata values
-            nir_nodata = nir_src.nodata
-            swir_nodata = swir_src.nodata
-            
-            # Create mask for invalid pixels
-            mask = ((nir_band == nir_nodata) | 
-                   (swir_band == swir_nodata) | 
-                   ((swir_band + nir_band) == 0))
-            
-            print("[NDBI SERVICE] Calculating NDBI...")
-            denominator = swir_band + nir_band
-            denominator[denominator == 0] = np.nan
-            
-            ndbi = (swir_band - nir_band) / denominator
-            
-            ndbi_nodata = -9999
-            ndbi[mask] = ndbi_nodata
-            
-            output_path = os.path.join(output_folder, f"ndbi_{os.path.basename(nir_band_path)}")
-            print(f"[NDBI SERVICE] Creating output: {output_path}")
-            
-            profile = target_profile.copy()
-            profile.update(
-                dtype=rasterio.float32,
-                count=1,
-                nodata=ndbi_nodata,
-                driver='GTiff'
-            )
-            
-            with rasterio.open(output_path, 'w', **profile) as dst:
-                dst.write(ndbi, 1)
-                dst.set_band_description(1, 'NDBI')
-            
-            print("[NDBI SERVICE] Completed successfully")
-            return {
-                "success": True,
-                "output_path": output_path,
-                "metadata": {
-                    "index": "NDBI",
-                    "formula": "(SWIR - NIR) / (SWIR + NIR)",
-                    "range": "[-1, 1]",
-                    "description": "Normalized Difference Built-up Index",
-                    "nodata_value": ndbi_nodata,
-                    "resolution": profile['transform'].a,
-                    "crs": str(profile['crs'])
-                }
-            }, 200
-            
+        result = {
+            "success": True,
+            "indices": indices,
+            "bands": {role: {"file": os.path.basename(path), "band": band}
+                      for role, (path, band) in sources.items() if role in needed},
+            "metadata": {
+                "formulas": {name: SPECTRAL_INDICES[name][0] for name in indices},
+                "reflectance_scale": reflectance_scale,
+                "reflectance_offset": reflectance_offset,
+                **plan.metadata()
+            }
+        }
+        if output == "multiband":
+            output_path = unique_output_path("indices", first_path, ".tif", folder=output_folder)
+            with cog_output(output_path, progress=span(progress, 0.8, 1.0)) as work_path:
+                plan.render(work_path, names, workers=workers, progress=span(progress, 0.0, 0.8))
+            result["output_path"] = output_path
+            return result, 200
+
+        # One pass into a multi-band work file, then each band is published as its own COG
+        output_paths = {name: unique_output_path(name, first_path, ".tif", folder=output_folder) for name in indices}
+        work_path = work_path_for(output_paths[indices[0]])
+        try:
+            plan.render(work_path, names, workers=workers, progress=span(progress, 0.0, 0.7))
+            step = 0.3 / len(indices)
+            for number, name in enumerate(indices, 1):
+                band_vrt = f"/vsimem/{name}_{new_token()}.vrt"
+                vrt = gdal.Translate(band_vrt, work_path, options=gdal.TranslateOptions(format="VRT", bandList=[number]))
+                try:
+                    write_cog(vrt, output_paths[name],
+                              progress=span(progress, 0.7 + step * (number - 1), 0.7 + step * number))
+                finally:
+                    vrt = None
+                    gdal.Unlink(band_vrt)
+        finally:
+            for leftover in (work_path, f"{work_path}.aux.xml"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        result["outputs"] = output_paths
+        return result, 200
     except Exception as e:
-        print(f"[NDBI SERVICE CRITICAL ERROR] {str(e)}")
-        return {"error": f"NDBI calculation failed: {str(e)}"}, 500
\ No newline at end of file
+        logger.error(f"Scene indices failed: {e}")
+        return {"error": f"Index calculation failed: {str(e)}"}, 500
+    finally:
+        plan.close()
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 4 * 1024 ** 3))  # 4 GB
+
+
+# (path) -> (size, mtime_ns, sha256) for files whose digest is already known
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
+
+def upload_path(folder, filename):
+    """Path inside folder for a client supplied filename, stripped of any directory part"""
+    name = os.path.basename(filename or "") or "upload.bin"
+    return os.path.join(folder, name)
+
+
+def record_digest(path, digest):
+    """Remember the content digest of a file so file_digest() does not hash it again"""
+    stat = os.stat(path)
+    with _digests_lock:
+        _digests[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+
+
+def forget_digest(path):
+    """Drop the memoized digest of a file that is about to be deleted"""
+    with _digests_lock:
+        _digests.pop(os.path.abspath(path), None)
+
+
+def file_digest(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """SHA-256 of a file, memoized on (size, mtime) so unchanged inputs are hashed once"""
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    with _digests_lock:
+        known = _digests.get(key)
+    if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    with _digests_lock:
+        _digests[key] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _write_chunk(buffer, digest, chunk):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def save_upload(upload, destination, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Stream an UploadFile to destination in fixed-size chunks, hashing it on the way.
+
+    Disk writes run in a worker thread so the event loop stays free, and memory use is one chunk
+    whatever the file size. The file only appears at destination once it is complete.
+    Returns (sha256 hexdigest, size in bytes).
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    partial_path = f"{destination}.{os.getpid()}.{id(upload)}.part"
+    try:
+        with open(partial_path, "wb") as buffer:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+
+        os.replace(partial_path, destination)
+        record_digest(destination, digest.hexdigest())
+        return digest.hexdigest(), size
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
@@ -0,0 +1,316 @@
+from contextlib import nullcontext
+import ee
+from sentinelhub import BBox, CRS
+from .jobs import job_operation, JobError
+from .result_cache import cached_service
+from .workspace import unique_output_path, publish, MemoryWorkspace
+from .hillshade import hillshade_service, compute_hillshade_stats
+from .slope import slope_service, compute_slope_stats
+from .aspect import aspect_service
+from .TPI import tpi_service
+from .Roughness import roughness_service
+from .Curvature import curvature_service
+from .terrain import terrain_service
+from .countour import contour_service
+from .indices import ndvi_service, ndwi_service, ndbi_service
+from .landsat import landsat_index_data, write_index_raster, index_statistics, LANDSAT_INDICES, LANDSAT_RESOLUTION
+from .lst import LSTDataDownloader
+from .lulc import LULCDataDownloader
+from .unzip_and_read_shapefile import unzip_and_read_shapefile, unzip_and_read_shapefile_ee, clip_raster_gdal
+from .tiles import resolve_tile_source
+from .zonal_stats import zonal_stats_service
+
+# (form field, dataset parameter, required) for the job inputs, named like the synchronous endpoints
+DEM_INPUT = ("file", "dataset_id", True)
+AOI_INPUT = ("zip_file", "aoi_dataset_id", False)
+
+STATS_MODES = ("server", "local")
+# Local statistics: keep the download and clip in /vsimem, or write them to the job workspace
+PIPELINE_MODES = ("memory", "disk")
+
+
+def _check(response, status, operation):
+    if status != 200:
+        raise JobError(response.get("error", f"{operation} failed"))
+    return response
+
+
+def _register_raster_job(name, service, path_key, params, stats=None):
+    """A DEM -> raster operation run through the result cache, optionally followed by statistics"""
+
+    def run_operation(run):
+        dem_path = run.inputs["file"]
+        run.progress(0.05, f"computing {name}")
+        response = _check(*cached_service(
+            name, [dem_path], run.params, service, dem_path, progress=run.span(0.05, 0.9), **run.params
+        ), name)
+        result = {"outputs": {name: response[path_key]}, "parameters": run.params}
+        if stats:
+            run.progress(0.9, "computing statistics")
+            result.update(stats(response[path_key]))
+        return result
+
+    job_operation(name, inputs=(DEM_INPUT,), params=params)(run_operation)
+
+
+_register_raster_job(
+    "hillshade", hillshade_service, "hillshade_path", ("z_factor", "azimuth", "altitude", "scale", "tiled"),
+    stats=lambda path: dict(zip(("stats", "histogram"), compute_hillshade_stats(path)))
+)
+_register_raster_job(
+    "slope", slope_service, "slope_path", ("slope_format", "scale", "compute_edges", "tiled"),
+    stats=lambda path: dict(zip(("stats", "classification"), compute_slope_stats(path)))
+)
+_register_raster_job("aspect", aspect_service, "aspect_path", ("trigonometric", "zero_for_flat", "tiled"))
+_register_raster_job("tpi", tpi_service, "output_path", ("z_factor", "scale", "tiled"))
+_register_raster_job("roughness", roughness_service, "output_path", ("z_factor", "scale", "tiled"))
+_register_raster_job("curvature", curvature_service, "output_path", ("z_factor", "scale", "tiled"))
+
+
+@job_operation("terrain", inputs=(DEM_INPUT,),
+               params=("products", "z_factor", "scale", "azimuth", "altitude", "slope_format", "workers"))
+def terrain_job(run):
+    run.progress(0.05, "computing terrain products")
+    response = _check(*terrain_service(run.inputs["file"], progress=run.span(0.05, 1.0), **run.params), "terrain")
+    return {"outputs": response["outputs"], "parameters": response["parameters"]}
+
+
+@job_operation("contours", inputs=(DEM_INPUT,), params=("interval",))
+def contours_job(run):
+    dem_path = run.inputs["file"]
+    interval = run.params.get("interval", 20.0)
+    output_geojson = unique_output_path("contours", dem_path, ".geojson")
+    run.progress(0.05, "generating contours")
+    response = _check(*cached_service(
+        "contours", [dem_path], {"interval": interval},
+        contour_service, dem_path, output_geojson, interval, progress=run.span(0.05, 1.0)
+    ), "contours")
+    return {"outputs": {"contours": response["output_path"]}, "parameters": {"interval": interval}}
+
+
+def _register_index_job(name, service, first, second):
+    """Two-band normalized difference from uploaded or registered band rasters"""
+    inputs = ((first, f"{first.split('_')[0]}_dataset_id", True), (second, f"{second.split('_')[0]}_dataset_id", True))
+
+    def run_operation(run):
+        paths = [run.inputs[first], run.inputs[second]]
+        run.progress(0.05, f"computing {name}")
+        response = _check(*cached_service(name, paths, {}, service, *paths, progress=run.span(0.05, 1.0)), name)
+        return {"outputs": {name: response["output_path"]}, "metadata": response.get("metadata")}
+
+    job_operation(name, inputs=inputs)(run_operation)
+
+
+_register_index_job("ndvi", ndvi_service, "red_band", "nir_band")
+_register_index_job("ndwi", ndwi_service, "green_band", "nir_band")
+_register_index_job("ndbi", ndbi_service, "nir_band", "swir_band")
+
+
+@job_operation("zonal_stats", inputs=(("file", "dataset_id", False), ("zones", "zones_dataset_id", True)),
+               params=("product_id", "histogram", "output_format", "all_touched"))
+def zonal_stats_job(run):
+    """Statistics of an uploaded, registered or server-produced raster (product_id) per zone polygon"""
+    product_id = run.params.get("product_id")
+    if product_id:
+        try:
+            raster_path = resolve_tile_source(product_id)
+        except (ValueError, FileNotFoundError) as e:
+            raise JobError(str(e))
+    elif run.inputs.get("file"):
+        raster_path = run.inputs["file"]
+    else:
+        raise JobError("Provide file, dataset_id or product_id")
+
+    zones_path = run.inputs["zones"]
+    options = {name: run.params[name] for name in ("histogram", "output_format", "all_touched") if name in run.params}
+    run.progress(0.05, "computing zonal statistics")
+    response = _check(*cached_service(
+        "zonal_stats", [raster_path, zones_path], {**options, "product_name": product_id},
+        zonal_stats_service, raster_path, zones_path, product_name=product_id, progress=run.span(0.05, 1.0),
+        **options
+    ), "zonal_stats")
+    return {
+        "outputs": {"zonal_stats": response["output_path"]},
+        "zones": response["zones"],
+        "zones_with_data": response["zones_with_data"],
+        "histogram": response["histogram"]
+    }
+
+
+def _bbox(value):
+    """[minX, minY, maxX, maxY] from a 'minX,minY,maxX,maxY' string or a list"""
+    coords = value.split(",") if isinstance(value, str) else value
+    try:
+        coords = [float(v) for v in coords]
+    except (TypeError, ValueError):
+        raise JobError(f"Invalid bbox: {value}")
+    if len(coords) != 4:
+        raise JobError("bbox must be minX,minY,maxX,maxY")
+    return coords
+
+
+def _time_interval(params):
+    start, end = params.get("time_start"), params.get("time_end")
+    return (start, end) if start and end else None
+
+
+def _landsat_index(run):
+    """(service, index array, lon/lat bounds) for the job's AOI"""
+    service = str(run.params.get("service", "")).lower()
+    if service not in LANDSAT_INDICES:
+        raise JobError(f"service must be one of: {', '.join(LANDSAT_INDICES)}")
+
+    bbox_sh = geometry = None
+    if run.params.get("bbox"):
+        bounds = _bbox(run.params["bbox"])
+        bbox_sh = BBox(bbox=bounds, crs=CRS.WGS84)
+    elif run.inputs.get("zip_file"):
+        geometry, aoi = unzip_and_read_shapefile(run.inputs["zip_file"])
+        bounds = list(aoi.bounds)
+    else:
+        raise JobError("Provide either bbox or an AOI file")
+
+    run.progress(0.1, "fetching Landsat bands")
+    data = landsat_index_data(
+        run.context["sh_config"], service, bbox=bbox_sh, geometry=geometry,
+        time_interval=_time_interval(run.params),
+        resolution=float(run.params.get("resolution", LANDSAT_RESOLUTION))
+    )
+    return service, data, bounds
+
+
+LANDSAT_PARAMS = ("service", "time_start", "time_end", "bbox", "resolution")
+
+
+@job_operation("landsat_indices", inputs=(AOI_INPUT,), params=LANDSAT_PARAMS)
+def landsat_indices_job(run):
+    service, data, bounds = _landsat_index(run)
+    run.progress(0.8, "writing raster")
+    output_path = write_index_raster(data, bounds, unique_output_path(service, ext=".tiff"))
+    return {"outputs": {service: output_path}}
+
+
+@job_operation("landsat_indices_statistics", inputs=(AOI_INPUT,), params=LANDSAT_PARAMS)
+def landsat_indices_statistics_job(run):
+    service, data, bounds = _landsat_index(run)
+    run.progress(0.8, "computing statistics")
+    return {"statistics": index_statistics(data, service, bounds)}
+
+
+def _ee_region(run):
+    """(ee.Geometry, cutline layer or None) for the job's AOI"""
+    if run.params.get("bbox"):
+        return ee.Geometry.Rectangle(_bbox(run.params["bbox"])), None
+    if run.inputs.get("zip_file"):
+        return unzip_and_read_shapefile_ee(run.inputs["zip_file"])
+    raise JobError("Provide either bbox or an AOI file")
+
+
+def _clip_or_publish(tiff_path, cutline, output_path, progress=None):
+    if cutline:
+        return clip_raster_gdal(tiff_path, output_path, shapefile=cutline, progress=progress)
+    return publish(tiff_path, output_path)
+
+
+def _stats_mode(params):
+    mode = params.get("mode", "server")
+    if mode not in STATS_MODES:
+        raise JobError(f"mode must be one of: {', '.join(STATS_MODES)}")
+    pipeline = params.get("pipeline", "memory")
+    if pipeline not in PIPELINE_MODES:
+        raise JobError(f"pipeline must be one of: {', '.join(PIPELINE_MODES)}")
+    return mode
+
+
+def _pipeline_memory(params):
+    """A MemoryWorkspace for the memory pipeline, or a context yielding None for the disk one"""
+    return MemoryWorkspace() if params.get("pipeline", "memory") == "memory" else nullcontext()
+
+
+def _download_lst(run, region, scale, memory=None):
+    run.progress(0.1, "downloading LST")
+    return LSTDataDownloader.download_lst_single(
+        run.params["time_start"], run.params["time_end"], region, scale=scale,
+        output_path=run.workspace.file("LST.tif"), progress=run.span(0.1, 0.7), memory=memory
+    )
+
+
+@job_operation("download_lst", inputs=(AOI_INPUT,), params=("time_start", "time_end", "bbox", "scale"))
+def download_lst_job(run):
+    LSTDataDownloader.initialize_earth_engine()
+    region, cutline = _ee_region(run)
+    tiff_path = _download_lst(run, region, int(run.params.get("scale", 1000)))
+    run.progress(0.8, "clipping")
+    output_path = _clip_or_publish(
+        tiff_path, cutline, unique_output_path("LST_clipped", ext=".tif"), progress=run.span(0.8, 1.0)
+    )
+    return {"outputs": {"lst": output_path}}
+
+
+@job_operation("lst_statistics", inputs=(AOI_INPUT,),
+               params=("time_start", "time_end", "bbox", "scale", "mode", "pipeline"))
+def lst_statistics_job(run):
+    mode = _stats_mode(run.params)
+    scale = int(run.params.get("scale", 1000))
+    LSTDataDownloader.initialize_earth_engine()
+    region, cutline = _ee_region(run)
+
+    if mode == "server":
+        run.progress(0.1, "reducing on Earth Engine")
+        summary, classes = LSTDataDownloader.lst_statistics_server(
+            run.params["time_start"], run.params["time_end"], region, scale
+        )
+    else:
+        with _pipeline_memory(run.params) as memory:
+            tiff_path = _download_lst(run, region, scale, memory)
+            if cutline:
+                run.progress(0.7, "clipping")
+                tiff_path = clip_raster_gdal(
+                    tiff_path, memory.file("LST_clipped.vrt") if memory else run.workspace.file("LST_clipped.tif"),
+                    shapefile=cutline, progress=run.span(0.7, 0.8)
+                )
+            run.progress(0.8, "computing statistics")
+            summary, classes = LSTDataDownloader.lst_statistics_local(tiff_path, scale)
+    return {"lst_statistics": {"summary": summary, "classes": classes}}
+
+
+def _download_lulc(run, region, memory=None):
+    run.progress(0.1, "downloading LULC")
+    return LULCDataDownloader.download_lulc_single(
+        region, output_path=run.workspace.file("LULC.tif"), progress=run.span(0.1, 0.7), memory=memory
+    )
+
+
+@job_operation("download_lulc", inputs=(AOI_INPUT,), params=("bbox",))
+def download_lulc_job(run):
+    LULCDataDownloader.initialize_earth_engine()
+    region, cutline = _ee_region(run)
+    tiff_path = _download_lulc(run, region)
+    run.progress(0.8, "clipping")
+    output_path = _clip_or_publish(
+        tiff_path, cutline, unique_output_path("LULC_clipped", ext=".tif"), progress=run.span(0.8, 1.0)
+    )
+    return {"outputs": {"lulc": output_path}}
+
+
+@job_operation("lulc_statistics", inputs=(AOI_INPUT,), params=("bbox", "scale", "mode", "pipeline"))
+def lulc_statistics_job(run):
+    mode = _stats_mode(run.params)
+    scale = int(run.params.get("scale", 100))
+    LULCDataDownloader.initialize_earth_engine()
+    region, cutline = _ee_region(run)
+
+    if mode == "server":
+        run.progress(0.1, "reducing on Earth Engine")
+        return {"lulc_statistics": LULCDataDownloader.lulc_statistics_server(region, scale)}
+
+    with _pipeline_memory(run.params) as memory:
+        tiff_path = _download_lulc(run, region, memory)
+        if cutline:
+            run.progress(0.7, "clipping")
+            tiff_path = clip_raster_gdal(
+                tiff_path, memory.file("LULC_clipped.vrt") if memory else run.workspace.file("LULC_clipped.tif"),
+                shapefile=cutline, progress=run.span(0.7, 0.8)
+            )
+        run.progress(0.8, "computing statistics")
+        return {"lulc_statistics": LULCDataDownloader.lulc_statistics_local(tiff_path, scale)}
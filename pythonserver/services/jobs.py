@@ -0,0 +1,520 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .workspace import Workspace
+from .delivery import raster_result
+from .progress import ProgressReporter, OperationCancelled
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_BACKEND = os.getenv("JOB_BACKEND", "sqlite")  # sqlite or memory
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("jobs", "jobs.sqlite3"))
+JOB_EXECUTOR = os.getenv("JOB_EXECUTOR", "process")  # process or thread
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", max((os.cpu_count() or 2) // 2, 1)))
+# How often the dispatcher looks for jobs queued by other server processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL", 7 * 24 * 3600))  # finished jobs are kept 7 days
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+# name -> JobOperation, filled by @job_operation in job_operations.py
+JOB_OPERATIONS = {}
+
+
+class JobError(Exception):
+    """An operation failed in a way worth reporting to the client as is"""
+
+
+class JobCancelled(OperationCancelled):
+    """Raised inside a running job once its cancellation was requested"""
+
+
+class JobOperation:
+    """A queueable operation: func(run) -> result dict, its file inputs and accepted parameters.
+
+    inputs are (form field, dataset parameter, required) triples: the file comes either as an
+    upload under the form field or as a registered dataset id under the dataset parameter.
+    """
+
+    def __init__(self, name, func, inputs=(), params=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+
+    def check_params(self, params):
+        dataset_params = {dataset_param for _, dataset_param, _ in self.inputs}
+        unknown = set(params) - set(self.params) - dataset_params
+        if unknown:
+            raise ValueError(
+                f"Unknown parameter(s) for {self.name}: {', '.join(sorted(unknown))}; "
+                f"accepted: {', '.join(self.params + tuple(sorted(dataset_params)))}"
+            )
+
+    def describe(self):
+        return {
+            "inputs": [
+                {"field": field, "dataset_param": dataset_param, "required": required}
+                for field, dataset_param, required in self.inputs
+            ],
+            "params": list(self.params)
+        }
+
+
+def job_operation(name, inputs=(), params=()):
+    """Register func as the job operation `name`"""
+    def register(func):
+        JOB_OPERATIONS[name] = JobOperation(name, func, inputs, params)
+        return func
+    return register
+
+
+def _now():
+    return time.time()
+
+
+def _job_dict(row):
+    """Public view of a job row, with timings"""
+    job = dict(row)
+    for field in ("params", "inputs", "result"):
+        if isinstance(job.get(field), str):
+            job[field] = json.loads(job[field])
+    started, finished = job.get("started_at"), job.get("finished_at")
+    job["queue_seconds"] = round((started or finished or _now()) - job["created_at"], 3)
+    job["run_seconds"] = round((finished or _now()) - started, 3) if started else None
+    job["cancel_requested"] = bool(job.get("cancel_requested"))
+    return job
+
+
+class SQLiteJobStore:
+    """Job queue and state in a SQLite file, shared by every server and worker process on the host.
+
+    Connections are opened per thread (and per process: only the path is pickled), and a job is
+    claimed with a conditional UPDATE so two dispatchers never run the same job.
+    """
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    operation TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    inputs TEXT NOT NULL,
+                    workspace TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, operation, params, inputs, workspace):
+        self._connect().execute(
+            "INSERT INTO jobs (id, operation, state, params, inputs, workspace, message, created_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, 'queued', ?)",
+            (job_id, operation, json.dumps(params), json.dumps(inputs), workspace, _now())
+        )
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def list(self, state=None, limit=100):
+        query, args = "SELECT * FROM jobs", []
+        if state:
+            query += " WHERE state = ?"
+            args.append(state)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        return [_job_dict(row) for row in self._connect().execute(query, args)]
+
+    def claim(self, worker):
+        """Move the oldest queued job to running for worker; None when the queue is empty"""
+        conn = self._connect()
+        while True:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, started_at = ?, message = 'running' "
+                "WHERE id = ? AND state = 'queued'",
+                (worker, _now(), row["id"])
+            ).rowcount
+            if claimed:
+                return self.get(row["id"])
+
+    def progress(self, job_id, fraction, message=None):
+        """Record progress; returns True when the job should stop"""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ? AND state = 'running'",
+            (fraction, message, job_id)
+        )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def finish(self, job_id, state, result=None, error=None, message=None):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = ?, message = ?, finished_at = ?, "
+            "progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END WHERE id = ?",
+            (state, json.dumps(result) if result is not None else None, error, message or state, _now(),
+             state, job_id)
+        )
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once, or flag a running one; returns the job or None"""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET state = 'cancelled', message = 'cancelled', finished_at = ? "
+            "WHERE id = ? AND state = 'queued'",
+            (_now(), job_id)
+        )
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def fail_orphans(self, is_orphan):
+        """Fail running jobs whose worker is gone (is_orphan(worker) -> bool); returns their ids"""
+        conn = self._connect()
+        rows = conn.execute("SELECT id, worker FROM jobs WHERE state = 'running'").fetchall()
+        orphans = [row["id"] for row in rows if is_orphan(row["worker"])]
+        for job_id in orphans:
+            self.finish(job_id, "failed", error="The worker running this job exited")
+        return orphans
+
+    def purge(self, older_than):
+        """Delete finished jobs older than the cutoff; returns their workspaces"""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT id, workspace FROM jobs WHERE state IN ('succeeded', 'failed', 'cancelled') "
+            "AND finished_at < ?", (older_than,)
+        ).fetchall()
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+        return [row["workspace"] for row in rows]
+
+    def counts(self):
+        rows = self._connect().execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {state: 0 for state in JOB_STATES} | {row["state"]: row["n"] for row in rows}
+
+
+class MemoryJobStore:
+    """In-process job store with the SQLiteJobStore interface; jobs are lost on restart.
+
+    Only usable with the thread executor, since worker processes cannot see it.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, operation, params, inputs, workspace):
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id, "operation": operation, "state": "queued", "params": params,
+                "inputs": inputs, "workspace": workspace, "progress": 0.0, "message": "queued",
+                "result": None, "error": None, "worker": None, "cancel_requested": False,
+                "created_at": _now(), "started_at": None, "finished_at": None
+            }
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return _job_dict(job) if job else None
+
+    def list(self, state=None, limit=100):
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if not state or job["state"] == state]
+            jobs.sort(key=lambda job: job["created_at"], reverse=True)
+            return [_job_dict(job) for job in jobs[:limit]]
+
+    def claim(self, worker):
+        with self._lock:
+            queued = [job for job in self._jobs.values() if job["state"] == "queued"]
+            if not queued:
+                return None
+            job = min(queued, key=lambda job: job["created_at"])
+            job.update(state="running", worker=worker, started_at=_now(), message="running")
+            return _job_dict(job)
+
+    def progress(self, job_id, fraction, message=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return True
+            if job["state"] == "running":
+                job["progress"] = fraction
+                job["message"] = message or job["message"]
+            return bool(job["cancel_requested"])
+
+    def finish(self, job_id, state, result=None, error=None, message=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(state=state, result=result, error=error, message=message or state, finished_at=_now())
+            if state == "succeeded":
+                job["progress"] = 1.0
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["state"] == "queued":
+                job.update(state="cancelled", message="cancelled", finished_at=_now())
+            elif job["state"] == "running":
+                job["cancel_requested"] = True
+            return _job_dict(job)
+
+    def fail_orphans(self, is_orphan):
+        return []
+
+    def purge(self, older_than):
+        with self._lock:
+            old = [job for job in self._jobs.values()
+                   if job["state"] in FINISHED_STATES and job["finished_at"] < older_than]
+            for job in old:
+                del self._jobs[job["id"]]
+            return [job["workspace"] for job in old]
+
+    def counts(self):
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job["state"]] += 1
+            return counts
+
+
+JOB_BACKENDS = {"sqlite": SQLiteJobStore, "memory": MemoryJobStore}
+
+
+def make_job_store(backend=JOB_BACKEND):
+    if backend not in JOB_BACKENDS:
+        raise ValueError(f"JOB_BACKEND must be one of: {', '.join(JOB_BACKENDS)}")
+    return JOB_BACKENDS[backend]()
+
+
+class JobRun(ProgressReporter):
+    """What an operation sees of its job: inputs, parameters, workspace and a progress reporter.
+
+    The run itself is the reporter handed to services as progress=, so GDAL callbacks update the
+    job and stop as soon as DELETE /jobs/{id} flags it.
+    """
+
+    def __init__(self, job, store, workspace, context):
+        super().__init__()
+        self.id = job["id"]
+        self.params = job["params"]
+        self.inputs = job["inputs"]
+        self.workspace = workspace
+        self.context = context
+        self._store = store
+
+    def _publish(self, fraction, message):
+        return self._store.progress(self.id, fraction, message)
+
+    def progress(self, fraction, message=None):
+        """Report progress in [0, 1]; raises JobCancelled once cancellation was requested"""
+        if not self.update(fraction, message):
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+
+def _with_handles(result):
+    """Replace the output paths of a result with download handles"""
+    result = dict(result or {})
+    outputs = result.pop("outputs", None) or {}
+    if outputs:
+        result["outputs"] = {name: raster_result(path, "handle")["result"] for name, path in outputs.items()}
+    return result
+
+
+def run_job(store, job, context):
+    """Run one claimed job to completion in a worker (thread or process) and record the outcome"""
+    workspace = Workspace(path=job["workspace"]) if job.get("workspace") else Workspace(prefix="job")
+    run = JobRun(job, store, workspace, context)
+    try:
+        run.progress(0.0, "running")
+        result = JOB_OPERATIONS[job["operation"]].func(run)
+        store.finish(job["id"], "succeeded", result=_with_handles(result))
+    except OperationCancelled:
+        store.finish(job["id"], "cancelled")
+    except Exception as e:
+        if run.cancelled:
+            # A service aborted through its progress callback and reported that as an error
+            store.finish(job["id"], "cancelled")
+        elif isinstance(e, JobError):
+            store.finish(job["id"], "failed", error=str(e))
+        else:
+            logger.exception(f"Job {job['id']} ({job['operation']}) failed")
+            store.finish(job["id"], "failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        workspace.cleanup()
+    return job["id"]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobManager:
+    """Dispatcher thread that claims queued jobs from the store and runs them on a worker pool.
+
+    Every server process runs one; with the SQLite store they share a single queue, so jobs
+    queued by one process may run in another. Throughput is bounded by max_workers per process.
+    """
+
+    def __init__(self, store=None, max_workers=JOB_WORKERS, executor=JOB_EXECUTOR,
+                 poll_interval=JOB_POLL_INTERVAL, ttl_seconds=JOB_TTL_SECONDS):
+        self.store = store or make_job_store()
+        if isinstance(self.store, MemoryJobStore) and executor == "process":
+            # Worker processes could not reach an in-process store
+            executor = "thread"
+        self.executor_kind = executor
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.ttl_seconds = ttl_seconds
+        self.context = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = None
+        self._thread = None
+        self._running = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self, **context):
+        """Start the worker pool and dispatcher; context (e.g. sh_config) is handed to every job"""
+        if self._thread is not None:
+            return
+        self.context = context
+        host = socket.gethostname()
+        orphans = self.store.fail_orphans(
+            lambda worker: bool(worker) and worker.rsplit(":", 1)[0] == host
+            and not _pid_alive(int(worker.rsplit(":", 1)[1]))
+        )
+        if orphans:
+            logger.warning(f"Marked {len(orphans)} job(s) of exited workers as failed")
+
+        if self.executor_kind == "process":
+            # spawn: forking a process that already holds GDAL handles and threads is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Job workers started: {self.max_workers} {self.executor_kind} worker(s)")
+
+    def submit(self, operation, params, inputs, workspace):
+        """Queue an operation whose inputs were saved to workspace; the job id is the workspace id"""
+        self.store.create(workspace.id, operation, params, inputs, workspace.path)
+        self._wake.set()
+        return workspace.id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def list(self, state=None, limit=100):
+        return self.store.list(state, limit)
+
+    def cancel(self, job_id):
+        job = self.store.cancel(job_id)
+        if job and job["state"] == "cancelled" and job.get("workspace") and os.path.isdir(job["workspace"]):
+            # Cancelled before a worker picked it up: nobody else will remove its inputs
+            Workspace(path=job["workspace"]).cleanup()
+        return job
+
+    def _release(self, _future):
+        with self._lock:
+            self._running -= 1
+        self._wake.set()
+
+    def _dispatch_loop(self):
+        last_purge = 0.0
+        while not self._stopping.is_set():
+            try:
+                while True:
+                    with self._lock:
+                        if self._running >= self.max_workers:
+                            break
+                    job = self.store.claim(self.worker_id)
+                    if job is None:
+                        break
+                    with self._lock:
+                        self._running += 1
+                    future = self._executor.submit(run_job, self.store, job, self.context)
+                    future.add_done_callback(self._release)
+
+                if _now() - last_purge > 3600:
+                    last_purge = _now()
+                    for workspace in self.store.purge(_now() - self.ttl_seconds):
+                        if workspace:
+                            Workspace(path=workspace).cleanup()
+            except Exception:
+                logger.exception("Job dispatcher error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def status(self):
+        with self._lock:
+            running = self._running
+        return {
+            "backend": type(self.store).__name__,
+            "executor": self.executor_kind,
+            "max_workers": self.max_workers,
+            "running_here": running,
+            "jobs": self.store.counts()
+        }
+
+    def shutdown(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Job workers shut down")
+
+
+JOB_MANAGER = JobManager()
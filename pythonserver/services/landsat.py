@@ -0,0 +1,311 @@
+import os
+import json
+import math
+import hashlib
+import logging
+import threading
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+import requests
+from requests.adapters import HTTPAdapter
+import sentinelhub
+from sentinelhub import (
+    SentinelHubRequest, SentinelHubDownloadClient, MimeType, DataCollection, BBox, bbox_to_dimensions
+)
+from .output_writer import cog_output
+from .raster_stats import array_stats, class_table_stats, CLASS_TABLES
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LANDSAT_CACHE_FOLDER = os.getenv("LANDSAT_CACHE_DIR", "landsat_cache")
+LANDSAT_CACHE_MAX_BYTES = int(os.getenv("LANDSAT_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # 2 GB
+# Target ground sample distance in metres (Landsat 8/9 bands are 30 m)
+LANDSAT_RESOLUTION = float(os.getenv("LANDSAT_RESOLUTION", 30))
+# Sentinel Hub Process API accepts at most 2500 px per side
+LANDSAT_MAX_TILE = int(os.getenv("LANDSAT_MAX_TILE", 2500))
+# Larger AOIs are fetched at a coarser resolution so the mosaic stays within this many pixels
+LANDSAT_MAX_PIXELS = int(os.getenv("LANDSAT_MAX_PIXELS", 100_000_000))
+LANDSAT_CONCURRENCY = int(os.getenv("LANDSAT_CONCURRENCY", 4))
+
+LANDSAT_BANDS = ("B03", "B04", "B05", "B06")
+
+# sentinelhub releases whose SentinelHubDownloadClient._do_download PooledDownloadClient mirrors;
+# requirement.txt pins 3.11.1
+POOLED_DOWNLOAD_SENTINELHUB_VERSIONS = ("3.11.", "3.12.")
+
+# Normalized difference indices as (a, b) -> (a - b) / (a + b), same formulas as EVALSCRIPTS
+LANDSAT_INDICES = {
+    "ndvi": ("B05", "B04"),
+    "ndwi": ("B03", "B05"),
+    "ndbi": ("B06", "B05"),
+}
+
+BAND_STACK_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {input: ["B03","B04","B05","B06"], output: {bands: 4, sampleType: "FLOAT32"}};
+}
+function evaluatePixel(sample) {
+    return [sample.B03, sample.B04, sample.B05, sample.B06];
+}
+"""
+
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def band_stack_key(bbox=None, geometry=None, time_interval=None, resolution=LANDSAT_RESOLUTION):
+    """Cache key for one (AOI, time interval, resolution) band stack"""
+    if bbox is not None:
+        aoi = {"bbox": [round(v, 8) for v in (bbox.min_x, bbox.min_y, bbox.max_x, bbox.max_y)],
+               "crs": str(bbox.crs)}
+    else:
+        aoi = {"geometry": geometry.wkt, "crs": str(geometry.crs)}
+    payload = json.dumps({
+        "aoi": aoi,
+        "time_interval": list(time_interval) if time_interval else None,
+        "resolution": float(resolution),
+        "bands": LANDSAT_BANDS
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(LANDSAT_CACHE_FOLDER, f"{key}.npy")
+
+
+def _evict(max_bytes=LANDSAT_CACHE_MAX_BYTES):
+    """Drop the least recently used stacks once the cache is over max_bytes"""
+    entries = []
+    for name in os.listdir(LANDSAT_CACHE_FOLDER):
+        path = os.path.join(LANDSAT_CACHE_FOLDER, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def plan_tiles(bbox, resolution=LANDSAT_RESOLUTION, max_tile=LANDSAT_MAX_TILE, max_pixels=LANDSAT_MAX_PIXELS):
+    """Output size for an AOI at the target resolution, and the tiles that cover it.
+
+    The resolution is coarsened when the AOI would exceed max_pixels. Tiles are
+    (x, y, width, height, BBox) with pixel offsets into the mosaic; tile bboxes are cut on
+    pixel boundaries so the tiles line up exactly.
+    """
+    width, height = bbox_to_dimensions(bbox, resolution)
+    if width * height > max_pixels:
+        factor = math.sqrt(width * height / max_pixels)
+        resolution *= factor
+        width, height = bbox_to_dimensions(bbox, resolution)
+        logger.info(f"AOI too large for the target resolution, fetching at {resolution:.1f} m")
+    width, height = max(width, 1), max(height, 1)
+
+    x_edges = np.linspace(0, width, math.ceil(width / max_tile) + 1).round().astype(int)
+    y_edges = np.linspace(0, height, math.ceil(height / max_tile) + 1).round().astype(int)
+    span_x = (bbox.max_x - bbox.min_x) / width
+    span_y = (bbox.max_y - bbox.min_y) / height
+
+    tiles = []
+    for y0, y1 in zip(y_edges[:-1], y_edges[1:]):
+        for x0, x1 in zip(x_edges[:-1], x_edges[1:]):
+            tile_bbox = BBox(
+                bbox=[bbox.min_x + x0 * span_x, bbox.max_y - y1 * span_y,
+                      bbox.min_x + x1 * span_x, bbox.max_y - y0 * span_y],
+                crs=bbox.crs
+            )
+            tiles.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0), tile_bbox))
+    return width, height, resolution, tiles
+
+
+class PooledDownloadClient(SentinelHubDownloadClient):
+    """Download client that sends every request through one keep-alive requests.Session.
+
+    The stock client opens a new connection per request; here all tiles (and all fetches in
+    the process) share a connection pool sized to the fetch concurrency.
+
+    sentinelhub has no public hook for the HTTP session, so _do_download is overridden with a
+    copy of the sentinelhub 3.11/3.12 body that swaps requests.request for the shared session.
+    Retries and rate limiting stay in the base class. On any other sentinelhub version the stock
+    download runs instead, so an upgrade costs pooling, never correctness.
+    """
+
+    _http = None
+    _http_lock = threading.Lock()
+
+    @classmethod
+    def http_session(cls):
+        with cls._http_lock:
+            if cls._http is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(LANDSAT_CONCURRENCY, 1) * 2)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._http = session
+            return cls._http
+
+    def _do_download(self, request):
+        if not sentinelhub.__version__.startswith(POOLED_DOWNLOAD_SENTINELHUB_VERSIONS):
+            return super()._do_download(request)
+        if request.url is None:
+            raise ValueError(f"Faulty request {request}, no URL specified.")
+        return self.http_session().request(
+            request.request_type.value,
+            url=request.url,
+            json=request.post_values,
+            headers=self._prepare_headers(request),
+            timeout=self.config.download_timeout_seconds,
+        )
+
+
+def _tile_request(config, tile_bbox, geometry, time_interval, size):
+    return SentinelHubRequest(
+        evalscript=BAND_STACK_EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.LANDSAT_OT_L2,
+                time_interval=time_interval
+            )
+        ],
+        responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+        bbox=tile_bbox,
+        # With a geometry too, Sentinel Hub returns the tile clipped to it
+        geometry=geometry,
+        size=size,
+        config=config
+    )
+
+
+def fetch_band_stack(config, bbox=None, geometry=None, time_interval=None, resolution=LANDSAT_RESOLUTION,
+                     concurrency=LANDSAT_CONCURRENCY):
+    """Landsat 8/9 L2 bands B03-B06 for an AOI as a (height, width, 4) float32 array.
+
+    The AOI is planned at the target resolution, split into tiles within Sentinel Hub's
+    request limits, fetched `concurrency` tiles at a time and mosaicked straight into a
+    memory-mapped .npy in the cache. Each (AOI, time interval, resolution) is fetched once;
+    concurrent requests for the same AOI wait for the fetch in flight.
+    """
+    key = band_stack_key(bbox, geometry, time_interval, resolution)
+    path = _cache_path(key)
+
+    with _key_lock(key):
+        if os.path.exists(path):
+            os.utime(path)
+            logger.info(f"Landsat band stack cache hit {key[:12]}")
+            return np.load(path, mmap_mode="r")
+
+        aoi = bbox if bbox is not None else geometry.bbox
+        width, height, fetch_resolution, tiles = plan_tiles(aoi, resolution)
+        requests_list = [
+            _tile_request(config, tile_bbox, geometry, time_interval, (tile_w, tile_h))
+            for _, _, tile_w, tile_h, tile_bbox in tiles
+        ]
+
+        os.makedirs(LANDSAT_CACHE_FOLDER, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp.npy"
+        mosaic = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(height, width, len(LANDSAT_BANDS))
+        )
+        try:
+            client = PooledDownloadClient(config=config)
+            results = client.download(
+                [request.download_list[0] for request in requests_list],
+                max_threads=max(concurrency, 1)
+            )
+            for (x, y, tile_w, tile_h, _), data in zip(tiles, results):
+                mosaic[y:y + tile_h, x:x + tile_w] = np.asarray(data, dtype=np.float32).reshape(tile_h, tile_w, -1)
+            mosaic.flush()
+            del mosaic
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        logger.info(
+            f"Fetched Landsat band stack {key[:12]}: {width}x{height} px at {fetch_resolution:.1f} m "
+            f"in {len(tiles)} tile(s)"
+        )
+
+    _evict()
+    return np.load(path, mmap_mode="r")
+
+
+def landsat_index(stack, service):
+    """Compute a LANDSAT_INDICES index from a band stack; NaN where both bands are zero"""
+    if service not in LANDSAT_INDICES:
+        raise ValueError(f"Unknown index '{service}', expected one of: {', '.join(LANDSAT_INDICES)}")
+    a_name, b_name = LANDSAT_INDICES[service]
+    a = stack[..., LANDSAT_BANDS.index(a_name)]
+    b = stack[..., LANDSAT_BANDS.index(b_name)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = (a - b) / (a + b)
+    index[~np.isfinite(index)] = np.nan
+    return index.astype(np.float32)
+
+
+def landsat_index_data(config, service, bbox=None, geometry=None, time_interval=None,
+                       resolution=LANDSAT_RESOLUTION):
+    """Index raster for an AOI, computed locally from the cached band stack"""
+    if service not in LANDSAT_INDICES:
+        raise ValueError(f"Unknown index '{service}', expected one of: {', '.join(LANDSAT_INDICES)}")
+    stack = fetch_band_stack(config, bbox, geometry, time_interval, resolution)
+    return landsat_index(stack, service)
+
+
+def write_index_raster(data, bounds, output_path):
+    """Write an index array covering lon/lat bounds (min_x, min_y, max_x, max_y) as a COG"""
+    with cog_output(output_path) as work_path:
+        with rasterio.open(
+            work_path,
+            "w",
+            driver="GTiff",
+            height=data.shape[0],
+            width=data.shape[1],
+            count=1,
+            dtype=data.dtype,
+            crs="EPSG:4326",
+            transform=from_bounds(*bounds, data.shape[1], data.shape[0]),
+            tiled=True,
+        ) as dst:
+            dst.write(data, 1)
+    return output_path
+
+
+def index_statistics(data, service, bounds):
+    """Summary, percentiles and index classes of an index array covering lon/lat bounds"""
+    total_area_m2 = (bounds[2] - bounds[0]) * (bounds[3] - bounds[1]) * (111320 ** 2)
+    pixel_area_km2 = total_area_m2 / data.size / 1e6
+
+    # One pass for summary, percentiles and index classes
+    stats = array_stats(data, hist_range=(-1.0, 1.0), classes=CLASS_TABLES.get(service))
+    if not stats.count:
+        raise ValueError("No valid pixels for the AOI and time interval")
+    summary = stats.summary()
+
+    return {
+        "mean": round(summary["mean"], 4),
+        "min": round(summary["min"], 4),
+        "max": round(summary["max"], 4),
+        "std": round(summary["std"], 4),
+        "percentiles": {name: round(value, 4) for name, value in summary["percentiles"].items()},
+        "pixel_area_km2": round(pixel_area_km2, 4),
+        "total_area_km2": round(pixel_area_km2 * data.size, 2),
+        "classes": class_table_stats(stats, pixel_area_km2, total=data.size)
+    }
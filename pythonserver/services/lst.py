@@ -1,7 +1,8 @@
 import ee
-import os
 import logging
-import requests
+from .ee_client import EE_CLIENT, grid_bytes, MEMORY_PIPELINE_MAX_BYTES
+from .workspace import unique_output_path
+from .raster_stats import CLASS_TABLES, raster_stats, class_table_stats
 from datetime import datetime
 
 # Logging setup
@@ -12,17 +13,8 @@ logger = logging.getLogger(__name__)
 class LSTDataDownloader:
     @staticmethod
     def initialize_earth_engine():
-        try:
-            ee.Initialize(project="ee-202319022")
-            logger.info("Earth Engine initialized successfully")
-        except Exception:
-            logger.warning("Earth Engine not initialized. Authenticating...")
-            try:
-                ee.Authenticate()
-                ee.Initialize(project="ee-202319022")
-            except Exception as auth_error:
-                logger.error(f"Failed to initialize Earth Engine: {auth_error}")
-                raise
+        # Initialized once per process; later calls are no-ops
+        EE_CLIENT.initialize()
 
     @staticmethod
     def validate_dates(start_date, end_date):
@@ -36,12 +28,8 @@ class LSTDataDownloader:
             raise
 
     @staticmethod
-    def download_lst_single(start_date, end_date, region, scale=1000, folder="LST_data"):
-        """Download MODIS LST mean clipped to region"""
-        os.makedirs(folder, exist_ok=True)
-
-        LSTDataDownloader.validate_dates(start_date, end_date)
-
+    def lst_image(start_date, end_date, region):
+        """Mean MODIS daytime LST in °C over the date range, clipped to region"""
         # Get MODIS LST dataset
         modis_lst = (
             ee.ImageCollection("MODIS/006/MOD11A2")
@@ -55,27 +43,108 @@ class LSTDataDownloader:
 
         # Mean LST in Celsius
         mean_lst = modis_lst.mean()
-        lst_celsius = mean_lst.multiply(0.02).subtract(273.15).clip(region)
+        return mean_lst.multiply(0.02).subtract(273.15).clip(region)
+
+    @staticmethod
+    def download_lst_single(start_date, end_date, region, scale=1000, folder="LST_data", output_path=None, progress=None,
+                            memory=None):
+        """Download MODIS LST mean clipped to region, to output_path or a unique file in folder.
+
+        Returns the path to read. With memory (a MemoryWorkspace) the raster stays in /vsimem/
+        instead, unless it is larger than MEMORY_PIPELINE_MAX_BYTES.
+        """
+        LSTDataDownloader.validate_dates(start_date, end_date)
+
+        lst_celsius = LSTDataDownloader.lst_image(start_date, end_date, region)
+        bounds = EE_CLIENT.region_bounds(region)
 
-        filename = os.path.join(folder, "LST.tif")
+        if memory is not None and grid_bytes(bounds, scale, 8) <= MEMORY_PIPELINE_MAX_BYTES:
+            filename = memory.file("LST.tif")
+        else:
+            filename = output_path or unique_output_path("LST", ext=".tif", folder=folder)
 
-        # Get download URL
-        url = lst_celsius.getDownloadURL({
-            "scale": scale,
-            "region": region,
-            "format": "GEO_TIFF",
-            "crs": "EPSG:4326"
-        })
+        # Tiled, concurrent download over the shared session
+        logger.info("Downloading LST ...")
+        return EE_CLIENT.download_image(
+            lst_celsius, bounds, scale, filename, crs="EPSG:4326", bytes_per_pixel=8, progress=progress
+        )
 
-        logger.info(f"Downloading LST from {url} ...")
-        r = requests.get(url, stream=True)
-        if r.status_code != 200:
-            raise Exception(f"Failed to download LST: {r.text}")
+    @staticmethod
+    def lst_statistics_server(start_date, end_date, region, scale=1000):
+        """Summary statistics and temperature classes reduced on Earth Engine; only JSON comes back"""
+        EE_CLIENT.initialize()
+        LSTDataDownloader.validate_dates(start_date, end_date)
+        lst = LSTDataDownloader.lst_image(start_date, end_date, region).rename("lst")
 
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+        # Class index per pixel from the break table (contiguous, ascending)
+        classes = CLASS_TABLES["lst"]
+        class_index = ee.Image.constant(0)
+        for _, low, _ in classes[1:]:
+            class_index = class_index.add(lst.gte(low))
+        in_table = lst.gte(classes[0][1]).And(lst.lt(classes[-1][2]))
+        class_index = class_index.updateMask(in_table).rename("class")
+
+        reducer = (
+            ee.Reducer.mean()
+            .combine(ee.Reducer.minMax(), sharedInputs=True)
+            .combine(ee.Reducer.stdDev(), sharedInputs=True)
+            .combine(ee.Reducer.median(), sharedInputs=True)
+            .combine(ee.Reducer.count(), sharedInputs=True)
+        )
+        region_args = {"geometry": region, "scale": scale, "maxPixels": 1e13, "tileScale": 4}
 
-        return filename
+        # Both reductions come back in one round trip
+        result = ee.Dictionary({
+            "stats": lst.reduceRegion(reducer=reducer, **region_args),
+            "classes": class_index.reduceRegion(reducer=ee.Reducer.frequencyHistogram().unweighted(), **region_args)
+        }).getInfo()
+
+        stats = result["stats"]
+        histogram = result["classes"].get("class") or {}
+        total_pixels = int(stats.get("lst_count") or 0)
+        if not total_pixels:
+            raise ValueError("No LST pixels inside the region")
+        pixel_area_km2 = scale * scale / 1e6
+
+        summary = {
+            "mean_celsius": round(stats["lst_mean"], 2),
+            "min_celsius": round(stats["lst_min"], 2),
+            "max_celsius": round(stats["lst_max"], 2),
+            "std_celsius": round(stats["lst_stdDev"], 2),
+            "median_celsius": round(stats["lst_median"], 2),
+            "area_km2": round(total_pixels * pixel_area_km2, 2)
+        }
+        stats_classes = []
+        for index, (class_name, _, _) in enumerate(classes):
+            count = int(histogram.get(str(index), 0))
+            if count == 0:
+                continue
+            stats_classes.append({
+                "class_name": class_name,
+                "pixel_count": count,
+                "area_km2": round(count * pixel_area_km2, 2),
+                "percentage": round((count / total_pixels) * 100, 2)
+            })
+        return summary, stats_classes
+
+    @staticmethod
+    def lst_statistics_local(tiff_path, scale=1000):
+        """The same summary and classes from a downloaded (and clipped) LST raster, in one blockwise scan.
 
+        As on the server, area and class percentages count valid pixels only, never nodata or
+        pixels clipped out of the region, so both modes agree for the same AOI.
+        """
+        lst_stats, _, _ = raster_stats(tiff_path, classes=CLASS_TABLES["lst"])
+        if not lst_stats.count:
+            raise ValueError("No LST pixels inside the region")
+        summary = lst_stats.summary()
+        pixel_area_km2 = scale * scale / 1e6
 
+        return {
+            "mean_celsius": round(summary["mean"], 2),
+            "min_celsius": round(summary["min"], 2),
+            "max_celsius": round(summary["max"], 2),
+            "std_celsius": round(summary["std"], 2),
+            "median_celsius": round(summary["percentiles"]["p50"], 2),
+            "area_km2": round(lst_stats.count * pixel_area_km2, 2)
+        }, class_table_stats(lst_stats, pixel_area_km2)
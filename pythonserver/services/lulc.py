@@ -1,71 +1,94 @@
 import ee
-import os
 import logging
-import requests
+from .ee_client import EE_CLIENT, grid_bytes, MEMORY_PIPELINE_MAX_BYTES
+from .workspace import unique_output_path
+from .raster_stats import LULC_CLASSES, raster_stats
 
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ESA WorldCover native resolution in metres
+LULC_SCALE = 10
+
+
 class LULCDataDownloader:
     @staticmethod
     def initialize_earth_engine():
-        try:
-            ee.Initialize(project="ee-202319022")
-            logger.info("Earth Engine initialized successfully")
-        except Exception:
-            logger.warning("Earth Engine not initialized. Authenticating...")
-            try:
-                ee.Authenticate()
-                ee.Initialize(project="ee-202319022")
-            except Exception as auth_error:
-                logger.error(f"Failed to initialize Earth Engine: {auth_error}")
-                raise
+        # Initialized once per process; later calls are no-ops
+        EE_CLIENT.initialize()
 
     @staticmethod
-    def download_lulc_single(region, folder="LULC_data"):
-        """Download single ESA WorldCover clipped LULC"""
-        os.makedirs(folder, exist_ok=True)
-        
+    def download_lulc_single(region, folder="LULC_data", output_path=None, progress=None, memory=None):
+        """Download single ESA WorldCover clipped LULC, to output_path or a unique file in folder.
+
+        Returns the path to read. With memory (a MemoryWorkspace) the raster stays in /vsimem/
+        instead, unless it is larger than MEMORY_PIPELINE_MAX_BYTES.
+        """
         # Use ESA WorldCover dataset
         lulc = ee.ImageCollection("ESA/WorldCover/v200").first().clip(region)
-        
-        # Get the bounding box of the region
-        region_bbox = region.bounds()
-        region_info = region_bbox.getInfo()
-        
-        # Extract coordinates from the bounding box
-        coords = region_info['coordinates'][0]
-        min_x = min(coord[0] for coord in coords)
-        max_x = max(coord[0] for coord in coords)
-        min_y = min(coord[1] for coord in coords)
-        max_y = max(coord[1] for coord in coords)
-        
-        filename = os.path.join(folder, "LULC.tif")
-        
-        # Get download URL with proper parameters
-        url = lulc.getDownloadURL({
-            "scale": 10,  # Higher resolution
-            "format": "GEO_TIFF",
-            "region": region_bbox,
-            "crs": "EPSG:4326"
-        })
-        
-        logger.info(f"Downloading LULC clipped to region from {url} ...")
-        r = requests.get(url, stream=True)
-        if r.status_code != 200:
-            raise Exception(f"Failed to download LULC: {r.text}")
+        bounds = EE_CLIENT.region_bounds(region)
 
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+        if memory is not None and grid_bytes(bounds, LULC_SCALE, 1) <= MEMORY_PIPELINE_MAX_BYTES:
+            filename = memory.file("LULC.tif")
+        else:
+            filename = output_path or unique_output_path("LULC", ext=".tif", folder=folder)
 
-        return filename
+        # Tiled, concurrent download of the region's bounding box over the shared session
+        logger.info("Downloading LULC clipped to region ...")
+        return EE_CLIENT.download_image(
+            lulc, bounds, LULC_SCALE, filename, crs="EPSG:4326", bytes_per_pixel=1, progress=progress
+        )
 
+    @staticmethod
+    def lulc_statistics_server(region, scale=10):
+        """Class pixel counts reduced on Earth Engine with a frequency histogram; only JSON comes back"""
+        EE_CLIENT.initialize()
+        lulc = ee.ImageCollection("ESA/WorldCover/v200").first().clip(region).rename("lulc")
 
+        result = lulc.reduceRegion(
+            reducer=ee.Reducer.frequencyHistogram().unweighted(),
+            geometry=region,
+            scale=scale,
+            maxPixels=1e13,
+            tileScale=4
+        ).getInfo()
 
+        histogram = {int(float(value)): int(count) for value, count in (result.get("lulc") or {}).items()}
+        total_pixels = sum(histogram.values())
+        pixel_area_km2 = scale * scale / 1e6
 
+        stats = []
+        for value, count in sorted(histogram.items()):
+            if value in LULC_CLASSES and count:
+                stats.append({
+                    "class_id": value,
+                    "class_name": LULC_CLASSES[value],
+                    "pixel_count": count,
+                    "area_km2": round(count * pixel_area_km2, 2),
+                    "percentage": round((count / total_pixels) * 100, 2)
+                })
+        return stats
 
+    @staticmethod
+    def lulc_statistics_local(tiff_path, scale=10):
+        """Class pixel counts from a downloaded (and clipped) LULC raster, in one blockwise pass.
 
+        Percentages are of the valid pixels, as on the server; nodata and clipped-out pixels are left out.
+        """
+        lulc_stats, _, _ = raster_stats(tiff_path, categories=LULC_CLASSES)
+        total_pixels = lulc_stats.count
+        pixel_area_km2 = scale * scale / 1e6
 
+        stats = []
+        for value, count in lulc_stats.category_breakdown():
+            if count:
+                stats.append({
+                    "class_id": int(value),
+                    "class_name": LULC_CLASSES[value],
+                    "pixel_count": int(count),
+                    "area_km2": round(count * pixel_area_km2, 2),
+                    "percentage": round((count / total_pixels) * 100, 2)
+                })
+        return stats
@@ -0,0 +1,93 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from osgeo import gdal
+from .progress import gdal_callback
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COG_COMPRESS = os.getenv("COG_COMPRESS", "DEFLATE")  # DEFLATE, ZSTD, LZW ...
+COG_LEVEL = os.getenv("COG_LEVEL")
+COG_BLOCKSIZE = int(os.getenv("COG_BLOCKSIZE", 512))
+
+# Work files written by the producers before the COG pass; tiled so the copy reads them block by block
+WORK_CREATION_OPTIONS = ["TILED=YES", "BIGTIFF=IF_SAFER"]
+
+
+def cog_creation_options(compress=None, level=None, blocksize=None, resampling="AVERAGE"):
+    """Creation options for the GDAL COG driver: internal tiles, codec + predictor and overviews"""
+    options = [
+        f"COMPRESS={compress or COG_COMPRESS}",
+        # YES picks horizontal differencing for integers and floating point prediction for floats
+        "PREDICTOR=YES",
+        f"BLOCKSIZE={blocksize or COG_BLOCKSIZE}",
+        "OVERVIEWS=IGNORE_EXISTING",
+        f"OVERVIEW_RESAMPLING={resampling}",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+    level = level or COG_LEVEL
+    if level:
+        options.append(f"LEVEL={level}")
+    return options
+
+
+def write_cog(source, output_path, compress=None, level=None, resampling="AVERAGE", progress=None):
+    """Copy a raster (path or dataset) to a Cloud Optimized GeoTIFF, building overviews in the same pass"""
+    # Private temporary name, so concurrent writers never share it; the rename publishes atomically
+    tmp_path = f"{output_path}.{os.getpid()}_{threading.get_ident()}.cog.tmp"
+    try:
+        ds = gdal.Translate(
+            tmp_path,
+            source,
+            options=gdal.TranslateOptions(
+                format="COG",
+                creationOptions=cog_creation_options(compress, level, resampling=resampling),
+                callback=gdal_callback(progress, "writing COG")
+            )
+        )
+        if progress is not None:
+            progress.check()
+        if ds is None:
+            raise RuntimeError(f"GDAL failed to write COG {output_path}")
+        ds = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info(f"Wrote COG {output_path}")
+    return output_path
+
+
+def work_path_for(output_path):
+    folder, name = os.path.split(output_path)
+    return os.path.join(folder, f".work_{os.path.splitext(name)[0]}_{os.getpid()}_{threading.get_ident()}.tif")
+
+
+@contextmanager
+def cog_output(output_path, compress=None, level=None, resampling="AVERAGE", progress=None):
+    """Yield a work path for a producer to write to; on success it is converted to a COG at output_path.
+
+    progress, if given, follows the COG pass; a producer aborted through it leaves a partial
+    work file, so nothing is published and OperationCancelled is raised instead.
+
+    Usage:
+        with cog_output(slope_path) as work_path:
+            gdal.DEMProcessing(work_path, dem_path, "slope", options=...)
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    work_path = work_path_for(output_path)
+    try:
+        yield work_path
+        if progress is not None:
+            progress.check()
+        if not os.path.exists(work_path):
+            raise RuntimeError(f"Producer did not write {work_path}")
+        write_cog(work_path, output_path, compress, level, resampling, progress)
+    finally:
+        for leftover in (work_path, f"{work_path}.aux.xml"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Updates closer together than this are dropped (GDAL calls back once per scanline)
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.25))
+# Finished operations stay visible this long so late subscribers still get the outcome
+PROGRESS_RETENTION = int(os.getenv("PROGRESS_RETENTION", 600))
+
+OPERATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class OperationCancelled(Exception):
+    """Raised by a long operation once its progress reporter asked it to stop"""
+
+
+class ProgressReporter:
+    """Receives progress in [0, 1] from a long operation and tells it whether to keep going.
+
+    update() returns False once cancellation was requested. gdal_callback() adapts it to the
+    GDAL progress callback protocol, where returning 0 aborts the GDAL operation; span()
+    maps a sub-step onto part of the range.
+    """
+
+    min_interval = PROGRESS_INTERVAL
+
+    def __init__(self):
+        self._cancelled = False
+        self._last_time = None
+        self._last_message = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _publish(self, fraction, message):
+        """Record an update; returns True when the operation should stop"""
+        return False
+
+    def update(self, fraction, message=None, force=False):
+        now = time.monotonic()
+        if (force or self._last_time is None or fraction >= 1.0 or now - self._last_time >= self.min_interval
+                or (message is not None and message != self._last_message)):
+            self._last_time = now
+            if message is not None:
+                self._last_message = message
+            if self._publish(min(max(float(fraction), 0.0), 1.0), message):
+                self._cancelled = True
+        return not self.cancelled
+
+    def check(self):
+        """Raise OperationCancelled if cancellation was requested"""
+        if self.cancelled:
+            raise OperationCancelled("Operation cancelled")
+
+    def span(self, start, end):
+        return ProgressSpan(self, start, end)
+
+    def gdal_callback(self, message=None):
+        def callback(complete, _message=None, _data=None):
+            return 1 if self.update(complete, message) else 0
+        return callback
+
+
+class ProgressSpan(ProgressReporter):
+    """Maps [0, 1] of a sub-step onto [start, end] of its parent reporter"""
+
+    def __init__(self, parent, start, end):
+        super().__init__()
+        self.parent = parent
+        self.start = start
+        self.end = end
+
+    @property
+    def cancelled(self):
+        return self.parent.cancelled
+
+    def cancel(self):
+        self.parent.cancel()
+
+    def update(self, fraction, message=None, force=False):
+        # The end of a sub-step is always reported, although it is not the end for the parent
+        return self.parent.update(self.start + (self.end - self.start) * fraction, message,
+                                  force=force or fraction >= 1.0)
+
+
+def span(progress, start, end):
+    """progress.span(start, end), or None when there is no reporter"""
+    return progress.span(start, end) if progress is not None else None
+
+
+def gdal_callback(progress, message=None):
+    """A GDAL progress callback feeding progress, or None when there is no reporter"""
+    return progress.gdal_callback(message) if progress is not None else None
+
+
+class OperationProgress(ProgressReporter):
+    """Progress of one synchronous request, kept in memory for the progress stream"""
+
+    def __init__(self, operation_id):
+        super().__init__()
+        self.id = operation_id
+        self.fraction = 0.0
+        self.message = "running"
+        self.state = "running"
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at = None
+        self.version = 0
+
+    def _publish(self, fraction, message):
+        self.fraction = fraction
+        if message is not None:
+            self.message = message
+        self.updated_at = time.time()
+        self.version += 1
+        return False
+
+    def cancel(self):
+        super().cancel()
+        self.message = "cancelling"
+        self.version += 1
+
+    def snapshot(self):
+        return {
+            "operation_id": self.id,
+            "state": self.state,
+            "progress": round(self.fraction, 4),
+            "message": self.message,
+            "cancel_requested": self.cancelled,
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 3)
+        }
+
+
+class ProgressRegistry:
+    """Operations in flight in this process, by id, plus recently finished ones"""
+
+    def __init__(self, retention=PROGRESS_RETENTION):
+        self.retention = retention
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def start(self, operation_id=None):
+        """Register a new operation; operation_id lets a client subscribe before the response arrives"""
+        operation_id = operation_id or uuid.uuid4().hex
+        if not OPERATION_ID_PATTERN.match(operation_id):
+            raise ValueError("operation_id must be 1-64 letters, digits, '-' or '_'")
+        with self._lock:
+            self._purge()
+            current = self._operations.get(operation_id)
+            if current is not None and current.state == "running":
+                raise ValueError(f"Operation {operation_id} is already running")
+            progress = OperationProgress(operation_id)
+            self._operations[operation_id] = progress
+        return progress
+
+    def finish(self, progress, failed=False):
+        progress.state = "cancelled" if progress.cancelled else "failed" if failed else "finished"
+        if progress.state == "finished":
+            progress.fraction = 1.0
+        progress.message = progress.state
+        progress.finished_at = time.time()
+        progress.version += 1
+
+    def get(self, operation_id):
+        with self._lock:
+            return self._operations.get(operation_id)
+
+    def cancel(self, operation_id):
+        """Ask a running operation to stop; returns it, or None if unknown"""
+        progress = self.get(operation_id)
+        if progress is not None and progress.state == "running":
+            progress.cancel()
+            logger.info(f"Cancellation requested for operation {operation_id}")
+        return progress
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        for operation_id in [op_id for op_id, progress in self._operations.items()
+                             if progress.finished_at and progress.finished_at < cutoff]:
+            del self._operations[operation_id]
+
+
+PROGRESS = ProgressRegistry()
@@ -0,0 +1,240 @@
+import numpy as np
+from osgeo import gdal
+from .terrain import iter_windows, BLOCK_SIZE
+
+DEFAULT_BINS = 256
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+ROW_CHUNK = 1024
+
+# Break tables as (label, low, high) with low inclusive and high exclusive
+CLASS_TABLES = {
+    "ndvi": [("Low", -1, 0.2), ("Medium", 0.2, 0.5), ("High", 0.5, 1.0)],
+    "ndwi": [("Low", -1, 0), ("Medium", 0, 0.3), ("High", 0.3, 1.0)],
+    "ndbi": [("Low", -1, 0), ("Medium", 0, 0.2), ("High", 0.2, 1.0)],
+    # Temperature classes in °C
+    "lst": [("Very Cold", -999, 0), ("Cold", 0, 10), ("Mild", 10, 20), ("Hot", 20, 30), ("Extreme", 30, 999)],
+}
+
+# ESA WorldCover class values
+LULC_CLASSES = {
+    10: "Tree cover",
+    20: "Shrubland",
+    30: "Grassland",
+    40: "Cropland",
+    50: "Built-up",
+    60: "Bare / sparse vegetation",
+    70: "Snow and ice",
+    80: "Permanent water bodies",
+    90: "Herbaceous wetland",
+    95: "Mangroves",
+    100: "Moss and lichen"
+}
+
+
+class StreamingStats:
+    """Single-pass, mergeable raster statistics.
+
+    Feed it blocks of valid values with update(); it keeps count/min/max and a Welford
+    mean + sum of squared deviations, a fixed-range histogram (also used for approximate
+    percentiles), per-class counts for a (label, low, high) break table, and per-value
+    counts for integer categories. Two accumulators can be combined with merge().
+    """
+
+    def __init__(self, bins=DEFAULT_BINS, hist_range=None, classes=None, categories=None):
+        self.bins = bins
+        self.hist_range = hist_range
+        self.histogram = np.zeros(bins, dtype=np.int64) if hist_range else None
+        self.classes = list(classes or [])
+        self.categories = sorted(int(c) for c in categories) if categories else []
+
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+        # Interval edges of the break table, and the class each interval belongs to (-1 for gaps)
+        self._edges = np.unique([bound for _, low, high in self.classes for bound in (low, high)])
+        self._interval_class = np.full(len(self._edges) + 1, -1)
+        for index, (_, low, high) in enumerate(self.classes):
+            for interval in range(1, len(self._edges)):
+                if low <= self._edges[interval - 1] and self._edges[interval] <= high:
+                    self._interval_class[interval] = index
+        self.class_counts = np.zeros(len(self.classes), dtype=np.int64)
+        self.category_counts = np.zeros(self.categories[-1] + 1 if self.categories else 0, dtype=np.int64)
+
+    def update(self, values):
+        """Add a 1-D array of valid (finite, non-nodata) values"""
+        n = values.size
+        if n == 0:
+            return
+        values = values.astype(np.float64, copy=False)
+
+        block_mean = float(values.mean())
+        block_m2 = float(np.square(values - block_mean).sum())
+        self._combine(n, block_mean, block_m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        if self.histogram is not None:
+            # Out of range values land in the edge bins so the histogram always sums to count
+            low, high = self.hist_range
+            clipped = np.clip(values, low, high)
+            self.histogram += np.histogram(clipped, bins=self.bins, range=self.hist_range)[0]
+
+        if self.classes:
+            owner = self.class_index(values)
+            self.class_counts += np.bincount(owner[owner >= 0], minlength=len(self.classes))[:len(self.classes)]
+
+        if self.categories:
+            top = len(self.category_counts) - 1
+            ints = values[(values >= 0) & (values <= top)].astype(np.int64)
+            self.category_counts += np.bincount(ints, minlength=top + 1)
+
+    def class_index(self, values):
+        """Index into the break table of each value, -1 where no class covers it"""
+        return self._interval_class[np.digitize(values, self._edges)]
+
+    def _combine(self, n, mean, m2):
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def merge(self, other):
+        """Fold another accumulator with the same configuration into this one"""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        if self.histogram is not None:
+            self.histogram += other.histogram
+        self.class_counts += other.class_counts
+        self.category_counts += other.category_counts
+        return self
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else None
+
+    def percentile(self, q):
+        """Approximate percentile from the histogram, interpolated linearly inside the bin"""
+        if self.histogram is None or not self.count:
+            return None
+        low, high = self.hist_range
+        width = (high - low) / self.bins
+        target = q / 100.0 * self.count
+        cumulative = np.cumsum(self.histogram)
+        index = int(np.searchsorted(cumulative, target, side="left"))
+        index = min(index, self.bins - 1)
+        before = cumulative[index - 1] if index else 0
+        inside = self.histogram[index]
+        fraction = (target - before) / inside if inside else 0.0
+        value = low + (index + fraction) * width
+        return float(min(max(value, self.min), self.max))
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        result = {
+            "count": int(self.count),
+            "min": float(self.min) if self.count else None,
+            "max": float(self.max) if self.count else None,
+            "mean": float(self.mean) if self.count else None,
+            "std": self.std
+        }
+        if self.histogram is not None:
+            result["percentiles"] = {f"p{q}": self.percentile(q) for q in percentiles}
+        return result
+
+    def class_breakdown(self):
+        """[(label, count)] for the break table, in table order"""
+        return [(label, int(count)) for (label, _, _), count in zip(self.classes, self.class_counts)]
+
+    def category_breakdown(self):
+        """[(value, count)] for the requested integer categories"""
+        return [(value, int(self.category_counts[value])) for value in self.categories]
+
+
+def _approximate_range(band):
+    """Value range from overviews (cheap on COGs), used to place the histogram bins"""
+    try:
+        low, high = band.ComputeRasterMinMax(True)
+    except RuntimeError:
+        return None
+    if low == high:
+        high = low + 1
+    return float(low), float(high)
+
+
+def raster_stats(path, bins=DEFAULT_BINS, hist_range=None, classes=None, categories=None,
+                 ignore_nodata=True, block_size=BLOCK_SIZE):
+    """Scan band 1 of a raster once, block by block, and return the filled StreamingStats.
+
+    Memory use is one block whatever the raster size. hist_range=None places the histogram
+    over the approximate value range. Besides the accumulator, returns the total pixel count
+    (including nodata) and the pixel size in CRS units.
+    """
+    ds = gdal.Open(path)
+    if ds is None:
+        raise ValueError(f"Could not open raster {path}")
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue() if ignore_nodata else None
+
+    stats = StreamingStats(
+        bins=bins,
+        hist_range=hist_range or _approximate_range(band),
+        classes=classes,
+        categories=categories
+    )
+    for xoff, yoff, width, height in iter_windows(ds.RasterXSize, ds.RasterYSize, block_size):
+        block = band.ReadAsArray(xoff, yoff, width, height).ravel()
+        if block.dtype.kind == "f":
+            block = block[np.isfinite(block)]
+        if nodata is not None:
+            block = block[block != nodata]
+        stats.update(block)
+
+    gt = ds.GetGeoTransform()
+    total = ds.RasterXSize * ds.RasterYSize
+    ds = None
+    return stats, total, (abs(gt[1]), abs(gt[5]))
+
+
+def array_stats(data, bins=DEFAULT_BINS, hist_range=None, classes=None, categories=None, nodata=None):
+    """The same accumulation over an in-memory array, fed in row chunks"""
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[np.newaxis, :]
+    data = data.reshape(-1, data.shape[-1])
+
+    if hist_range is None:
+        finite = data[np.isfinite(data)] if data.dtype.kind == "f" else data
+        if finite.size:
+            low, high = float(finite.min()), float(finite.max())
+            hist_range = (low, high if high > low else low + 1)
+
+    stats = StreamingStats(bins=bins, hist_range=hist_range, classes=classes, categories=categories)
+    for start in range(0, data.shape[0], ROW_CHUNK):
+        block = data[start:start + ROW_CHUNK].ravel()
+        if block.dtype.kind == "f":
+            block = block[np.isfinite(block)]
+        if nodata is not None:
+            block = block[block != nodata]
+        stats.update(block)
+    return stats
+
+
+def class_table_stats(stats, pixel_area_km2, total=None, skip_empty=True):
+    """Class rows in the {class_name, pixel_count, area_km2, percentage} shape the stats endpoints return"""
+    total = total or stats.count
+    rows = []
+    for label, count in stats.class_breakdown():
+        if skip_empty and count == 0:
+            continue
+        rows.append({
+            "class_name": label,
+            "pixel_count": count,
+            "area_km2": round(count * pixel_area_km2, 2),
+            "percentage": round((count / total) * 100, 2) if total else 0.0
+        })
+    return rows
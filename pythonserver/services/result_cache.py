@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import logging
+import threading
+from .ingest import file_digest
+from .workspace import atomic_path
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_FOLDER = os.getenv("RESULT_CACHE_DIR", "result_cache")
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 5 * 1024 ** 3))  # 5 GB
+CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+
+META_FILE = "meta.json"
+# Service arguments that change how a result is computed or reported, never the result itself
+RUNTIME_PARAMS = ("progress", "workers", "output_folder")
+
+
+def normalize_params(params):
+    """Canonical form of operation parameters, so 1 and 1.0 or 'Degree' and 'degree' share a key"""
+    normalized = {}
+    for name, value in sorted(params.items()):
+        if isinstance(value, bool) or value is None:
+            normalized[name] = value
+        elif isinstance(value, (int, float)):
+            normalized[name] = float(value)
+        elif isinstance(value, str):
+            normalized[name] = value.strip().lower()
+        elif isinstance(value, (list, tuple)):
+            normalized[name] = [v.strip().lower() if isinstance(v, str) else v for v in value]
+        else:
+            normalized[name] = str(value)
+    return normalized
+
+
+def service_params(service, params):
+    """params completed with the defaults of service's keyword arguments.
+
+    A job that only sends the parameters it changes and an endpoint that passes every form
+    default then key the same computation the same way.
+    """
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(service).parameters.items()
+        if parameter.default is not inspect.Parameter.empty and name not in RUNTIME_PARAMS
+    }
+    return {**defaults, **params}
+
+
+def _same_file(path_a, path_b):
+    """True when path_b is already a restored copy of path_a (copy2 keeps size and mtime)"""
+    if not os.path.exists(path_b):
+        return False
+    a, b = os.stat(path_a), os.stat(path_b)
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+class ResultCache:
+    """Disk-backed cache of analysis outputs keyed on (input content hash, operation, parameters).
+
+    Each entry is a directory holding copies of the output artifacts and a meta.json with the
+    service response. The meta file's mtime is the last access time used for LRU eviction.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.metrics = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def make_key(self, operation, input_paths, params):
+        payload = json.dumps({
+            "operation": operation,
+            "inputs": [file_digest(path) for path in input_paths],
+            "params": normalize_params(params)
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.folder, key)
+
+    def _remove_entry(self, entry_dir):
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def _read_meta(self, entry_dir):
+        """The entry's metadata, or None if it is missing, unreadable or expired (then removed)"""
+        try:
+            with open(os.path.join(entry_dir, META_FILE)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta["created"] > self.ttl_seconds:
+            self._remove_entry(entry_dir)
+            self.metrics["evictions"] += 1
+            return None
+        return meta
+
+    def get(self, key):
+        """Return the cached (response, status) and restore its artifacts, or None on a miss.
+
+        Only the metadata is read under the lock; the artifacts, which may be large rasters, are
+        copied outside it so one restore does not hold up every other lookup and store.
+        """
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+
+        with self._lock:
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                self.metrics["misses"] += 1
+                return None
+            # Mark as recently used first, so a concurrent eviction passes over it
+            os.utime(meta_path)
+
+        try:
+            # Put the artifacts back where the response says they are
+            for name, original_path in meta["artifacts"].items():
+                cached_path = os.path.join(entry_dir, name)
+                if not _same_file(cached_path, original_path):
+                    with atomic_path(original_path) as tmp_path:
+                        shutil.copy2(cached_path, tmp_path)
+        except OSError as e:
+            # Evicted or replaced while copying, or a broken entry: recompute either way
+            with self._lock:
+                current = self._read_meta(entry_dir)
+                if current is not None and current["created"] == meta["created"]:
+                    logger.warning(f"Dropping unreadable result cache entry {key}: {e}")
+                    self._remove_entry(entry_dir)
+                    self.metrics["evictions"] += 1
+                self.metrics["misses"] += 1
+            return None
+
+        with self._lock:
+            self.metrics["hits"] += 1
+        return meta["response"], meta["status"]
+
+    def put(self, key, response, status, artifact_paths):
+        """Store copies of artifact_paths ({name: path}) together with the service response"""
+        entry_dir = self._entry_dir(key)
+        staging_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(staging_dir, exist_ok=True)
+
+        try:
+            size = 0
+            for name, path in artifact_paths.items():
+                shutil.copy2(path, os.path.join(staging_dir, name))
+                size += os.path.getsize(path)
+
+            with open(os.path.join(staging_dir, META_FILE), "w") as f:
+                json.dump({
+                    "created": time.time(),
+                    "size": size,
+                    "status": status,
+                    "response": response,
+                    "artifacts": artifact_paths
+                }, f)
+
+            with self._lock:
+                if os.path.exists(entry_dir):
+                    self._remove_entry(entry_dir)
+                os.replace(staging_dir, entry_dir)
+                self.metrics["stores"] += 1
+        finally:
+            if os.path.exists(staging_dir):
+                self._remove_entry(staging_dir)
+
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            meta_path = os.path.join(self.folder, name, META_FILE)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta_path), meta["created"], meta["size"], name))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until the cache fits in max_bytes"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for last_access, created, size, name in self._entries():
+                if now - created > self.ttl_seconds:
+                    self._remove_entry(os.path.join(self.folder, name))
+                    self.metrics["evictions"] += 1
+                else:
+                    entries.append((last_access, size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for last_access, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove_entry(os.path.join(self.folder, name))
+                self.metrics["evictions"] += 1
+                total -= size
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries()
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            return {
+                **self.metrics,
+                "hit_ratio": round(self.metrics["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(entries),
+                "bytes": sum(entry[2] for entry in entries),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+RESULT_CACHE = ResultCache()
+
+
+def cached_service(operation, input_paths, params, service, *args, **kwargs):
+    """Run service(*args, **kwargs) through the result cache.
+
+    Every `*_path` entry of a successful response that points at a file is cached as an artifact.
+    params are keyed together with the service defaults they leave out.
+    """
+    key = RESULT_CACHE.make_key(operation, input_paths, service_params(service, params))
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        logger.info(f"Result cache hit for {operation}")
+        return cached
+
+    response, status = service(*args, **kwargs)
+    if status == 200:
+        artifacts = {
+            f"{name}_{os.path.basename(value)}": value
+            for name, value in response.items()
+            if name.endswith("_path") and isinstance(value, str) and os.path.isfile(value)
+        }
+        try:
+            RESULT_CACHE.put(key, response, status, artifacts)
+        except Exception as e:
+            logger.warning(f"Could not cache {operation} result: {e}")
+    return response, status
@@ -1,7 +1,12 @@
 from osgeo import gdal
 import os
+from .terrain import run_tiled
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
+from .workspace import unique_output_path
+from .raster_stats import raster_stats
 
-def slope_service(dem_path, slope_format="degree", scale=1.0, compute_edges=True):
+def slope_service(dem_path, slope_format="degree", scale=1.0, compute_edges=True, tiled=False, workers=None, progress=None):
     """Generate slope map from DEM file using GDAL DEMProcessing"""
     gdal.AllRegister()
 
@@ -9,22 +14,31 @@ def slope_service(dem_path, slope_format="degree", scale=1.0, compute_edges=True
         return {"error": f"DEM file not found: {dem_path}"}, 400
 
     try:
-        temp_dir = "outputs"
-        os.makedirs(temp_dir, exist_ok=True)
-        slope_path = os.path.join(temp_dir, f"slope_{os.path.basename(dem_path)}")
-
-        options = gdal.DEMProcessingOptions(
-            computeEdges=compute_edges,
-            slopeFormat=slope_format,
-            scale=scale
-        )
-
-        gdal.DEMProcessing(
-            slope_path,
-            dem_path,
-            "slope",
-            options=options
-        )
+        slope_path = unique_output_path("slope", dem_path)
+
+        # Producer writes a work file that is turned into a COG with overviews
+        with cog_output(slope_path, progress=span(progress, 0.8, 1.0)) as work_path:
+            if tiled:
+                # Windowed, multi-core execution for DEMs larger than RAM
+                run_tiled(dem_path, "slope", work_path, workers=workers,
+                          slope_format=slope_format, scale=scale,
+                          progress=span(progress, 0.0, 0.8))
+            else:
+                options = gdal.DEMProcessingOptions(
+                    computeEdges=compute_edges,
+                    slopeFormat=slope_format,
+                    scale=scale,
+                    format="GTiff",
+                    creationOptions=WORK_CREATION_OPTIONS,
+                    callback=gdal_callback(span(progress, 0.0, 0.8), "slope")
+                )
+
+                gdal.DEMProcessing(
+                    work_path,
+                    dem_path,
+                    "slope",
+                    options=options
+                )
 
         return {
             "success": True,
@@ -32,9 +46,51 @@ def slope_service(dem_path, slope_format="degree", scale=1.0, compute_edges=True
             "parameters": {
                 "slope_format": slope_format,
                 "scale": scale,
-                "compute_edges": compute_edges
+                "compute_edges": compute_edges,
+                "tiled": tiled
             }
         }, 200
 
     except Exception as e:
         return {"error": f"Slope calculation failed: {str(e)}"}, 500
+
+
+# Classification ranges
+SLOPE_CLASSES = [
+    {"label": "Flat (0-2°)", "range": (0, 2), "color": "#00ff00"},
+    {"label": "Gentle (2-6°)", "range": (2, 6), "color": "#a8ff00"},
+    {"label": "Moderate (6-15°)", "range": (6, 15), "color": "#ffff00"},
+    {"label": "Steep (15-30°)", "range": (15, 30), "color": "#ff7f00"},
+    {"label": "Very Steep (>30°)", "range": (30, 9999), "color": "#ff0000"},
+]
+
+
+def compute_slope_stats(slope_path):
+    """Compute min, max, mean + slope class breakdown for a slope raster in one blockwise pass"""
+    slope_stats, _, _ = raster_stats(
+        slope_path,
+        classes=[(cls["label"], *cls["range"]) for cls in SLOPE_CLASSES]
+    )
+    summary = slope_stats.summary()
+
+    # Statistics
+    stats = {
+        "min": summary["min"],
+        "max": summary["max"],
+        "mean": summary["mean"],
+        "std": summary["std"],
+        "percentiles": summary["percentiles"]
+    }
+
+    class_stats = []
+    total_pixels = slope_stats.count
+
+    for cls, (_, count) in zip(SLOPE_CLASSES, slope_stats.class_breakdown()):
+        class_stats.append({
+            "label": cls["label"],
+            "count": count,
+            "percent": round((count / total_pixels) * 100, 2) if total_pixels else 0.0,
+            "color": cls["color"]
+        })
+
+    return stats, class_stats
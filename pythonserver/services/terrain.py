@@ -0,0 +1,372 @@
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from osgeo import gdal
+from .output_writer import cog_output
+from .progress import OperationCancelled, span
+from .workspace import unique_output_path
+
+TERRAIN_PRODUCTS = ("slope", "aspect", "hillshade", "tpi", "roughness", "curvature")
+TERRAIN_NODATA = -9999.0
+HILLSHADE_NODATA = 0
+BLOCK_SIZE = 512
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Per-process DEM handles of the terrain pool workers, reused across the windows they process;
+# only ever touched from the single thread of a worker process
+_worker_datasets = OrderedDict()
+WORKER_DATASETS_MAX = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_products(products):
+    """Normalize a comma separated string or list of product names"""
+    if isinstance(products, str):
+        products = products.split(",")
+    names = []
+    for name in products:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in TERRAIN_PRODUCTS:
+            raise ValueError(f"Unknown terrain product '{name}'. Choose from: {', '.join(TERRAIN_PRODUCTS)}")
+        if name not in names:
+            names.append(name)
+    if not names:
+        raise ValueError("At least one terrain product is required")
+    return names
+
+
+def iter_windows(xsize, ysize, block_size=BLOCK_SIZE):
+    """Yield (xoff, yoff, width, height) windows covering the raster"""
+    for yoff in range(0, ysize, block_size):
+        for xoff in range(0, xsize, block_size):
+            yield xoff, yoff, min(block_size, xsize - xoff), min(block_size, ysize - yoff)
+
+
+def read_window_with_halo(band, window, nodata=None):
+    """Read a window plus a 1-pixel halo as float64, replicating edges at the raster border"""
+    xoff, yoff, width, height = window
+    x0 = max(xoff - 1, 0)
+    y0 = max(yoff - 1, 0)
+    x1 = min(xoff + width + 1, band.XSize)
+    y1 = min(yoff + height + 1, band.YSize)
+
+    data = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0).astype(np.float64)
+    if nodata is not None:
+        data[data == nodata] = np.nan
+
+    pad = (
+        (1 - (yoff - y0), 1 - (y1 - (yoff + height))),
+        (1 - (xoff - x0), 1 - (x1 - (xoff + width))),
+    )
+    return np.pad(data, pad, mode="edge")
+
+
+def compute_terrain_block(padded, products, ewres, nsres, z_factor=1.0, scale=1.0,
+                          azimuth=315.0, altitude=45.0, slope_format="degree",
+                          trigonometric=False, zero_for_flat=True):
+    """Compute every requested product from one 3x3 neighborhood scan of a haloed block.
+
+    `padded` holds NaN for nodata; any NaN in a neighborhood makes that output pixel NaN.
+    """
+    z = padded * z_factor
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, e, f = z[1:-1, :-2], z[1:-1, 1:-1], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+
+    xres = abs(ewres) * scale
+    yres = abs(nsres) * scale
+    results = {}
+
+    if {"slope", "aspect", "hillshade"} & set(products):
+        # Horn gradients, shared by slope, aspect and hillshade
+        dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+        dzdy = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * yres)
+        gradient = np.hypot(dzdx, dzdy)
+
+        if "slope" in products:
+            if slope_format == "percent":
+                results["slope"] = gradient * 100.0
+            else:
+                results["slope"] = np.degrees(np.arctan(gradient))
+
+        if "aspect" in products:
+            if trigonometric:
+                aspect = np.degrees(np.arctan2(-dzdy, -dzdx))
+            else:
+                aspect = np.degrees(np.arctan2(-dzdx, -dzdy))
+            aspect = np.mod(aspect, 360.0)
+            aspect[gradient == 0] = 0.0 if zero_for_flat else np.nan
+            results["aspect"] = aspect
+
+        if "hillshade" in products:
+            az = np.radians(azimuth)
+            alt = np.radians(altitude)
+            shade = (np.sin(alt)
+                     - dzdx * np.sin(az) * np.cos(alt)
+                     - dzdy * np.cos(az) * np.cos(alt)) / np.sqrt(1.0 + gradient ** 2)
+            # Same 1..255 range as gdaldem, keeping 0 for nodata
+            results["hillshade"] = 1.0 + 254.0 * np.clip(shade, 0.0, 1.0)
+
+    if "tpi" in products:
+        results["tpi"] = e - (a + b + c + d + f + g + h + i) / 8.0
+
+    if "roughness" in products:
+        window = (a, b, c, d, e, f, g, h, i)
+        results["roughness"] = np.maximum.reduce(window) - np.minimum.reduce(window)
+
+    if "curvature" in products:
+        # Zevenbergen & Thorne profile curvature, in the same 1/100 z-unit scale as ArcGIS
+        D = ((d + f) / 2.0 - e) / xres ** 2
+        E = ((b + h) / 2.0 - e) / yres ** 2
+        F = (-a + c + g - i) / (4.0 * xres * yres)
+        G = (f - d) / (2.0 * xres)
+        H = (b - h) / (2.0 * yres)
+        denominator = G ** 2 + H ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            curvature = -2.0 * (D * G ** 2 + E * H ** 2 + F * G * H) / denominator * 100.0
+        curvature[denominator == 0] = 0.0
+        curvature[np.isnan(e)] = np.nan
+        results["curvature"] = curvature
+
+    return results
+
+
+def _create_output(path, product, src_ds):
+    driver = gdal.GetDriverByName("GTiff")
+    if product == "hillshade":
+        data_type, nodata = gdal.GDT_Byte, HILLSHADE_NODATA
+    else:
+        data_type, nodata = gdal.GDT_Float32, TERRAIN_NODATA
+
+    dst_ds = driver.Create(
+        path, src_ds.RasterXSize, src_ds.RasterYSize, 1, data_type,
+        options=["TILED=YES", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"]
+    )
+    dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
+    dst_ds.SetProjection(src_ds.GetProjection())
+    band = dst_ds.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.SetDescription(product)
+    return dst_ds
+
+
+def _write_block(dst_ds, product, values, xoff, yoff):
+    band = dst_ds.GetRasterBand(1)
+    invalid = np.isnan(values)
+    if product == "hillshade":
+        block = values.astype(np.uint8)
+        block[invalid] = HILLSHADE_NODATA
+    else:
+        block = values.astype(np.float32)
+        block[invalid] = TERRAIN_NODATA
+    band.WriteArray(block, xoff, yoff)
+
+
+def _compute_window(dem_ds, window, products, params):
+    gt = dem_ds.GetGeoTransform()
+    band = dem_ds.GetRasterBand(1)
+    padded = read_window_with_halo(band, window, band.GetNoDataValue())
+    return window, compute_terrain_block(padded, products, gt[1], gt[5], **params)
+
+
+def _init_worker():
+    gdal.AllRegister()
+    _worker_datasets.clear()
+
+
+def _process_window(dem_path, window, products, params):
+    """Compute the requested products for one window; runs inside a terrain pool worker"""
+    dem_ds = _worker_datasets.get(dem_path)
+    if dem_ds is None:
+        dem_ds = gdal.Open(dem_path)
+        if dem_ds is None:
+            raise ValueError(f"Could not open DEM file: {dem_path}")
+        _worker_datasets[dem_path] = dem_ds
+        while len(_worker_datasets) > WORKER_DATASETS_MAX:
+            _worker_datasets.popitem(last=False)
+    else:
+        _worker_datasets.move_to_end(dem_path)
+    return _compute_window(dem_ds, window, products, params)
+
+
+def _terrain_pool():
+    """The process pool shared by every tiled terrain request, started on first use.
+
+    spawn, as for the job workers: forking a threaded server that holds GDAL handles is not safe.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=DEFAULT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return _pool
+
+
+def shutdown_terrain_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _iter_results(dem_path, windows, products, params, workers):
+    """Yield (window, results) serially, or from the shared process pool with at most
+    workers x 2 windows of this request in flight.
+
+    The serial path runs on a compute pool thread and opens its own DEM handle: GDAL datasets
+    cannot be shared between threads.
+    """
+    workers = min(max(int(workers or 1), 1), DEFAULT_WORKERS)
+    if workers <= 1:
+        dem_ds = gdal.Open(dem_path)
+        if dem_ds is None:
+            raise ValueError("Could not open DEM file")
+        try:
+            for window in windows:
+                yield _compute_window(dem_ds, window, products, params)
+        finally:
+            dem_ds = None
+        return
+
+    pool = _terrain_pool()
+    pending = set()
+    try:
+        for window in windows:
+            pending.add(pool.submit(_process_window, dem_path, window, products, params))
+            # Keep memory bounded by tile size x workers
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Closed early (cancelled or failed): drop the windows not started yet
+        for future in pending:
+            future.cancel()
+
+
+def render_terrain(dem_path, output_paths, params, block_size=BLOCK_SIZE, workers=1, progress=None):
+    """Write each product in `output_paths` ({product: path}) as a tiled GeoTIFF, window by window.
+
+    progress is updated after every window; once it is cancelled, OperationCancelled is raised
+    and the windows still queued are dropped.
+    """
+    dem_ds = gdal.Open(dem_path)
+    if dem_ds is None:
+        raise ValueError("Could not open DEM file")
+
+    products = list(output_paths)
+    outputs = {}
+    try:
+        for product, path in output_paths.items():
+            outputs[product] = _create_output(path, product, dem_ds)
+
+        windows = iter_windows(dem_ds.RasterXSize, dem_ds.RasterYSize, block_size)
+        total = -(-dem_ds.RasterXSize // block_size) * -(-dem_ds.RasterYSize // block_size)
+        results_iter = _iter_results(dem_path, windows, products, params, workers)
+        try:
+            for done, (window, results) in enumerate(results_iter, 1):
+                for product, values in results.items():
+                    _write_block(outputs[product], product, values, window[0], window[1])
+                if progress is not None and not progress.update(done / total, "computing blocks"):
+                    raise OperationCancelled("Operation cancelled")
+        finally:
+            results_iter.close()
+    finally:
+        # Closing the datasets flushes the blocks to disk
+        for product in list(outputs):
+            outputs[product] = None
+        dem_ds = None
+
+    return output_paths
+
+
+def run_tiled(dem_path, product, output_path, workers=None, block_size=BLOCK_SIZE, progress=None, **params):
+    """Tiled, multi-core execution of a single terrain product for the services/* functions"""
+    render_terrain(
+        dem_path,
+        {product: output_path},
+        params,
+        block_size=block_size,
+        workers=workers or DEFAULT_WORKERS,
+        progress=progress
+    )
+    return output_path
+
+
+def terrain_service(dem_path, products=TERRAIN_PRODUCTS, z_factor=1.0, scale=1.0,
+                    azimuth=315.0, altitude=45.0, slope_format="degree",
+                    trigonometric=False, zero_for_flat=True, block_size=BLOCK_SIZE, workers=1, progress=None):
+    """Compute several terrain products from a single block-by-block pass over the DEM."""
+    gdal.AllRegister()
+
+    if not os.path.exists(dem_path):
+        return {"error": f"DEM file not found: {dem_path}"}, 400
+
+    try:
+        products = parse_products(products)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    # More processes than cores only adds contention
+    workers = min(max(int(workers or 1), 1), DEFAULT_WORKERS)
+
+    try:
+        paths = {product: unique_output_path(product, dem_path, ".tif") for product in products}
+        params = {
+            "z_factor": z_factor,
+            "scale": scale,
+            "azimuth": azimuth,
+            "altitude": altitude,
+            "slope_format": slope_format,
+            "trigonometric": trigonometric,
+            "zero_for_flat": zero_for_flat
+        }
+        # Rendering takes the first 70% of the progress range, the COG passes share the rest;
+        # the stack converts the last product first, so the spans are handed out in reverse
+        cog_step = 0.3 / len(paths)
+        with ExitStack() as stack:
+            # Render into work files, then publish each product as a COG
+            work_paths = {
+                product: stack.enter_context(cog_output(
+                    path, resampling="NEAREST" if product == "aspect" else "AVERAGE",
+                    progress=span(progress, 1.0 - cog_step * (index + 1), 1.0 - cog_step * index)
+                ))
+                for index, (product, path) in enumerate(paths.items())
+            }
+            render_terrain(dem_path, work_paths, params, block_size=block_size, workers=workers,
+                           progress=span(progress, 0.0, 0.7))
+
+        return {
+            "success": True,
+            "outputs": paths,
+            "download_urls": {
+                product: f"/download?file={os.path.basename(path)}"
+                for product, path in paths.items()
+            },
+            "parameters": {
+                "products": products,
+                "z_factor": z_factor,
+                "scale": scale,
+                "azimuth": azimuth,
+                "altitude": altitude,
+                "slope_format": slope_format,
+                "workers": workers
+            }
+        }, 200
+
+    except Exception as e:
+        return {"error": f"Terrain calculation failed: {str(e)}"}, 500
@@ -0,0 +1,308 @@
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from osgeo import gdal, osr
+from PIL import Image
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+TILE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+TILE_CACHE_FOLDER = os.getenv("TILE_CACHE_DIR", "tile_cache")
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", 1024 ** 3))  # 1 GB
+TILE_SOURCE_FOLDERS = ["outputs", "saved_tiffs", "LST_data", "LULC_data"]
+# Bounds and value ranges kept for this many source file versions
+TILE_SOURCE_INFO_MAX_ENTRIES = int(os.getenv("TILE_SOURCE_INFO_MAX_ENTRIES", 512))
+
+WEB_MERCATOR_HALF = 20037508.342789244
+
+# Color ramps as (position 0..1, (r, g, b)) stops
+COLOR_RAMPS = {
+    "gray": [(0.0, (0, 0, 0)), (1.0, (255, 255, 255))],
+    "slope": [(0.0, (0, 255, 0)), (0.25, (168, 255, 0)), (0.5, (255, 255, 0)),
+              (0.75, (255, 127, 0)), (1.0, (255, 0, 0))],
+    "aspect": [(0.0, (255, 0, 0)), (0.25, (255, 255, 0)), (0.5, (0, 255, 255)),
+               (0.75, (0, 0, 255)), (1.0, (255, 0, 0))],
+    "ndvi": [(0.0, (165, 0, 38)), (0.4, (254, 224, 139)), (0.6, (166, 217, 106)), (1.0, (0, 104, 55))],
+    "diverging": [(0.0, (202, 0, 32)), (0.5, (247, 247, 247)), (1.0, (5, 113, 176))],
+    "thermal": [(0.0, (49, 54, 149)), (0.25, (116, 173, 209)), (0.5, (255, 255, 191)),
+                (0.75, (244, 109, 67)), (1.0, (165, 0, 38))],
+}
+
+# ESA WorldCover class colors
+CATEGORICAL_COLORMAPS = {
+    "lulc": {
+        10: (0, 100, 0), 20: (255, 187, 34), 30: (255, 255, 76), 40: (240, 150, 255),
+        50: (250, 0, 0), 60: (180, 180, 180), 70: (240, 240, 240), 80: (0, 100, 200),
+        90: (0, 150, 160), 95: (0, 207, 117), 100: (250, 230, 160)
+    }
+}
+
+# Default colormap by output name prefix
+PRODUCT_COLORMAPS = {
+    "hillshade": "gray",
+    "slope": "slope",
+    "aspect": "aspect",
+    "ndvi": "ndvi",
+    "ndwi": "diverging",
+    "ndbi": "diverging",
+    "tpi": "diverging",
+    "curvature": "diverging",
+    "roughness": "slope",
+    "lst": "thermal",
+    "lulc": "lulc",
+}
+
+_source_info = OrderedDict()
+_source_lock = threading.Lock()
+_overview_lock = threading.Lock()
+
+
+def resolve_tile_source(product_id, folders=TILE_SOURCE_FOLDERS):
+    """Find a derived raster by its file name in the folders the services write to"""
+    name = os.path.basename(product_id or "")
+    if not name or name != product_id:
+        raise ValueError(f"Invalid product id: {product_id}")
+    for folder in folders:
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"Product not found: {product_id}")
+
+
+def default_colormap(product_id):
+    prefix = os.path.basename(product_id).split("_")[0].split(".")[0].lower()
+    return PRODUCT_COLORMAPS.get(prefix, "gray")
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of an XYZ tile"""
+    size = 2 * WEB_MERCATOR_HALF / (2 ** z)
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+@lru_cache(maxsize=None)
+def _ramp_lut(name):
+    stops = COLOR_RAMPS[name]
+    positions = [p for p, _ in stops]
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    levels = np.linspace(0.0, 1.0, 256)
+    for channel in range(3):
+        lut[:, channel] = np.interp(levels, positions, [c[channel] for _, c in stops])
+    return lut
+
+
+def _ensure_overviews(path, categorical):
+    """Build external overviews once so low zoom levels read a reduced copy instead of full resolution"""
+    ds = gdal.Open(path)
+    band = ds.GetRasterBand(1)
+    if band.GetOverviewCount() > 0:
+        return
+    levels = []
+    factor = 2
+    while max(ds.RasterXSize, ds.RasterYSize) / factor >= TILE_SIZE:
+        levels.append(factor)
+        factor *= 2
+    if levels:
+        ds.BuildOverviews("NEAREST" if categorical else "AVERAGE", levels)
+        logger.info(f"Built overviews {levels} for {path}")
+    ds = None
+
+
+def _source_metadata(path, categorical):
+    """Mercator bounds and value range of a source, computed once per file version"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _source_lock:
+        info = _source_info.get(key)
+        if info:
+            _source_info.move_to_end(key)
+    if info:
+        return info
+
+    with _overview_lock:
+        _ensure_overviews(path, categorical)
+    ds = gdal.Open(path)
+    gt = ds.GetGeoTransform()
+    corners = [
+        (gt[0], gt[3]),
+        (gt[0] + gt[1] * ds.RasterXSize, gt[3] + gt[5] * ds.RasterYSize),
+    ]
+    src_srs = osr.SpatialReference(wkt=ds.GetProjection())
+    src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    mercator = osr.SpatialReference()
+    mercator.ImportFromEPSG(3857)
+    mercator.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src_srs, mercator)
+    minx, miny, maxx, maxy = transform.TransformBounds(
+        min(c[0] for c in corners), min(c[1] for c in corners),
+        max(c[0] for c in corners), max(c[1] for c in corners), 21
+    )
+
+    band = ds.GetRasterBand(1)
+    # Approximate statistics read from the overviews
+    vmin, vmax, _, _ = band.GetStatistics(True, True)
+    ds = None
+
+    info = {"bounds": (minx, miny, maxx, maxy), "vmin": vmin, "vmax": vmax}
+    with _source_lock:
+        _source_info[key] = info
+        _source_info.move_to_end(key)
+        # Rewritten or removed outputs leave stale versions behind; drop the least recently used
+        while len(_source_info) > TILE_SOURCE_INFO_MAX_ENTRIES:
+            _source_info.popitem(last=False)
+    return info
+
+
+def _encode(rgba, fmt):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format=fmt.upper())
+    return buffer.getvalue()
+
+
+def render_tile(path, z, x, y, colormap, vmin=None, vmax=None, fmt="png", tile_size=TILE_SIZE):
+    """Warp one web-mercator tile out of the source raster and color it"""
+    categorical = colormap in CATEGORICAL_COLORMAPS
+    info = _source_metadata(path, categorical)
+    bounds = tile_bounds(z, x, y)
+
+    sx0, sy0, sx1, sy1 = info["bounds"]
+    if bounds[0] >= sx1 or bounds[2] <= sx0 or bounds[1] >= sy1 or bounds[3] <= sy0:
+        return _encode(np.zeros((tile_size, tile_size, 4), dtype=np.uint8), fmt)
+
+    warped = gdal.Warp(
+        "", path,
+        format="MEM",
+        dstSRS="EPSG:3857",
+        outputBounds=bounds,
+        width=tile_size,
+        height=tile_size,
+        resampleAlg="near" if categorical else "bilinear",
+        dstAlpha=True
+    )
+    values = warped.GetRasterBand(1).ReadAsArray()
+    alpha = warped.GetRasterBand(warped.RasterCount).ReadAsArray().astype(np.uint8)
+    warped = None
+
+    rgba = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+    if categorical:
+        for value, color in CATEGORICAL_COLORMAPS[colormap].items():
+            rgba[values == value, :3] = color
+        alpha[~np.isin(values, list(CATEGORICAL_COLORMAPS[colormap]))] = 0
+    else:
+        vmin = info["vmin"] if vmin is None else vmin
+        vmax = info["vmax"] if vmax is None else vmax
+        span = (vmax - vmin) or 1.0
+        values = values.astype(np.float32)
+        alpha[np.isnan(values)] = 0
+        index = np.clip((np.nan_to_num(values, nan=vmin) - vmin) / span * 255.0, 0, 255).astype(np.uint8)
+        rgba[..., :3] = _ramp_lut(colormap)[index]
+    rgba[..., 3] = alpha
+    return _encode(rgba, fmt)
+
+
+class TileCache:
+    """Encoded tiles on disk, evicted least recently used first once over max_bytes"""
+
+    def __init__(self, folder=TILE_CACHE_FOLDER, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def path_for(self, product_id, etag, style, z, x, y, fmt):
+        version = hashlib.sha1(f"{product_id}|{etag}|{style}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.folder, version, str(z), str(x), f"{y}.{fmt}")
+
+    def get(self, path):
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError:
+            with self._lock:
+                self.metrics["misses"] += 1
+            return None
+        os.utime(path)
+        with self._lock:
+            self.metrics["hits"] += 1
+        return content
+
+    def put(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += len(content)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _tiles(self):
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._tiles())
+
+    def _evict(self):
+        # Trim to 80% so eviction does not run on every write
+        target = self.max_bytes * 0.8
+        tiles = sorted(self._tiles())
+        total = sum(size for _, size, _ in tiles)
+        for _, size, path in tiles:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.metrics["evictions"] += 1
+        self._bytes = total
+
+
+TILE_CACHE = TileCache()
+
+
+def tile_service(product_id, z, x, y, fmt="png", colormap=None, vmin=None, vmax=None):
+    """Return (tile bytes, media type) for an XYZ tile of a derived raster, using the tile cache"""
+    if fmt not in TILE_FORMATS:
+        raise ValueError(f"Tile format must be one of: {', '.join(TILE_FORMATS)}")
+    if z < 0 or z > 24 or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile address {z}/{x}/{y}")
+
+    colormap = colormap or default_colormap(product_id)
+    if colormap not in COLOR_RAMPS and colormap not in CATEGORICAL_COLORMAPS:
+        raise ValueError(f"Unknown colormap '{colormap}'")
+
+    path = resolve_tile_source(product_id)
+    stat = os.stat(path)
+    etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    style = f"{colormap}|{vmin}|{vmax}"
+
+    cache_path = TILE_CACHE.path_for(product_id, etag, style, z, x, y, fmt)
+    content = TILE_CACHE.get(cache_path)
+    if content is None:
+        content = render_tile(path, z, x, y, colormap, vmin=vmin, vmax=vmax, fmt=fmt)
+        TILE_CACHE.put(cache_path, content)
+    return content, TILE_FORMATS[fmt]
@@ -1,107 +1,99 @@
-import os
-import tempfile
-import zipfile
-import geopandas as gpd
-from sentinelhub import  CRS, Geometry
+from sentinelhub import CRS, Geometry
+from shapely.geometry import shape
 import ee
 from osgeo import gdal
 import logging
+from .aoi import read_aoi
+from .output_writer import cog_output, WORK_CREATION_OPTIONS
+from .progress import span, gdal_callback
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- Helper function for unzip + shapefile reading ---
+# --- AOI readers: zipped shapefile, GeoPackage, GeoJSON or FlatGeobuf, read in place ---
 def unzip_and_read_shapefile(zip_path: str):
-    """Unzips a shapefile ZIP and returns a SentinelHub Geometry + bounds"""
-    if not os.path.exists(zip_path):
-        raise FileNotFoundError(f"File not found: {zip_path}")
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(tmpdir)
-
-        # Find .shp file inside extracted folder
-        shp_files = [f for f in os.listdir(tmpdir) if f.endswith(".shp")]
-        if not shp_files:
-            raise ValueError("No .shp file found in ZIP")
-        
-        shp_path = os.path.join(tmpdir, shp_files[0])
-
-        gdf = gpd.read_file(shp_path)
-        gdf = gdf.to_crs(epsg=4326)
-
-        geom = gdf.geometry.iloc[0]
-        return Geometry(geom, crs=CRS.WGS84), gdf
+    """Return a SentinelHub Geometry of the AOI (all features dissolved, WGS84) and the parsed AOI"""
+    aoi = read_aoi(zip_path)
+    return Geometry(shape(aoi.geojson), crs=CRS.WGS84), aoi
 
 
 def unzip_and_read_shapefile_ee(zip_path: str):
-    """Unzip shapefile ZIP and return EE geometry + shapefile path"""
-    if not os.path.exists(zip_path):
-        raise FileNotFoundError(f"File not found: {zip_path}")
+    """Return an EE Geometry of the AOI and the OGR name of its layer, usable as a GDAL cutline.
 
-    tmpdir = tempfile.mkdtemp(prefix="shp_extract_")
-    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        zip_ref.extractall(tmpdir)
+    Nothing is extracted: a ZIP is read through /vsizip/, and a parsed AOI is reused for the
+    same file content.
+    """
+    aoi = read_aoi(zip_path)
+    return ee.Geometry(aoi.geojson), aoi.source
 
-    # Find .shp
-    shp_files = [f for f in os.listdir(tmpdir) if f.endswith(".shp")]
-    if not shp_files:
-        raise ValueError("No .shp file found in ZIP")
-    shp_path = os.path.join(tmpdir, shp_files[0])
 
-    # Read shapefile geometry
-    gdf = gpd.read_file(shp_path)
-    gdf = gdf.to_crs(epsg=4326)
-    
-    # If multiple features, create a union
-    if len(gdf) > 1:
-        geom = gdf.unary_union
-    else:
-        geom = gdf.geometry.iloc[0]
+def _clip_to(input_raster, destination, shapefile, bbox, output_format, creation_options, callback):
+    """Clip input_raster into destination with Warp (cutline) or Translate (bbox); returns the dataset"""
+    if shapefile:
+        # Use Warp with cutline for precise clipping
+        warp_options = gdal.WarpOptions(
+            cutlineDSName=shapefile,
+            cropToCutline=True,
+            dstNodata=0,
+            format=output_format,
+            creationOptions=creation_options,
+            callback=callback
+        )
+        return gdal.Warp(
+            destination,
+            input_raster,
+            options=warp_options
+        )
+    if bbox:
+        minX, minY, maxX, maxY = bbox
+        # Use Translate with proper coordinate order
+        translate_options = gdal.TranslateOptions(
+            projWin=[minX, maxY, maxX, minY],  # ULX, ULY, LRX, LRY
+            format=output_format,
+            creationOptions=creation_options,
+            callback=callback
+        )
+        return gdal.Translate(
+            destination,
+            input_raster,
+            options=translate_options
+        )
+    raise ValueError("Provide either shapefile or bbox")
 
-    # Convert to EE Geometry
-    ee_geom = ee.Geometry(geom.__geo_interface__)
-    return ee_geom, shp_path
 
-def clip_raster_gdal(input_raster, output_raster, shapefile=None, bbox=None):
-    """Clip raster using GDAL with mask layer"""
+def clip_raster_gdal(input_raster, output_raster, shapefile=None, bbox=None, resampling="NEAREST", progress=None):
+    """Clip raster using GDAL to a cutline layer (any OGR source, e.g. a /vsizip/ path) or a bbox, written as a COG.
+
+    For pipelines that only read the clip back, a .vrt output_raster is a virtual clip that
+    is evaluated on read, and another /vsimem/ output an in-memory GTiff; neither gets a COG pass.
+    """
     try:
-        if shapefile:
-            # Use Warp with cutline for precise clipping
-            warp_options = gdal.WarpOptions(
-                cutlineDSName=shapefile,
-                cropToCutline=True,
-                dstNodata=0,
-                format='GTiff',
-                creationOptions=['COMPRESS=LZW']
-            )
-            ds = gdal.Warp(
-                output_raster,
-                input_raster,
-                options=warp_options
-            )
-        elif bbox:
-            minX, minY, maxX, maxY = bbox
-            # Use Translate with proper coordinate order
-            translate_options = gdal.TranslateOptions(
-                projWin=[minX, maxY, maxX, minY],  # ULX, ULY, LRX, LRY
-                format='GTiff',
-                creationOptions=['COMPRESS=LZW']
+        if output_raster.lower().endswith(".vrt") or output_raster.startswith("/vsimem/"):
+            virtual = output_raster.lower().endswith(".vrt")
+            ds = _clip_to(
+                input_raster, output_raster, shapefile, bbox, "VRT" if virtual else "GTiff",
+                [] if virtual else WORK_CREATION_OPTIONS, gdal_callback(progress, "clipping")
             )
-            ds = gdal.Translate(
-                output_raster,
-                input_raster,
-                options=translate_options
-            )
-        else:
-            raise ValueError("Provide either shapefile or bbox")
+            if ds is None:
+                if progress is not None:
+                    progress.check()
+                raise RuntimeError("GDAL failed to clip raster")
+            ds = None
+            return output_raster
 
-        if ds is None:
-            raise RuntimeError("GDAL failed to clip raster")
+        with cog_output(output_raster, resampling=resampling, progress=span(progress, 0.8, 1.0)) as work_path:
+            ds = _clip_to(
+                input_raster, work_path, shapefile, bbox, "GTiff", WORK_CREATION_OPTIONS,
+                gdal_callback(span(progress, 0.0, 0.8), "clipping")
+            )
+            if ds is None:
+                if progress is not None:
+                    progress.check()
+                raise RuntimeError("GDAL failed to clip raster")
         
-        # Flush cache and close dataset
-        ds = None
+            # Flush cache and close dataset
+            ds = None
         return output_raster
         
     except Exception as e:
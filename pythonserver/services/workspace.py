@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from osgeo import gdal
+from .dataset_cache import DATASET_CACHE
+from .ingest import forget_digest
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_DIR", "workspaces")
+# Workspaces older than this are left over from a crashed worker and can be swept
+WORKSPACE_MAX_AGE = int(os.getenv("WORKSPACE_MAX_AGE", 24 * 3600))
+OUTPUT_FOLDER = "outputs"
+
+
+def new_token():
+    """Short random id used to keep file and directory names unique across requests and workers"""
+    return uuid.uuid4().hex[:12]
+
+
+def unique_output_path(prefix, source_path=None, ext=None, folder=OUTPUT_FOLDER):
+    """Path for a published result, `<prefix>_<source stem>_<token><ext>` inside folder.
+
+    The token keeps concurrent requests on the same input (or on inputs with the same file
+    name) from writing to the same result. ext defaults to the source file's extension.
+    """
+    stem, source_ext = os.path.splitext(os.path.basename(source_path or ""))
+    name = "_".join(part for part in (prefix, stem, new_token()) if part)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name + (ext if ext is not None else source_ext or ".tif"))
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a private temporary path next to path; it replaces path only if the block succeeds.
+
+    Readers never see a partially written file, and two writers of the same path never share
+    a temporary file.
+    """
+    folder, name = os.path.split(path)
+    os.makedirs(folder or ".", exist_ok=True)
+    stem, ext = os.path.splitext(name)
+    # Keep the extension so GDAL/OGR can still pick the driver from the name
+    tmp_path = os.path.join(folder, f".{stem}.{new_token()}.tmp{ext}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def publish(source_path, destination):
+    """Move a finished file out of a workspace to destination in one atomic step"""
+    with atomic_path(destination) as tmp_path:
+        # A rename when both sides are on the same filesystem, a copy otherwise
+        shutil.move(source_path, tmp_path)
+    return destination
+
+
+class Workspace:
+    """A private directory for one request or job, removed with everything in it on cleanup.
+
+    Use it as a context manager, or call cleanup() yourself. file() hands out paths that are
+    unique within the workspace, so two uploads with the same client filename do not collide.
+    """
+
+    def __init__(self, root=WORKSPACE_ROOT, prefix="req", path=None):
+        if path is not None:
+            # Reattach to a workspace created earlier, e.g. by the request that queued a job
+            self.path = path
+            self.id = os.path.basename(path).split("-", 1)[-1]
+            os.makedirs(self.path, exist_ok=True)
+        else:
+            self.id = new_token()
+            self.path = os.path.join(root, f"{prefix}-{self.id}")
+            os.makedirs(self.path)
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def file(self, name):
+        """Path for name inside the workspace, suffixed with a counter if name was handed out before"""
+        name = os.path.basename(name or "") or "file.bin"
+        stem, ext = os.path.splitext(name)
+        with self._lock:
+            candidate, counter = name, 1
+            while candidate in self._names or os.path.exists(os.path.join(self.path, candidate)):
+                candidate = f"{stem}_{counter}{ext}"
+                counter += 1
+            self._names.add(candidate)
+        return os.path.join(self.path, candidate)
+
+    def subdir(self, name):
+        """A fresh directory inside the workspace"""
+        path = self.file(name)
+        os.makedirs(path)
+        return path
+
+    def cleanup(self):
+        """Forget cached handles and digests of the workspace files, then delete the directory"""
+        if not os.path.isdir(self.path):
+            return
+        for folder, _, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(folder, name)
+                DATASET_CACHE.invalidate(path)
+                forget_digest(path)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+class MemoryWorkspace:
+    """The /vsimem/ counterpart of Workspace, for intermediates that are only read back once.
+
+    file() hands out unique names under a private /vsimem/ directory; cleanup() frees
+    everything in it, including files GDAL created next to them (tiles, .aux.xml).
+    """
+
+    def __init__(self, prefix="pipe"):
+        self.id = new_token()
+        self.path = f"/vsimem/{prefix}-{self.id}"
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def file(self, name):
+        """/vsimem/ path for name, suffixed with a counter if name was handed out before"""
+        name = os.path.basename(name or "") or "file.bin"
+        stem, ext = os.path.splitext(name)
+        with self._lock:
+            candidate, counter = name, 1
+            while candidate in self._names:
+                candidate = f"{stem}_{counter}{ext}"
+                counter += 1
+            self._names.add(candidate)
+        return f"{self.path}/{candidate}"
+
+    def cleanup(self):
+        for name in gdal.ReadDirRecursive(self.path) or []:
+            if not name.endswith("/"):
+                gdal.Unlink(f"{self.path}/{name}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+def sweep_workspaces(root=WORKSPACE_ROOT, max_age=WORKSPACE_MAX_AGE, prefix="req-"):
+    """Remove workspaces older than max_age seconds, left behind by killed workers; returns the count.
+
+    Only request workspaces (prefix) are swept; job workspaces live until their job is purged.
+    """
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for name in os.listdir(root):
+        if not name.startswith(prefix):
+            continue
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale workspace(s) from {root}")
+    return removed
@@ -0,0 +1,384 @@
+import os
+import csv
+import json
+import math
+import logging
+import numpy as np
+from osgeo import gdal, ogr, osr
+from .aoi import aoi_source, AOIError
+from .band_math import _crs_name
+from .raster_stats import StreamingStats, CLASS_TABLES, LULC_CLASSES
+from .terrain import iter_windows, BLOCK_SIZE
+from .progress import OperationCancelled, span, gdal_callback
+from .workspace import atomic_path, new_token, unique_output_path, OUTPUT_FOLDER
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ZONAL_FORMATS = ("geojson", "csv")
+# Per-zone histogram: a break table, "values" (one bin per integer value), "lulc" (values with
+# WorldCover class names), "none", or "auto" to pick one from the product name
+ZONAL_HISTOGRAMS = ("auto", "none", "values", "lulc") + tuple(CLASS_TABLES)
+ZONE_STATISTICS = ("count", "mean", "min", "max", "std")
+# "values" histograms are for categorical rasters; more distinct values than this is an error
+MAX_ZONE_CATEGORIES = 256
+
+
+class ZonalStatsError(ValueError):
+    """A zone layer, histogram or output format the zonal statistics cannot use"""
+
+
+class ZonalAccumulator:
+    """Per-zone count/mean/min/max/std and histograms, filled block by block.
+
+    update() takes the zone id of every valid pixel of a block (0 is outside every zone) and
+    its value. Each statistic is a bincount over the zone ids, so the cost does not depend on
+    the number of zones; means and squared deviations are merged per zone as in StreamingStats.
+    """
+
+    def __init__(self, zone_count, classes=None, values=False, max_categories=MAX_ZONE_CATEGORIES):
+        size = zone_count + 1
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+        self._classes = StreamingStats(classes=classes) if classes else None
+        self.categories = np.zeros(0, dtype=np.int64) if values else None
+        self.max_categories = max_categories
+        self.histogram = np.zeros((size, len(classes) if classes else 0), dtype=np.int64)
+
+    def update(self, zones, values):
+        if zones.size == 0:
+            return
+        size = len(self.count)
+        values = values.astype(np.float64, copy=False)
+
+        counts = np.bincount(zones, minlength=size)
+        present = counts > 0
+        block_mean = np.divide(np.bincount(zones, weights=values, minlength=size), counts,
+                               out=np.zeros(size), where=present)
+        deviation = values - block_mean[zones]
+        block_m2 = np.bincount(zones, weights=deviation * deviation, minlength=size)
+        total = self.count + counts
+        share = np.divide(counts, total, out=np.zeros(size), where=present)
+        delta = block_mean - self.mean
+        self.mean += delta * share
+        self.m2 += block_m2 + delta * delta * self.count * share
+        self.count = total
+
+        # Extremes: sort the block by zone once, then reduce each run of equal ids
+        order = np.argsort(zones, kind="stable")
+        sorted_zones = zones[order]
+        sorted_values = values[order]
+        starts = np.flatnonzero(np.diff(sorted_zones, prepend=-1))
+        ids = sorted_zones[starts]
+        self.min[ids] = np.minimum(self.min[ids], np.minimum.reduceat(sorted_values, starts))
+        self.max[ids] = np.maximum(self.max[ids], np.maximum.reduceat(sorted_values, starts))
+
+        if self._classes is not None:
+            self._count_bins(zones, self._classes.class_index(values))
+        elif self.categories is not None:
+            ints = values.astype(np.int64)
+            found = np.unique(ints)
+            if not np.isin(found, self.categories).all():
+                self._add_categories(found)
+            self._count_bins(zones, np.searchsorted(self.categories, ints))
+
+    def _add_categories(self, found):
+        categories = np.union1d(self.categories, found)
+        if len(categories) > self.max_categories:
+            raise ZonalStatsError(
+                f"More than {self.max_categories} distinct values; a 'values' histogram needs a categorical raster"
+            )
+        histogram = np.zeros((len(self.count), len(categories)), dtype=np.int64)
+        histogram[:, np.searchsorted(categories, self.categories)] = self.histogram
+        self.categories = categories
+        self.histogram = histogram
+
+    def _count_bins(self, zones, bins):
+        width = self.histogram.shape[1]
+        keep = bins >= 0
+        self.histogram += np.bincount(
+            zones[keep] * width + bins[keep], minlength=self.histogram.size
+        ).reshape(self.histogram.shape)
+
+    def bin_labels(self, names=None):
+        """Histogram bin names: class labels, or the integer values (named through names)"""
+        if self._classes is not None:
+            return [label for label, _, _ in self._classes.classes]
+        if self.categories is not None:
+            return [(names or {}).get(int(value), str(int(value))) for value in self.categories]
+        return []
+
+    def zone(self, zone_id):
+        """{count, mean, min, max, std} of one zone (1-based); None values for an empty zone"""
+        count = int(self.count[zone_id])
+        if not count:
+            return {"count": 0, "mean": None, "min": None, "max": None, "std": None}
+        return {
+            "count": count,
+            "mean": float(self.mean[zone_id]),
+            "min": float(self.min[zone_id]),
+            "max": float(self.max[zone_id]),
+            "std": float(np.sqrt(self.m2[zone_id] / count))
+        }
+
+
+def _traditional_srs(srs):
+    # x/y (lon/lat) axis order whatever the authority says, as in the rest of the pipeline
+    srs = srs.Clone()
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def _transform(source_srs, target_srs):
+    if source_srs is None or target_srs is None or source_srs.IsSame(target_srs):
+        return None
+    return osr.CoordinateTransformation(source_srs, target_srs)
+
+
+def histogram_mode(histogram, product_name):
+    """Resolve "auto" from the product prefix (ndvi_*, lst_*, LULC_* ...) and validate the rest"""
+    histogram = (histogram or "auto").lower()
+    if histogram not in ZONAL_HISTOGRAMS:
+        raise ZonalStatsError(f"histogram must be one of: {', '.join(ZONAL_HISTOGRAMS)}")
+    if histogram != "auto":
+        return histogram
+    prefix = os.path.basename(product_name or "").split("_")[0].split(".")[0].lower()
+    if prefix == "lulc":
+        return "lulc"
+    return prefix if prefix in CLASS_TABLES else "none"
+
+
+def _pixel_window(envelope, geotransform, xsize, ysize):
+    """(xoff, yoff, width, height) of the raster pixels under an (minx, maxx, miny, maxy) envelope"""
+    minx, maxx, miny, maxy = envelope
+    cols = sorted(((minx - geotransform[0]) / geotransform[1], (maxx - geotransform[0]) / geotransform[1]))
+    rows = sorted(((maxy - geotransform[3]) / geotransform[5], (miny - geotransform[3]) / geotransform[5]))
+    x0 = min(max(int(math.floor(cols[0])), 0), xsize)
+    x1 = min(max(int(math.ceil(cols[1])), 0), xsize)
+    y0 = min(max(int(math.floor(rows[0])), 0), ysize)
+    y1 = min(max(int(math.ceil(rows[1])), 0), ysize)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def read_zones(zones_path, raster_srs):
+    """Features of the zone layer as (attributes, GeoJSON geometry in WGS84), plus an in-memory
+    copy of the polygons in the raster CRS, each carrying its 1-based zone id, and their envelope.
+    """
+    source = aoi_source(zones_path)
+    vector_ds = ogr.Open(source)
+    if vector_ds is None or vector_ds.GetLayerCount() == 0:
+        raise ZonalStatsError(f"Could not open zone layer {os.path.basename(zones_path)}")
+    layer = vector_ds.GetLayer(0)
+
+    layer_srs = layer.GetSpatialRef()
+    layer_srs = _traditional_srs(layer_srs) if layer_srs is not None else raster_srs
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    wgs84 = _traditional_srs(wgs84)
+    to_raster = _transform(layer_srs, raster_srs)
+    to_wgs84 = _transform(layer_srs, wgs84)
+
+    memory_ds = ogr.GetDriverByName("Memory").CreateDataSource(f"zones_{new_token()}")
+    memory_layer = memory_ds.CreateLayer("zones", srs=raster_srs, geom_type=ogr.wkbUnknown)
+    memory_layer.CreateField(ogr.FieldDefn("zone", ogr.OFTInteger))
+
+    fields = [layer.GetLayerDefn().GetFieldDefn(i).GetName() for i in range(layer.GetLayerDefn().GetFieldCount())]
+    features = []
+    envelope = None
+    for zone_id, feature in enumerate(layer, 1):
+        geometry = feature.GetGeometryRef()
+        geojson = None
+        if geometry is not None:
+            in_raster = geometry.Clone()
+            if to_raster is not None:
+                in_raster.Transform(to_raster)
+            zone = ogr.Feature(memory_layer.GetLayerDefn())
+            zone.SetField("zone", zone_id)
+            zone.SetGeometry(in_raster)
+            memory_layer.CreateFeature(zone)
+
+            minx, maxx, miny, maxy = in_raster.GetEnvelope()
+            envelope = (minx, maxx, miny, maxy) if envelope is None else (
+                min(envelope[0], minx), max(envelope[1], maxx), min(envelope[2], miny), max(envelope[3], maxy)
+            )
+            in_wgs84 = geometry.Clone()
+            if to_wgs84 is not None:
+                in_wgs84.Transform(to_wgs84)
+            geojson = json.loads(in_wgs84.ExportToJson())
+        features.append(({name: feature.GetField(name) for name in fields}, geojson))
+
+    vector_ds = None
+    if not features:
+        raise ZonalStatsError("The zone layer has no features")
+    return features, fields, memory_ds, memory_layer, envelope
+
+
+def zonal_statistics(raster_path, zones_path, histogram="auto", all_touched=False, product_name=None,
+                     block_size=BLOCK_SIZE, progress=None):
+    """Statistics of band 1 of a raster for every feature of a polygon layer.
+
+    The zones are burnt once into an Int32 raster on the raster's own grid (restricted to the
+    window they cover), then both are read block by block and every zone is updated from each
+    block in one bincount pass. Where polygons overlap, the later feature owns the pixel.
+    Returns ([(attributes, geometry, stats)], attribute names, histogram bin labels).
+    """
+    raster_ds = gdal.Open(raster_path)
+    if raster_ds is None:
+        raise ZonalStatsError(f"Could not open raster {os.path.basename(raster_path)}")
+    band = raster_ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    geotransform = raster_ds.GetGeoTransform()
+    projection = raster_ds.GetProjection()
+    raster_srs = None
+    if projection:
+        raster_srs = osr.SpatialReference()
+        raster_srs.ImportFromWkt(projection)
+        raster_srs = _traditional_srs(raster_srs)
+
+    mode = histogram_mode(histogram, product_name or raster_path)
+    if mode in ("values", "lulc") and gdal.GetDataTypeName(band.DataType).startswith("Float"):
+        raise ZonalStatsError(f"A '{mode}' histogram needs an integer raster")
+
+    features, fields, memory_ds, memory_layer, envelope = read_zones(zones_path, raster_srs)
+    accumulator = ZonalAccumulator(
+        len(features), classes=CLASS_TABLES.get(mode), values=mode in ("values", "lulc")
+    )
+
+    xoff, yoff, width, height = (
+        _pixel_window(envelope, geotransform, raster_ds.RasterXSize, raster_ds.RasterYSize)
+        if envelope is not None else (0, 0, 0, 0)
+    )
+    zone_path = f"/vsimem/zones_{new_token()}.tif"
+    zone_ds = None
+    try:
+        if width > 0 and height > 0:
+            zone_ds = gdal.GetDriverByName("GTiff").Create(
+                zone_path, width, height, 1, gdal.GDT_Int32,
+                options=["TILED=YES", f"BLOCKXSIZE={BLOCK_SIZE}", f"BLOCKYSIZE={BLOCK_SIZE}", "COMPRESS=DEFLATE"]
+            )
+            zone_ds.SetGeoTransform((
+                geotransform[0] + xoff * geotransform[1] + yoff * geotransform[2], geotransform[1], geotransform[2],
+                geotransform[3] + xoff * geotransform[4] + yoff * geotransform[5], geotransform[4], geotransform[5]
+            ))
+            if projection:
+                zone_ds.SetProjection(projection)
+            options = ["ATTRIBUTE=zone"] + (["ALL_TOUCHED=TRUE"] if all_touched else [])
+            err = gdal.RasterizeLayer(zone_ds, [1], memory_layer, options=options,
+                                      callback=gdal_callback(span(progress, 0.0, 0.2), "rasterizing zones"))
+            if progress is not None:
+                progress.check()
+            if err != 0:
+                raise RuntimeError(f"RasterizeLayer returned error {err}")
+
+            zone_band = zone_ds.GetRasterBand(1)
+            windows = list(iter_windows(width, height, block_size))
+            for done, (x, y, w, h) in enumerate(windows, 1):
+                zones = zone_band.ReadAsArray(x, y, w, h).ravel()
+                inside = zones > 0
+                if inside.any():
+                    values = band.ReadAsArray(xoff + x, yoff + y, w, h).ravel()
+                    valid = inside
+                    if values.dtype.kind == "f":
+                        valid &= np.isfinite(values)
+                    if nodata is not None:
+                        valid &= values != nodata
+                    accumulator.update(zones[valid].astype(np.intp), values[valid])
+                if progress is not None and not progress.update(0.2 + 0.8 * done / len(windows), "zonal statistics"):
+                    raise OperationCancelled("Operation cancelled")
+    finally:
+        zone_ds = None
+        memory_ds = None
+        gdal.Unlink(zone_path)
+        raster_ds = None
+
+    labels = accumulator.bin_labels(LULC_CLASSES if mode == "lulc" else None)
+    rows = []
+    for zone_id, (attributes, geometry) in enumerate(features, 1):
+        stats = accumulator.zone(zone_id)
+        if labels:
+            stats["histogram"] = {label: int(count) for label, count in zip(labels, accumulator.histogram[zone_id])}
+        rows.append((attributes, geometry, stats))
+    return rows, fields, labels
+
+
+def _flat_properties(attributes, stats, labels):
+    # Statistics win over same-named attributes; histogram bins become hist_<label> columns
+    properties = dict(attributes)
+    properties.update({name: stats[name] for name in ZONE_STATISTICS})
+    for label in labels:
+        properties[f"hist_{label}"] = stats["histogram"][label]
+    return properties
+
+
+def write_zonal_geojson(path, rows, labels):
+    """FeatureCollection of the zone polygons (WGS84) with the statistics as properties"""
+    with open(path, "w") as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        for index, (attributes, geometry, stats) in enumerate(rows):
+            feature = {
+                "type": "Feature",
+                "id": index + 1,
+                "properties": _flat_properties(attributes, stats, labels),
+                "geometry": geometry
+            }
+            f.write(("," if index else "") + "\n" + json.dumps(feature, default=str))
+        f.write("\n]}\n")
+
+
+def write_zonal_csv(path, rows, fields, labels):
+    """One row per zone: zone id, the layer attributes, the statistics and the histogram columns"""
+    columns = ["zone"] + [name for name in fields if name not in ZONE_STATISTICS + ("zone",)] + list(ZONE_STATISTICS)
+    columns += [f"hist_{label}" for label in labels]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for zone_id, (attributes, _, stats) in enumerate(rows, 1):
+            writer.writerow({**_flat_properties(attributes, stats, labels), "zone": zone_id})
+
+
+def zonal_stats_service(raster_path, zones_path, output_format="geojson", histogram="auto", all_touched=False,
+                        product_name=None, output_folder=OUTPUT_FOLDER, progress=None):
+    """Per-feature raster statistics joined to the zone layer, written as GeoJSON or CSV"""
+    if output_format not in ZONAL_FORMATS:
+        return {"error": f"output_format must be one of: {', '.join(ZONAL_FORMATS)}"}, 400
+    for path in (raster_path, zones_path):
+        if not os.path.exists(path):
+            return {"error": f"Input not found: {os.path.basename(path)}"}, 400
+
+    try:
+        rows, fields, labels = zonal_statistics(
+            raster_path, zones_path, histogram=histogram, all_touched=all_touched,
+            product_name=product_name, progress=progress
+        )
+        output_path = unique_output_path("zonal", product_name or raster_path, f".{output_format}",
+                                         folder=output_folder)
+        # Written under a private name and renamed into place once complete
+        with atomic_path(output_path) as work_path:
+            if output_format == "geojson":
+                write_zonal_geojson(work_path, rows, labels)
+            else:
+                write_zonal_csv(work_path, rows, fields, labels)
+    except (ZonalStatsError, AOIError) as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        logger.error(f"Zonal statistics failed for {os.path.basename(raster_path)}: {e}")
+        return {"error": f"Zonal statistics failed: {str(e)}"}, 500
+
+    return {
+        "success": True,
+        "output_path": output_path,
+        "zones": len(rows),
+        "zones_with_data": sum(1 for _, _, stats in rows if stats["count"]),
+        "histogram": labels,
+        "metadata": {
+            "raster": os.path.basename(product_name or raster_path),
+            "statistics": list(ZONE_STATISTICS),
+            "all_touched": all_touched,
+            "crs": _crs_name(gdal.Open(raster_path).GetProjection())
+        }
+    }, 200